@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the :class:`~matchpy.matching.bipartite.BipartiteGraph`.
+
+Run this script directly to time finding maximum matchings in bipartite graphs::
+
+    python benchmarks/bench_bipartite.py
+"""
+import random
+import timeit
+
+from matchpy.matching.bipartite import BipartiteGraph, enum_maximum_matchings_iter, _DirectedMatchGraph
+
+
+def random_graph(size, degree, seed=0):
+    rng = random.Random(seed)
+    return BipartiteGraph(((l, r), True) for l in range(size) for r in rng.sample(range(size), degree))
+
+
+def bench_find_matching(size=300, degree=5, number=5, repeat=5):
+    """Find a maximum matching in a sparse random graph from scratch."""
+    edges = dict(random_graph(size, degree).edges_with_labels())
+    return min(timeit.repeat(lambda: BipartiteGraph(edges).find_matching(), number=number, repeat=repeat))
+
+
+def bench_find_matching_incremental(size=300, degree=5, changes=20, number=5, repeat=5):
+    """Find maximum matchings in a graph from which edges are removed one at a time."""
+    graph = random_graph(size, degree)
+
+    def run():
+        graph.find_matching()
+        removed = []
+        for edge in list(graph.edges())[:changes]:
+            removed.append((edge, graph[edge]))
+            del graph[edge]
+            graph.find_matching()
+        for edge, value in removed:
+            graph[edge] = value
+
+    return min(timeit.repeat(run, number=number, repeat=repeat))
+
+
+def bench_enum_complete(left=7, right=4, number=1, repeat=5):
+    """Enumerate all maximum matchings of a complete bipartite graph, i.e. with interchangeable nodes."""
+    edges = dict(((l, r), True) for l in range(left) for r in range(right))
+    graph = BipartiteGraph(edges)
+    return min(timeit.repeat(lambda: sum(1 for _ in enum_maximum_matchings_iter(graph)), number=number, repeat=repeat))
+
+
+def bench_enum_sparse(size=40, count=256, number=1, repeat=5):
+    """Enumerate maximum matchings of a graph where many edges are not part of any maximum matching.
+
+    The nodes form pairs which are completely connected, so that every pair can be matched in two ways. In addition,
+    the left nodes of every pair are connected to the right nodes of the next pair, but these edges cannot be part of
+    a maximum matching, because the last pair has no next pair to compensate.
+    """
+    edges = {}
+    for l in range(size):
+        pair = l - l % 2
+        for r in range(pair, min(pair + 4, size)):
+            edges[l, r] = True
+    graph = BipartiteGraph(edges)
+    enumerate_some = lambda: sum(1 for _, _ in zip(range(count), enum_maximum_matchings_iter(graph)))
+    return min(timeit.repeat(enumerate_some, number=number, repeat=repeat))
+
+
+def bench_find_cycle(size=500, number=5, repeat=5):
+    """Find the cycle in the directed match graph of a graph that consists of a long alternating path.
+
+    Left node i is matched with right node i and also connected to right node i + 1. Only the last left node is
+    connected back to the first right node, so the depth-first search has to follow the whole path.
+    """
+    edges = dict(((l, r % size), True) for l in range(size) for r in (l, l + 1))
+    graph = BipartiteGraph(edges)
+    directed_match_graph = _DirectedMatchGraph(graph, dict((i, i) for i in range(size)))
+    return min(timeit.repeat(directed_match_graph.find_cycle, number=number, repeat=repeat))
+
+
+def main():
+    benches = [
+        ('find_matching', bench_find_matching), ('incremental', bench_find_matching_incremental),
+        ('enum_complete', bench_enum_complete), ('enum_sparse', bench_enum_sparse), ('find_cycle', bench_find_cycle)
+    ]
+    for name, bench in benches:
+        print('{:<18}{:8.3f}s'.format(name, bench()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the :class:`~matchpy.matching.many_to_one.ManyToOneMatcher`.
+
+Run this script directly to time matching against deeply nested and very wide subjects::
+
+    python benchmarks/bench_many_to_one.py
+"""
+import timeit
+
+from matchpy import (
+    Operation, Symbol, Arity, Wildcard, Pattern, ManyToOneMatcher, SubjectIndex, match_anywhere, TermIndex,
+    ReplacementRule, ManyToOneReplacer, minimise_rules
+)
+
+f = Operation.new('f', Arity.variadic)
+g = Operation.new('g', Arity.unary)
+a = Symbol('a')
+b = Symbol('b')
+x_ = Wildcard.dot('x')
+y_ = Wildcard.dot('y')
+xs = Wildcard.star('xs')
+ys = Wildcard.star('ys')
+
+
+def nest(expression, depth):
+    for _ in range(depth):
+        expression = g(expression)
+    return expression
+
+
+def bench_deep(depth=150, width=40, number=5, repeat=5):
+    """Match sequence variables inside a deeply nested chain of unary operations.
+
+    Every match is found at the bottom of the chain, so it has to be passed up through all the nesting levels.
+    """
+    matcher = ManyToOneMatcher(Pattern(nest(f(xs, ys), depth)), Pattern(nest(f(xs, a, ys), depth)))
+    subject = nest(f(*([a] * width)), depth)
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def bench_wide(width=200, number=5, repeat=5):
+    """Match sequence variable patterns against a very wide operation."""
+    matcher = ManyToOneMatcher(Pattern(f(xs, a, ys)), Pattern(f(xs, b, ys)), Pattern(f(x_, ys, y_)))
+    subject = f(*([a, b] * (width // 2)))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def bench_many(count=300, number=5, repeat=5):
+    """Match a subject against many patterns that share a common prefix."""
+    symbols = [Symbol('s{}'.format(i)) for i in range(count)]
+    matcher = ManyToOneMatcher(*(Pattern(f(x_, g(s), ys)) for s in symbols))
+    matcher.freeze()
+    subject = f(a, g(symbols[-1]), *([b] * 20))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number * 20, repeat=repeat))
+
+
+def document(sections=200):
+    """A large subject in which only a few subexpressions have the heads of the patterns."""
+    h = Operation.new('h', Arity.binary)
+    return f(*(f(a, b, *(f(a, b) for _ in range(10)), h(a, g(b))) for _ in range(sections)))
+
+
+def bench_anywhere(sections=200, number=1, repeat=5):
+    """Search a large subject for the matches of multiple patterns with the subject index."""
+    h = Operation.new('h', Arity.binary)
+    patterns = [Pattern(h(x_, g(y_))), Pattern(h(a, x_)), Pattern(g(a))]
+    subject = document(sections)
+
+    def search():
+        index = SubjectIndex(subject)
+        for pattern in patterns:
+            list(match_anywhere(index, pattern))
+
+    return min(timeit.repeat(search, number=number, repeat=repeat))
+
+
+def commutative_tree(depth):
+    fc = Operation.new('fc', Arity.variadic, commutative=True)
+    if depth == 0:
+        return fc(a, b, g(b))
+    return fc(g(commutative_tree(depth - 1)), g(a), commutative_tree(depth - 1), b)
+
+
+def bench_matcher_anywhere(depth=7, number=1, repeat=5):
+    """Match commutative patterns against every subexpression of a nested commutative subject."""
+    fc = Operation.new('fc', Arity.variadic, commutative=True)
+    matcher = ManyToOneMatcher(
+        Pattern(fc(g(x_), b, xs)), Pattern(fc(g(a), g(fc(x_, xs)), xs)), Pattern(g(fc(a, xs)))
+    )
+    subject = commutative_tree(depth)
+    return min(timeit.repeat(lambda: list(matcher.match_anywhere(subject)), number=number, repeat=repeat))
+
+
+def bench_term_index(count=2000, number=5, repeat=5):
+    """Retrieve the stored terms that match some patterns from a large term index."""
+    symbols = [Symbol('s{}'.format(i)) for i in range(count // 10)]
+    index = TermIndex(*(f(s, g(t)) for s in symbols for t in symbols[:10]))
+    patterns = [Pattern(f(symbols[1], g(x_))), Pattern(f(x_, g(symbols[2]))), Pattern(f(x_, g(x_)))]
+    return min(
+        timeit.repeat(
+            lambda: [list(index.instances(pattern)) for pattern in patterns], number=number, repeat=repeat
+        )
+    )
+
+
+def bench_repeated_subjects(count=6, number=5, repeat=5):
+    """Match commutative patterns against subjects in which the same operands occur many times."""
+    fc = Operation.new('fc', Arity.variadic, commutative=True)
+    matcher = ManyToOneMatcher(Pattern(fc(x_, x_, y_, y_, xs)), Pattern(fc(g(x_), g(x_), a, a, xs)))
+    subject = fc(*([a] * count + [b] * count + [g(a)] * count + [g(b)] * 2))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def bench_anonymous_subpatterns(count=5, number=5, repeat=5):
+    """Match a commutative pattern with many different anonymous subpatterns against subjects that occur many times.
+
+    Most assignments of the subjects to the subpatterns only differ in which of the anonymous subpatterns the subjects
+    are assigned to.
+    """
+    fc = Operation.new('fc', Arity.variadic, commutative=True)
+    h = Operation.new('h', Arity.binary)
+    c = Symbol('c')
+    _ = Wildcard.dot()
+    matcher = ManyToOneMatcher(Pattern(fc(*([h(_, _), h(a, _), h(_, b), h(_, c), h(c, _)] * 2), xs)))
+    subject = fc(*([h(a, b)] * count + [h(a, c)] * count + [h(c, b)] * count + [h(c, c)] * count))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def bench_shared_variables(count=8, number=5, repeat=5):
+    """Match a commutative pattern whose commutative subpatterns share a variable.
+
+    Every subject can be matched to every subpattern in many ways, but most combinations of them bind the shared
+    variable to different values.
+    """
+    plus = Operation.new('plus', Arity.variadic, commutative=True)
+    times = Operation.new('times', Arity.variadic, commutative=True)
+    zs = Wildcard.star('zs')
+    ws = Wildcard.star('ws')
+    symbols = [Symbol('s{}'.format(i)) for i in range(count)]
+    matcher = ManyToOneMatcher(Pattern(plus(times(x_, ys), times(x_, zs), times(x_, ws), xs)))
+    subject = plus(*(times(Symbol('t{}'.format(i)), *symbols[i:]) for i in range(4)))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def redundant_rules(count=100):
+    """Rules with general patterns followed by many specialisations of them."""
+    symbols = [Symbol('s{}'.format(i)) for i in range(count)]
+    rules = [ReplacementRule(Pattern(f(s, xs)), lambda xs: a) for s in symbols[::2]]
+    rules.extend(ReplacementRule(Pattern(f(s, g(t), xs)), lambda xs: b) for s in symbols for t in symbols[:5])
+    return rules
+
+
+def bench_minimise(count=100, number=1, repeat=5):
+    """Minimise a redundant rule set and build a replacer from the remaining rules."""
+    rules = redundant_rules(count)
+    return min(timeit.repeat(lambda: ManyToOneReplacer(*minimise_rules(rules)), number=number, repeat=repeat))
+
+
+def bench_no_minimise(count=100, number=1, repeat=5):
+    """Build a replacer from a redundant rule set without minimising it first."""
+    rules = redundant_rules(count)
+    return min(timeit.repeat(lambda: ManyToOneReplacer(*rules), number=number, repeat=repeat))
+
+
+def main():
+    benches = [
+        ('deep', bench_deep), ('wide', bench_wide), ('many', bench_many), ('anywhere', bench_anywhere),
+        ('matcher_anywhere', bench_matcher_anywhere), ('repeated_subjects', bench_repeated_subjects),
+        ('anonymous_subpatterns', bench_anonymous_subpatterns), ('shared_variables', bench_shared_variables),
+        ('term_index', bench_term_index),
+        ('minimise', bench_minimise), ('no_minimise', bench_no_minimise)
+    ]
+    for name, bench in benches:
+        print('{:<22}{:8.3f}s'.format(name, bench()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for applying replacement rules with :func:`~matchpy.functions.replace_all` and the
+:class:`~matchpy.matching.many_to_one.ManyToOneReplacer`, and with the :mod:`~matchpy.strategies`.
+
+Run this script directly to time the replacement::
+
+    python benchmarks/bench_replace.py
+"""
+import timeit
+
+from matchpy import (
+    Operation, Symbol, Arity, Wildcard, Pattern, ReplacementRule, replace_all, ManyToOneReplacer, Innermost,
+    ReplacementTemplate, substitute, replace_many
+)
+
+f = Operation.new('f', Arity.variadic)
+g = Operation.new('g', Arity.variadic)
+u = Operation.new('u', Arity.unary)
+a = Symbol('a')
+b = Symbol('b')
+x_ = Wildcard.dot('x')
+y_ = Wildcard.dot('y')
+
+RULES = [ReplacementRule(Pattern(u(x_)), lambda x: x)]
+
+# Rules for operations that do not occur in the subject followed by the rule that does the work
+MANY_RULES = [
+    ReplacementRule(Pattern(Operation.new('h{}'.format(i), Arity.variadic)(x_, a)), lambda x: x) for i in range(50)
+] + RULES
+
+
+def wide_subject(width):
+    return f(*(g(u(a), b) for _ in range(width)))
+
+
+def bench_replace_all(width=300, number=1, repeat=5):
+    """Remove many unary wrappers scattered over a wide expression."""
+    subject = wide_subject(width)
+    return min(timeit.repeat(lambda: replace_all(subject, RULES), number=number, repeat=repeat))
+
+
+def bench_replace_all_many_rules(width=300, number=1, repeat=5):
+    """Remove many unary wrappers with a rule that comes after many rules which never match."""
+    subject = wide_subject(width)
+    return min(timeit.repeat(lambda: replace_all(subject, MANY_RULES), number=number, repeat=repeat))
+
+
+def bench_many_to_one_replacer(width=300, number=1, repeat=5):
+    """Remove many unary wrappers scattered over a wide expression."""
+    replacer = ManyToOneReplacer(*RULES)
+    subject = wide_subject(width)
+    return min(timeit.repeat(lambda: replacer.replace(subject), number=number, repeat=repeat))
+
+
+def bench_innermost(width=300, number=1, repeat=5):
+    """Remove many unary wrappers scattered over a wide expression with the innermost strategy."""
+    strategy = Innermost(RULES)
+    subject = wide_subject(width)
+    return min(timeit.repeat(lambda: strategy(subject), number=number, repeat=repeat))
+
+
+def bench_replace_many(width=300, number=1, repeat=5):
+    """Replace all unary wrappers of a wide expression at once."""
+    subject = wide_subject(width)
+    replacements = [((i, 0), [a, b]) for i in range(width)]
+    return min(timeit.repeat(lambda: replace_many(subject, replacements), number=number, repeat=repeat))
+
+
+def template_expression():
+    return f(g(x_, f(a, b, g(a, a, b))), g(y_, a), f(a, g(b, b), g(a, f(b))), x_)
+
+
+def bench_substitute(number=20000, repeat=5):
+    """Substitute the variables of a replacement expression with constant parts."""
+    expression = template_expression()
+    substitution = {'x': u(a), 'y': g(b)}
+    return min(timeit.repeat(lambda: substitute(expression, substitution), number=number, repeat=repeat))
+
+
+def bench_template(number=20000, repeat=5):
+    """Substitute the variables of a replacement expression with constant parts using a compiled template."""
+    template = ReplacementTemplate(template_expression())
+    substitution = {'x': u(a), 'y': g(b)}
+    return min(timeit.repeat(lambda: template.substitute(substitution), number=number, repeat=repeat))
+
+
+def main():
+    benches = [
+        ('replace_all', bench_replace_all),
+        ('many_rules', bench_replace_all_many_rules),
+        ('many_to_one', bench_many_to_one_replacer),
+        ('innermost', bench_innermost),
+        ('replace_many', bench_replace_many),
+        ('substitute', bench_substitute),
+        ('template', bench_template),
+    ]
+    for name, bench in benches:
+        print('{:<14}{:8.3f}s'.format(name, bench()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the :class:`~matchpy.matching.syntactic.DiscriminationNet` and
+:class:`~matchpy.matching.syntactic.SequenceMatcher`.
+
+Run this script directly to time matching the same subjects repeatedly::
+
+    python benchmarks/bench_syntactic.py
+"""
+import timeit
+
+from matchpy import Operation, Symbol, Arity, Wildcard, Pattern
+from matchpy.matching.syntactic import DiscriminationNet, SequenceMatcher
+
+f = Operation.new('f', Arity.variadic)
+g = Operation.new('g', Arity.unary)
+h = Operation.new('h', Arity.variadic)
+a = Symbol('a')
+b = Symbol('b')
+_ = Wildcard.dot()
+x_ = Wildcard.dot('x')
+xs = Wildcard.star('xs')
+ys = Wildcard.star('ys')
+
+
+def bench_net(count=50, width=30, number=20, repeat=5):
+    """Match subjects with large operands that the patterns skip with a wildcard against a discrimination net."""
+    symbols = [Symbol('s{}'.format(i)) for i in range(count)]
+    net = DiscriminationNet(*(Pattern(f(s, _, g(x_))) for s in symbols))
+    subjects = [f(s, h(*([g(a), b] * width)), g(b)) for s in symbols]
+    return min(
+        timeit.repeat(
+            lambda: [list(net.matching_labels(subject)) for subject in subjects], number=number, repeat=repeat
+        )
+    )
+
+
+def bench_sequence(width=40, number=5, repeat=5):
+    """Match a long sequence of operands against patterns with a common surrounding operation."""
+    matcher = SequenceMatcher(Pattern(f(xs, g(a), b, ys)), Pattern(f(xs, g(x_), g(b), ys)))
+    subject = f(*([g(a), b, g(a), g(b)] * width))
+    return min(timeit.repeat(lambda: list(matcher.match(subject)), number=number, repeat=repeat))
+
+
+def bench_long_sequence(width=500, number=1, repeat=5):
+    """Match a sequence with thousands of operands against patterns with a common surrounding operation."""
+    return bench_sequence(width, number, repeat)
+
+
+def main():
+    benches = [('net', bench_net), ('sequence', bench_sequence), ('long_sequence', bench_long_sequence)]
+    for name, bench in benches:
+        print('{:<22}{:8.3f}s'.format(name, bench()))
+
+
+if __name__ == '__main__':
+    main()
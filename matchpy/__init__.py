@@ -6,10 +6,12 @@ from . import expressions
 from . import functions
 from . import utils
 from . import matching
+from . import strategies
 
 from .expressions import *
 from .functions import *
 from .utils import *
 from .matching import *
+from .strategies import *
 
-__all__ = expressions.__all__ + functions.__all__ + utils.__all__ + matching.__all__
+__all__ = expressions.__all__ + functions.__all__ + utils.__all__ + matching.__all__ + strategies.__all__
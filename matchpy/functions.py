@@ -2,27 +2,44 @@
 """This module contains various functions for working with expressions.
 
 - With `substitute()` you can replace occurrences of variables with an expression or sequence of expressions.
+- With `ReplacementTemplate` you can compile an expression once to substitute its variables repeatedly.
 - With `replace()` you can replace a subexpression at a specific position with a different expression or
   sequence of expressions.
 - With `replace_many()` works the same as `replace()`, but you can replace multiple positions at once.
 - With `replace_all()` you can apply a set of replacement rules repeatedly to an expression.
+- With `ReplacementRuleIndex` you can index a set of replacement rules once to reuse it for multiple replacements.
+- With `NormalFormCache` you can remember the results of `replace_all_post_order()` for recurring subexpressions.
+- With `replace_all_bounded()` and `replace_all_post_order_bounded()` you can limit the rewriting with a
+  `RewriteBudget`.
+- With `RewriteTrace` you can record which rules `replace_all()` applied and where.
+- With `minimise_rules()` you can drop the rules that are never applied because an earlier rule is more general.
 - With `is_match()` you can check whether a pattern matches a subject expression.
 """
 
-import itertools
 import math
-from typing import Callable, List, NamedTuple, Sequence, Tuple, Union, Iterable
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union, Iterable
 
 from multiset import Multiset
 
 from .expressions.expressions import (
-    Expression, Operation, Pattern, Wildcard, SymbolWildcard, AssociativeOperation, CommutativeOperation
+    Expression, Operation, Pattern, Symbol, Wildcard, SymbolWildcard, AssociativeOperation, CommutativeOperation,
+    OneIdentityOperation
 )
 from .expressions.substitution import Substitution
-from .expressions.functions import preorder_iter_with_position, create_operation_expression, op_iter, op_len
+from .expressions.functions import (
+    create_operation_expression, op_iter, op_len, get_head
+)
 from .matching.one_to_one import match
+from .matching.term_index import GeneralisationIndex
 
-__all__ = ['substitute', 'replace', 'replace_all', 'replace_many', 'is_match', 'ReplacementRule', 'replace_all_post_order']
+__all__ = [
+    'substitute', 'replace', 'replace_all', 'replace_many', 'is_match', 'ReplacementRule', 'replace_all_post_order',
+    'NormalFormCache', 'ReplacementRuleIndex', 'RewriteBudget', 'RewriteResult', 'StopReason', 'replace_all_bounded',
+    'replace_all_post_order_bounded', 'RewriteTrace', 'TraceStep', 'ReplacementTemplate', 'minimise_rules'
+]
 
 Replacement = Union[Expression, List[Expression]]
 
@@ -63,6 +80,9 @@ def substitute(expression: Union[Expression, Pattern], substitution: Substitutio
             the value either an expression or a list of expression to use as a replacement for
             the variable.
 
+    If the same expression is substituted many times, e.g. in the replacement of a rule, compile it into a
+    `ReplacementTemplate` instead.
+
     Returns:
         The expression resulting from applying the substitution.
     """
@@ -93,6 +113,120 @@ def _substitute(expression: Expression, substitution: Substitution) -> Tuple[Rep
     return expression, False
 
 
+class ReplacementTemplate:
+    """An expression with variables that is compiled to substitute them repeatedly.
+
+    The result of substituting the template is the same as with `substitute()`:
+
+    >>> template = ReplacementTemplate(f(x_, f(a, b), y_))
+    >>> print(template.substitute({'x': c, 'y': [a, b]}))
+    f(c, f(a, b), a, b)
+
+    When the template is compiled, every subexpression without variables is found, so that it can be shared as-is
+    between all results without looking at it again. For the other subexpressions, the positions of the variables
+    and how to create a copy of the operation are determined once.
+
+    Calling the template with the substitution as keyword arguments also substitutes it. Hence, a template can be
+    used as the replacement of a `ReplacementRule`:
+
+    >>> rule = ReplacementRule(Pattern(f(a, x_, y_)), ReplacementTemplate(f(y_, x_)))
+    >>> print(replace_all(f(a, b, c), [rule]))
+    f(c, b)
+    """
+
+    def __init__(self, expression: Union[Expression, Pattern]) -> None:
+        """
+        Args:
+            expression:
+                The expression in which variables are substituted.
+        """
+        if isinstance(expression, Pattern):
+            expression = expression.expression
+        self.expression = expression
+        self._substitute = _compile_substitution(expression)
+
+    def substitute(self, substitution: Substitution) -> Replacement:
+        """Replace the variables of the template like `substitute()` does.
+
+        Args:
+            substitution:
+                A substitution dictionary which maps variable names to their replacements.
+
+        Returns:
+            The expression resulting from applying the substitution.
+        """
+        if self._substitute is None:
+            return self.expression
+        return self._substitute(substitution)[0]
+
+    def __call__(self, **substitution) -> Replacement:
+        return self.substitute(substitution)
+
+    def __repr__(self):
+        return '{!s}({!r})'.format(type(self).__name__, self.expression)
+
+
+def _compile_substitution(expression: Expression) -> Optional[Callable[[Substitution], Tuple[Replacement, bool]]]:
+    """Compile the expression into a function which returns the same as `_substitute` for a substitution.
+
+    Returns None if the expression does not contain any variables, i.e. it is never changed by a substitution.
+    """
+    variable_name = getattr(expression, 'variable_name', None)
+    if not isinstance(expression, Operation):
+        if not variable_name:
+            return None
+
+        def substitute_variable(substitution):
+            if variable_name in substitution:
+                return substitution[variable_name], True
+            return expression, False
+
+        return substitute_variable
+
+    # The operands as triples of the operand, the name of the operand if it is not an operation and a variable,
+    # and the compiled substitution otherwise (or None, if the operand is constant)
+    operands = []
+    for operand in op_iter(expression):
+        if isinstance(operand, Operation):
+            operands.append((operand, None, _compile_substitution(operand)))
+        else:
+            operands.append((operand, getattr(operand, 'variable_name', None), None))
+    if not variable_name and all(name is None and compiled is None for _, name, compiled in operands):
+        return None
+
+    def substitute_operation(substitution):
+        if variable_name and variable_name in substitution:
+            return substitution[variable_name], True
+        any_replaced = False
+        new_operands = []
+        for operand, name, compiled in operands:
+            if name is not None:
+                if name not in substitution:
+                    new_operands.append(operand)
+                    continue
+                result = substitution[name]
+            elif compiled is not None:
+                result, replaced = compiled(substitution)
+                if not replaced:
+                    new_operands.append(operand)
+                    continue
+            else:
+                new_operands.append(operand)
+                continue
+            any_replaced = True
+            if isinstance(result, (list, tuple)):
+                new_operands.extend(result)
+            elif isinstance(result, Multiset):
+                new_operands.extend(sorted(result))
+            else:
+                new_operands.append(result)
+        if any_replaced:
+            return create_operation_expression(expression, new_operands), True
+        return expression, False
+
+    return substitute_operation
+
+
 def replace(expression: Expression, position: Sequence[int], replacement: Replacement) -> Replacement:
     r"""Replaces the subexpression of `expression` at the given `position` with the given `replacement`.
 
@@ -178,41 +312,447 @@ def replace_many(expression: Expression, replacements: Sequence[Tuple[Sequence[i
     """
     if len(replacements) == 0:
         return expression
-    replacements = sorted(replacements)
-    if len(replacements[0][0]) == 0:
-        if len(replacements) > 1:
+    if len(replacements) == 1:
+        position, replacement = replacements[0]
+        return replace(expression, position, replacement)
+    root = _ReplacementNode(expression)
+    for position, replacement in replacements:
+        node = root
+        for index in position:
+            if node.replaced:
+                raise IndexError(
+                    "Cannot replace child position {!r} of replaced expression {!s}".format(position, node.expression)
+                )
+            child = node.children.get(index)
+            if child is None:
+                if node.operands is None:
+                    if not isinstance(node.expression, Operation):
+                        raise IndexError("Invalid position {!r} for expression {!s}".format(position, expression))
+                    node.operands = list(op_iter(node.expression))
+                if not 0 <= index < len(node.operands):
+                    raise IndexError("Position {!r} out of range for expression {!s}".format(position, expression))
+                child = node.children[index] = _ReplacementNode(node.operands[index])
+            node = child
+        if node.replaced or node.children:
             raise IndexError(
-                "Cannot replace child positions for expression {}, got {!r}".format(expression, replacements[1:])
+                "Cannot replace position {!r} and its child positions for expression {!s}".format(position, expression)
             )
-        return replacements[0][1]
-    if len(replacements) == 1:
-        return replace(expression, replacements[0][0], replacements[0][1])
-    if not isinstance(expression, Operation):
-        raise IndexError("Invalid replacements {!r} for expression {!s}".format(replacements, expression))
-    operands = list(op_iter(expression))
-    new_operands = []
-    last_index = 0
-    for index, group in itertools.groupby(replacements, lambda r: r[0][0]):
-        new_operands.extend(operands[last_index:index])
-        replacements = [(pos[1:], r) for pos, r in group]
-        if len(replacements) == 1:
-            replacement = replace(operands[index], replacements[0][0], replacements[0][1])
-        else:
-            replacement = replace_many(operands[index], replacements)
-        if isinstance(replacement, (list, tuple, Multiset)):
-            new_operands.extend(replacement)
-        else:
-            new_operands.append(replacement)
-        last_index = index + 1
-    new_operands.extend(operands[last_index:len(operands)])
-    return create_operation_expression(expression, new_operands)
+        node.replaced = True
+        node.replacement = replacement
+    return root.rebuild()
+
+
+class _ReplacementNode:
+    """A node in the trie of positions for `replace_many`.
+
+    The trie only contains the replaced positions and their ancestors, so rebuilding it visits each of them once.
+    """
+
+    __slots__ = ('expression', 'operands', 'children', 'replaced', 'replacement')
+
+    def __init__(self, expression: Expression) -> None:
+        self.expression = expression
+        self.operands = None  # type: Optional[List[Expression]]
+        self.children = {}  # type: Dict[int, _ReplacementNode]
+        self.replaced = False
+        self.replacement = None  # type: Optional[Replacement]
+
+    def rebuild(self) -> Replacement:
+        if self.replaced:
+            return self.replacement
+        new_operands = list(self.operands)
+        sequence_indices = set()
+        for index, child in self.children.items():
+            replacement = new_operands[index] = child.rebuild()
+            if isinstance(replacement, (list, tuple, Multiset)):
+                sequence_indices.add(index)
+        if sequence_indices:
+            operands = new_operands
+            new_operands = []
+            for index, operand in enumerate(operands):
+                if index in sequence_indices:
+                    new_operands.extend(operand)
+                else:
+                    new_operands.append(operand)
+        return create_operation_expression(self.expression, new_operands)
 
 
 ReplacementRule = NamedTuple('ReplacementRule', [('pattern', Pattern), ('replacement', Callable[..., Expression])])
 
 
-def replace_all(expression: Expression, rules: Iterable[ReplacementRule], max_count: int=math.inf) \
-        -> Union[Expression, Sequence[Expression]]:
+class ReplacementRuleIndex:
+    """An ordered collection of replacement rules, indexed by the heads and shapes of their patterns.
+
+    For a subject expression, only the rules whose pattern can possibly match it are tried, i.e. the head of the
+    pattern fits and its operands can cover the number of operands of the subject. The candidate rules for a type of
+    subject are computed once and remembered. They are still tried in the order of the rules, so the first matching
+    rule is the same as when trying all rules one by one:
+
+    >>> rules = ReplacementRuleIndex([
+    ...     ReplacementRule(Pattern(f(a, x_)), lambda x: x),
+    ...     ReplacementRule(Pattern(f(x_, y_, _)), lambda x, y: f(y, x)),
+    ...     ReplacementRule(Pattern(x_), lambda x: f(x)),
+    ... ])
+    >>> [str(rule.pattern) for rule in rules.candidates(f(a, b))]
+    ['f(a, x_)', 'x_']
+    >>> replacement, substitution = rules.find_rewrite(f(a, b))
+    >>> print(replacement(**substitution))
+    b
+
+    The index can be passed to `replace_all()` and `replace_all_post_order()` instead of the rules, which also index
+    the rules they are given automatically. Building the index beforehand avoids doing that for every call.
+    """
+
+    def __init__(self, rules: Iterable[ReplacementRule]=()) -> None:
+        """
+        Args:
+            rules:
+                The replacement rules in the order in which they are tried.
+        """
+        self.rules = []  # type: List[ReplacementRule]
+        self._shapes = []
+        self._candidates = {}
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def add(self, rule: ReplacementRule) -> None:
+        """Add a replacement rule which is tried after all the previously added rules."""
+        if not isinstance(rule, ReplacementRule):
+            rule = ReplacementRule(*rule)
+        self.rules.append(rule)
+        self._shapes.append(self._get_shape(rule.pattern.expression))
+        self._candidates.clear()
+
+    def candidates(self, expression: Expression) -> List[ReplacementRule]:
+        """Return the rules whose patterns can possibly match the expression in the order they were added."""
+        return [
+            self.rules[index] for index, symbol_name, min_length, max_length in self._get_candidates(type(expression))
+            if self._fits(expression, symbol_name, min_length, max_length)
+        ]
+
+    def find_rule(self, expression: Expression) -> Optional[Tuple[ReplacementRule, Substitution]]:
+        """Find the first rule that matches the expression.
+
+        Returns:
+            The first matching rule and the substitution of its first match or ``None`` if no rule matches.
+        """
+        for index, symbol_name, min_length, max_length in self._get_candidates(type(expression)):
+            if not self._fits(expression, symbol_name, min_length, max_length):
+                continue
+            rule = self.rules[index]
+            for subst in match(expression, rule.pattern):
+                return rule, subst
+        return None
+
+    def find_rewrite(self, expression: Expression) -> Optional[Tuple[Callable[..., Replacement], Substitution]]:
+        """Find the first rule that matches the expression like `find_rule()`.
+
+        Returns:
+            The replacement callback of the first matching rule and the substitution of its first match or ``None``
+            if no rule matches.
+        """
+        found = self.find_rule(expression)
+        if found is None:
+            return None
+        rule, subst = found
+        return rule.replacement, subst
+
+    def _get_candidates(self, subject_type):
+        try:
+            return self._candidates[subject_type]
+        except KeyError:
+            pass
+        candidates = []
+        for index, (head, symbol_name, min_length, max_length) in enumerate(self._shapes):
+            if head is None or issubclass(subject_type, head):
+                candidates.append((index, symbol_name, min_length, max_length))
+        self._candidates[subject_type] = candidates
+        return candidates
+
+    @staticmethod
+    def _fits(expression, symbol_name, min_length, max_length):
+        if symbol_name is not None:
+            return expression.name == symbol_name
+        if min_length is not None:
+            length = op_len(expression)
+            return min_length <= length <= max_length
+        return True
+
+    @staticmethod
+    def _get_shape(expression):
+        """Return the head, the symbol name and the minimum and maximum number of operands of a pattern.
+
+        Parts that cannot be used to exclude subjects are None.
+        """
+        head = get_head(expression)
+        if head is None or isinstance(expression, OneIdentityOperation):
+            return None, None, None, None
+        if isinstance(expression, Symbol):
+            return head, expression.name, None, None
+        if not isinstance(expression, Operation) or isinstance(expression, Wildcard):
+            return head, None, None, None
+        min_length = 0
+        max_length = math.inf if isinstance(expression, AssociativeOperation) else 0
+        for operand in op_iter(expression):
+            if isinstance(operand, Wildcard):
+                if operand.optional is None:
+                    min_length += operand.min_count
+                if operand.fixed_size:
+                    max_length += operand.min_count
+                else:
+                    max_length = math.inf
+            else:
+                min_length += 1
+                max_length += 1
+        return head, None, min_length, max_length
+
+
+def minimise_rules(rules: Iterable[ReplacementRule]) -> List[ReplacementRule]:
+    """Remove the replacement rules that are subsumed by an earlier rule.
+
+    A rule is subsumed if the pattern of an earlier rule matches everything that its pattern matches. Since the rules
+    are tried in order, such a rule is never applied by `replace_all()` and can be dropped before building a
+    :class:`.ManyToOneReplacer` or a `ReplacementRuleIndex`:
+
+    >>> rules = minimise_rules([
+    ...     ReplacementRule(Pattern(f(a, x_)), lambda x: x),
+    ...     ReplacementRule(Pattern(f(a, b)), lambda: b),
+    ...     ReplacementRule(Pattern(f(x_, b)), lambda x: x),
+    ...     ReplacementRule(Pattern(f(a, x_)), lambda x: f(x)),
+    ... ])
+    >>> [str(rule.pattern) for rule in rules]
+    ['f(a, x_)', 'f(x_, b)']
+
+    The subsumption is decided with a :class:`.GeneralisationIndex`, so rules are only dropped if that is safe, but
+    not every subsumed rule is found. A :class:`.ManyToOneReplacer` does not guarantee the order in which its rules
+    are tried, so there the dropped rules only could have been applied instead of a more general one.
+
+    Args:
+        rules:
+            The replacement rules in the order in which they are tried.
+
+    Returns:
+        The rules that are not subsumed by an earlier rule in their original order.
+    """
+    index = GeneralisationIndex()
+    result = []
+    for rule in rules:
+        if not isinstance(rule, ReplacementRule):
+            rule = ReplacementRule(*rule)
+        if any(True for _ in index.generalisations(rule.pattern)):
+            continue
+        index.add(rule.pattern, rule)
+        result.append(rule)
+    return result
+
+
+def _index_rules(rules: Iterable[ReplacementRule]) -> ReplacementRuleIndex:
+    if isinstance(rules, ReplacementRuleIndex):
+        return rules
+    return ReplacementRuleIndex(rules)
+
+
+class StopReason(Enum):
+    """The reason why a bounded rewriting stopped."""
+
+    NORMAL_FORM = 'normal form'
+    """No rule can be applied anymore."""
+
+    STEP_LIMIT = 'step limit'
+    """The maximum number of rewrite steps was reached."""
+
+    TIMEOUT = 'timeout'
+    """The time limit was reached."""
+
+    CYCLE = 'cycle'
+    """A rewrite step resulted in an expression that was already seen before."""
+
+
+RewriteResult = NamedTuple('RewriteResult', [('expression', Replacement), ('steps', int), ('reason', StopReason)])
+RewriteResult.__doc__ = """The result of a bounded rewriting with the number of performed steps and why it stopped."""
+
+
+class RewriteBudget:
+    """Limits for a bounded rewriting, e.g. with `replace_all_bounded()`.
+
+    >>> rules = [ReplacementRule(Pattern(f(x_)), lambda x: f(f(x)))]
+    >>> replace_all_bounded(f(a), rules, RewriteBudget(max_steps=2))
+    RewriteResult(expression=f(f(f(Symbol('a')))), steps=2, reason=<StopReason.STEP_LIMIT: 'step limit'>)
+
+    With cycle detection, the rewriting stops as soon as an expression is repeated:
+
+    >>> rules = [ReplacementRule(Pattern(f(x_, y_)), lambda x, y: f(y, x))]
+    >>> replace_all_bounded(f(a, b), rules, RewriteBudget(detect_cycles=True))
+    RewriteResult(expression=f(Symbol('a'), Symbol('b')), steps=2, reason=<StopReason.CYCLE: 'cycle'>)
+
+    For the detection, every expression resulting from a rewrite step is hashed and kept until the rewriting is done.
+    Hashing takes time proportional to the size of the expression, so it is disabled by default.
+
+    The time limit is checked between rewrite steps and before matching each subexpression. A single match or
+    replacement callback is never interrupted.
+    """
+
+    def __init__(self, max_steps: int=math.inf, timeout: Optional[float]=None, detect_cycles: bool=False) -> None:
+        """
+        Args:
+            max_steps:
+                The maximum number of rewrite steps.
+            timeout:
+                The maximum time for the rewriting in seconds.
+            detect_cycles:
+                If True, the rewriting stops when a rewrite step results in an expression that was seen before.
+
+        Raises:
+            ValueError:
+                If the *max_steps* or the *timeout* is negative.
+        """
+        if max_steps < 0:
+            raise ValueError("The maximum number of steps must not be negative, got {}".format(max_steps))
+        if timeout is not None and timeout < 0:
+            raise ValueError("The timeout must not be negative, got {}".format(timeout))
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.detect_cycles = detect_cycles
+
+    def _start(self) -> '_RewriteRun':
+        return _RewriteRun(self)
+
+
+class _RewriteRun:
+    """The state of a single rewriting with a `RewriteBudget`."""
+
+    __slots__ = ('max_steps', 'deadline', 'detect_cycles', 'steps', 'reason')
+
+    def __init__(self, budget: RewriteBudget) -> None:
+        self.max_steps = budget.max_steps
+        self.deadline = time.monotonic() + budget.timeout if budget.timeout is not None else None
+        self.detect_cycles = budget.detect_cycles
+        self.steps = 0
+        self.reason = None  # type: Optional[StopReason]
+
+    def timed_out(self) -> bool:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = StopReason.TIMEOUT
+            return True
+        return False
+
+    def next_step(self) -> bool:
+        """Count the next rewrite step. Returns False if there are no steps left."""
+        if self.steps >= self.max_steps:
+            self.reason = StopReason.STEP_LIMIT
+            return False
+        self.steps += 1
+        return True
+
+    def new_history(self, expression: Replacement) -> Optional[dict]:
+        if not self.detect_cycles:
+            return None
+        history = {}
+        self._is_repeated(history, expression)
+        return history
+
+    def is_cycle(self, history: Optional[dict], expression: Replacement) -> bool:
+        """Add the expression to the history and return True if it was already in it."""
+        if history is None or not self._is_repeated(history, expression):
+            return False
+        self.reason = StopReason.CYCLE
+        return True
+
+    @staticmethod
+    def _is_repeated(history, expression):
+        try:
+            key = hash(expression)
+        except TypeError:
+            key = hash(tuple(expression))
+        seen = history.setdefault(key, [])
+        if expression in seen:
+            return True
+        seen.append(expression)
+        return False
+
+    def result(self, expression: Replacement) -> RewriteResult:
+        return RewriteResult(expression, self.steps, self.reason or StopReason.NORMAL_FORM)
+
+
+TraceStep = NamedTuple(
+    'TraceStep', [('rule', ReplacementRule), ('position', Tuple[int, ...]), ('substitution', Substitution)]
+)
+TraceStep.__doc__ = """A recorded rewrite step with the applied rule, the position of the rewritten subexpression
+in the expression before the step and the substitution of the match."""
+
+
+class RewriteTrace:
+    """Records the rewrite steps of `replace_all()` or :meth:`.ManyToOneReplacer.replace`.
+
+    >>> rule = ReplacementRule(Pattern(f(a, x_)), lambda x: x)
+    >>> trace = RewriteTrace()
+    >>> print(replace_all(f(b, f(a, f(a, c))), [rule], trace=trace))
+    f(b, c)
+    >>> [(str(step.rule.pattern), step.position, str(step.substitution)) for step in trace.steps]
+    [('f(a, x_)', (1,), '{x ↦ f(a, c)}'), ('f(a, x_)', (1,), '{x ↦ c}')]
+
+    The positions refer to the expression as it was before the respective step. Together with the rules and
+    substitutions, the steps can be replayed to reconstruct the rewriting. The steps share the rules, substitutions
+    and their expressions with the rewriting instead of copying them.
+
+    For statistics about how often each rule was applied, recording the individual steps can be disabled:
+
+    >>> trace = RewriteTrace(record_steps=False)
+    >>> _ = replace_all(f(a, f(a, b)), [rule], trace=trace)
+    >>> [(str(rule.pattern), count) for rule, count in trace.rule_counts()]
+    [('f(a, x_)', 2)]
+    >>> len(trace), trace.steps
+    (2, [])
+
+    A trace can be reused for multiple rewritings, which are then recorded one after another.
+    """
+
+    def __init__(self, record_steps: bool=True) -> None:
+        """
+        Args:
+            record_steps:
+                If False, only the number of applications of each rule is counted.
+        """
+        self.record_steps = record_steps
+        self.steps = []  # type: List[TraceStep]
+        self._counts = {}
+        self._total = 0
+
+    def __len__(self):
+        return self._total
+
+    def rule_counts(self) -> List[Tuple[ReplacementRule, int]]:
+        """Return how often each rule was applied in the order in which the rules were first applied.
+
+        Rules are distinguished by identity, since patterns are not hashable.
+        """
+        return [(rule, count) for rule, count in self._counts.values()]
+
+    def clear(self) -> None:
+        """Remove all recorded steps and counts."""
+        self.steps.clear()
+        self._counts.clear()
+        self._total = 0
+
+    def _record(self, rule: ReplacementRule, position: Tuple[int, ...], substitution: Substitution) -> None:
+        self._total += 1
+        entry = self._counts.get(id(rule))
+        if entry is None:
+            self._counts[id(rule)] = [rule, 1]
+        else:
+            entry[1] += 1
+        if self.record_steps:
+            self.steps.append(TraceStep(rule, position, substitution))
+
+
+def replace_all(expression: Expression, rules: Iterable[ReplacementRule], max_count: int=math.inf,
+                trace: Optional[RewriteTrace]=None) -> Union[Expression, Sequence[Expression]]:
     """Replace all occurrences of the patterns according to the replacement rules.
 
     A replacement rule consists of a *pattern*, that is matched against any subexpression
@@ -228,41 +768,278 @@ def replace_all(expression: Expression, rules: Iterable[ReplacementRule], max_co
         expression:
             The expression to which the replacement rules are applied.
         rules:
-            A collection of replacement rules that are applied to the expression.
+            A collection of replacement rules that are applied to the expression. If there are multiple rules
+            whose patterns match, the first one is applied. The rules are indexed by the heads of their patterns
+            unless they already are a `ReplacementRuleIndex`.
         max_count:
             If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
             are applied until there is no more match. If the set of replacement rules is not confluent,
             the replacement might not terminate without a *max_count* set.
+        trace:
+            An optional `RewriteTrace` that records the applied rules.
 
     Returns:
         The resulting expression after the application of the replacement rules. This can also be a sequence of
         expressions, if the root expression is replaced with a sequence of expressions by a rule.
     """
-    rules = [ReplacementRule(pattern, replacement) for pattern, replacement in rules]
-    expression = expression
-    replaced = True
+    return _replace_all_incremental(expression, _index_rules(rules).find_rule, max_count, trace=trace)
+
+
+def replace_all_bounded(expression: Expression, rules: Iterable[ReplacementRule], budget: RewriteBudget,
+                        trace: Optional[RewriteTrace]=None) -> RewriteResult:
+    """Replace all occurrences of the patterns like `replace_all()` does, but within the limits of the *budget*.
+
+    Args:
+        expression:
+            The expression to which the replacement rules are applied.
+        rules:
+            A collection of replacement rules that are applied to the expression.
+        budget:
+            The limits for the rewriting.
+        trace:
+            An optional `RewriteTrace` that records the applied rules.
+
+    Returns:
+        The resulting expression together with the number of rewrite steps and the reason why the rewriting stopped.
+    """
+    run = budget._start()
+    result = _replace_all_incremental(expression, _index_rules(rules).find_rule, run=run, trace=trace)
+    return run.result(result)
+
+
+def _replace_all_incremental(
+        expression: Expression,
+        find_rule: Callable[[Expression], Optional[Tuple[ReplacementRule, Substitution]]],
+        max_count: int=math.inf,
+        run: Optional[_RewriteRun]=None,
+        trace: Optional[RewriteTrace]=None
+) -> Replacement:
+    """Repeatedly rewrite the first subexpression in preorder for which *find_rule* finds a matching rule.
+
+    The result is the same as restarting a preorder traversal from the root after every rewrite. However, everything
+    before the rewritten position in preorder is unchanged except for the ancestors of the position, and it is
+    already known that none of it can be rewritten. Hence, only the ancestors are checked again (from the top down),
+    before the traversal continues at the rewritten position with the new subexpressions.
+
+    Args:
+        expression:
+            The expression to rewrite.
+        find_rule:
+            Returns a tuple of the matching rule and the substitution its replacement is called with for a
+            subexpression, or ``None`` if the subexpression cannot be rewritten.
+        max_count:
+            The maximum number of rewrites.
+        run:
+            The state of a bounded rewriting, which is updated with the number of steps and why the rewriting stopped.
+        trace:
+            The trace to record the rewrites in.
+
+    Returns:
+        The rewritten expression.
+    """
+    # The ancestors of the current position as lists of the operation, its operands and the index of the operand
+    # which contains the current position. The current expression is None if the position is after the last operand.
+    path = []
+    current = expression
     replace_count = 0
-    while replaced and replace_count < max_count:
-        replaced = False
-        for subexpr, pos in preorder_iter_with_position(expression):
-            for pattern, replacement in rules:
-                try:
-                    subst = next(match(subexpr, pattern))
-                    result = replacement(**subst)
-                    expression = replace(expression, pos, result)
-                    replaced = True
+    check_ancestors = False
+    history = run.new_history(expression) if run is not None else None
+    while replace_count < max_count:
+        if run is not None and run.timed_out():
+            break
+        rewrite = None
+        if check_ancestors:
+            check_ancestors = False
+            for level, (operation, _, _) in enumerate(path):
+                rewrite = find_rule(operation)
+                if rewrite is not None:
+                    current = operation
+                    del path[level:]
                     break
-                except StopIteration:
-                    pass
-            if replaced:
+        if rewrite is None and current is not None:
+            rewrite = find_rule(current)
+        if rewrite is None:
+            if current is not None and isinstance(current, Operation) and op_len(current) > 0:
+                operands = list(op_iter(current))
+                path.append([current, operands, 0])
+                current = operands[0]
+                continue
+            while path:
+                frame = path[-1]
+                frame[2] += 1
+                if frame[2] < len(frame[1]):
+                    current = frame[1][frame[2]]
+                    break
+                path.pop()
+            else:
                 break
+            continue
+        if run is not None and not run.next_step():
+            break
+        rule, subst = rewrite
+        if trace is not None:
+            trace._record(rule, tuple(frame[2] for frame in path), subst)
+        expression, current = _rebuild_path(path, rule.replacement(**subst))
         replace_count += 1
-
+        check_ancestors = True
+        if run is not None and run.is_cycle(history, expression):
+            break
     return expression
 
 
-def replace_all_post_order(expression: Expression, rules: Iterable[ReplacementRule]) \
-        -> Union[Expression, Sequence[Expression]]:
+def _rebuild_path(path: List[list], replacement: Replacement) -> Tuple[Replacement, Optional[Expression]]:
+    """Replace the expression at the position of the path and rebuild all its ancestors like `replace` does.
+
+    The path is updated to the new ancestors. If creating a new ancestor changed more than the operand on the path,
+    e.g. because operands were sorted or flattened, the path is cut off at that ancestor and the ancestor is the new
+    position, so that the traversal continues with everything that may have changed.
+
+    Returns:
+        The new root expression and the expression at the new position (or None, if the position is after the last
+        operand of its parent).
+    """
+    if not path:
+        return replacement, replacement
+    child = replacement
+    new_ancestors = []
+    for operation, operands, index in reversed(path):
+        if isinstance(child, Sequence):
+            new_operands = operands[:index] + list(child) + operands[index + 1:]
+        else:
+            new_operands = operands[:index] + [child] + operands[index + 1:]
+        child = create_operation_expression(operation, new_operands)
+        new_ancestors.append(child)
+    new_ancestors.reverse()
+    for level, ancestor in enumerate(new_ancestors):
+        _, old_operands, index = path[level]
+        if not isinstance(ancestor, Operation):
+            del path[level:]
+            return child, ancestor
+        operands = list(op_iter(ancestor))
+        if len(operands) < index or any(o is not p for o, p in zip(operands[:index], old_operands)):
+            del path[level:]
+            return child, ancestor
+        path[level] = [ancestor, operands, index]
+        current = operands[index] if index < len(operands) else None
+        if level + 1 < len(new_ancestors) and current is not new_ancestors[level + 1]:
+            del path[level + 1:]
+            return child, current
+    return child, current
+
+
+class NormalFormCache:
+    """A bounded cache that maps expressions to their normal forms for a fixed set of replacement rules.
+
+    It can be passed to `replace_all_post_order()` or :meth:`.ManyToOneReplacer.replace_post_order` to avoid
+    normalising the same subexpression more than once. An expression that is already in normal form is stored with
+    itself as its normal form, which marks it as irreducible so that no matching is attempted for it again:
+
+    >>> rules = [ReplacementRule(Pattern(f(a, x_)), lambda x: x)]
+    >>> cache = NormalFormCache()
+    >>> print(replace_all_post_order(f(f(a, b), f(a, b)), rules, cache))
+    f(b, b)
+    >>> print(cache.get(f(a, b)))
+    b
+    >>> cache.is_irreducible(b)
+    True
+
+    By default, expressions are compared structurally. Equal expressions then share the instance that was stored
+    first, which interns the irreducible subexpressions. Computing the hash of an expression takes time proportional
+    to its size though. For expressions with many shared subexpression instances, i.e. a DAG rather than a tree, the
+    cache can compare by identity instead, which makes every lookup constant time.
+
+    Once the cache holds *max_size* expressions, the least recently used ones are evicted. A cache must only be used
+    with a single set of rules, since the normal forms depend on it.
+    """
+
+    def __init__(self, max_size: int=4096, by_identity: bool=False) -> None:
+        """
+        Args:
+            max_size:
+                The maximum number of expressions to keep in the cache.
+            by_identity:
+                If True, expressions are looked up by identity instead of by equality.
+
+        Raises:
+            ValueError:
+                If the *max_size* is not positive.
+        """
+        if max_size < 1:
+            raise ValueError("The maximum size of the cache must be positive, got {}".format(max_size))
+        self.max_size = max_size
+        self.by_identity = by_identity
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Remove all expressions from the cache."""
+        self._entries.clear()
+
+    def get(self, expression: Expression) -> Optional[Replacement]:
+        """Return the normal form of the expression or None if it is not in the cache."""
+        entry = self._lookup(expression)
+        return entry[1] if entry is not None else None
+
+    def is_irreducible(self, expression: Expression) -> bool:
+        """Return True iff the expression is known to be in normal form."""
+        entry = self._lookup(expression)
+        return entry is not None and entry[2]
+
+    def add(self, expression: Expression, normal_form: Replacement) -> None:
+        """Add the normal form of an expression to the cache.
+
+        The normal form itself is also marked as irreducible, unless it is a sequence of expressions.
+        """
+        if expression is normal_form:
+            self._store(expression, normal_form, True)
+            return
+        self._store(expression, normal_form, False)
+        if isinstance(normal_form, Expression):
+            self._store(normal_form, normal_form, True)
+
+    def _key(self, expression):
+        return id(expression) if self.by_identity else expression
+
+    def _lookup(self, expression):
+        try:
+            key = self._key(expression)
+            entry = self._entries[key]
+        except (KeyError, TypeError):
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, expression, normal_form, irreducible):
+        # The expression is kept in the entry, so that its id cannot be reused while it is in the cache
+        try:
+            self._entries[self._key(expression)] = (expression, normal_form, irreducible)
+        except TypeError:
+            return
+        self._entries.move_to_end(self._key(expression))
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _replace(self, expression, replace_uncached, run=None):
+        """Normalise the expression with *replace_uncached* unless its normal form is cached.
+
+        Returns the normal form and whether it is a different instance than the expression. For a cached
+        irreducible expression, this is the case if it was interned, so that the surrounding expression gets rebuilt
+        with the interned instance.
+        """
+        entry = self._lookup(expression)
+        if entry is not None:
+            normal_form = entry[1]
+            return normal_form, normal_form is not expression
+        normal_form, replaced = replace_uncached(expression)
+        if run is None or run.reason is None:
+            self.add(expression, normal_form if replaced else expression)
+        return normal_form, replaced
+
+
+def replace_all_post_order(expression: Expression, rules: Iterable[ReplacementRule],
+                           cache: Optional[NormalFormCache]=None) -> Union[Expression, Sequence[Expression]]:
     """Replace all occurrences of the patterns according to the replacement rules.
 
     A replacement rule consists of a *pattern*, that is matched against any subexpression
@@ -278,37 +1055,83 @@ def replace_all_post_order(expression: Expression, rules: Iterable[ReplacementRu
         expression:
             The expression to which the replacement rules are applied.
         rules:
-            A collection of replacement rules that are applied to the expression.
-        max_count:
-            If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
-            are applied until there is no more match. If the set of replacement rules is not confluent,
-            the replacement might not terminate without a *max_count* set.
+            A collection of replacement rules that are applied to the expression. If there are multiple rules
+            whose patterns match, the first one is applied. The rules are indexed by the heads of their patterns
+            unless they already are a `ReplacementRuleIndex`.
+        cache:
+            An optional `NormalFormCache` that is used to look up and store the normal forms of subexpressions.
+            It must not be used with a different set of rules.
 
     Returns:
         The resulting expression after the application of the replacement rules. This can also be a sequence of
         expressions, if the root expression is replaced with a sequence of expressions by a rule.
     """
-    return _replace_all_post_order(expression, rules)[0]
+    return _replace_post_order(expression, _index_rules(rules).find_rule, cache)[0]
+
+
+def replace_all_post_order_bounded(expression: Expression, rules: Iterable[ReplacementRule], budget: RewriteBudget,
+                                   cache: Optional[NormalFormCache]=None) -> RewriteResult:
+    """Replace all occurrences of the patterns like `replace_all_post_order()`, but within the limits of the *budget*.
+
+    Cycles are detected separately for every subexpression, i.e. the rewriting stops if the rewrites of a
+    subexpression repeat.
+
+    Args:
+        expression:
+            The expression to which the replacement rules are applied.
+        rules:
+            A collection of replacement rules that are applied to the expression.
+        budget:
+            The limits for the rewriting.
+        cache:
+            An optional `NormalFormCache` that is used to look up and store the normal forms of subexpressions.
+            Subexpressions whose rewriting was stopped are not added to it.
+
+    Returns:
+        The resulting expression together with the number of rewrite steps and the reason why the rewriting stopped.
+    """
+    run = budget._start()
+    result, _ = _replace_post_order(expression, _index_rules(rules).find_rule, cache, run)
+    return run.result(result)
 
-def _replace_all_post_order(expression, rules):
-    replaced = True
+
+def _replace_post_order(expression, find_rule, cache=None, run=None):
+    """Rewrite the expression to normal form, rewriting the operands before the expression itself.
+
+    Returns the rewritten expression and whether anything was rewritten.
+    """
+    if cache is not None:
+        return cache._replace(expression, lambda e: _replace_post_order_uncached(e, find_rule, cache, run), run)
+    return _replace_post_order_uncached(expression, find_rule, cache, run)
+
+
+def _replace_post_order_uncached(expression, find_rule, cache, run):
     any_replaced = False
-    while replaced:
-        replaced = False
+    history = run.new_history(expression) if run is not None else None
+    while True:
         if isinstance(expression, Operation):
-            new_operands = [_replace_all_post_order(o, rules) for o in op_iter(expression)]
-            if any(r for _, r in new_operands):
-                new_operands = [o for o, _ in new_operands]
+            new_operands = []
+            operands_replaced = False
+            for operand in op_iter(expression):
+                if run is not None and run.reason is not None:
+                    new_operands.append(operand)
+                    continue
+                new_operand, replaced = _replace_post_order(operand, find_rule, cache, run)
+                new_operands.append(new_operand)
+                operands_replaced = operands_replaced or replaced
+            if operands_replaced:
                 expression = create_operation_expression(expression, new_operands)
                 any_replaced = True
-        for pattern, replacement in rules:
-            try:
-                subst = next(iter(match(expression, pattern)))
-                expression = replacement(**subst)
-                replaced = any_replaced = True
-                break
-            except StopIteration:
-                pass
+        if run is not None and (run.reason is not None or run.timed_out()):
+            break
+        rewrite = find_rule(expression)
+        if rewrite is None or (run is not None and not run.next_step()):
+            break
+        rule, subst = rewrite
+        expression = rule.replacement(**subst)
+        any_replaced = True
+        if run is not None and run.is_cycle(history, expression):
+            break
     return expression, any_replaced
 
 
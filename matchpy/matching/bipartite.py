@@ -2,20 +2,28 @@
 """Contains classes and functions related to bipartite graphs.
 
 The `BipartiteGraph` class is used to represent a bipartite graph as a dictionary. In particular,
-`BipartiteGraph.find_matching()` can be used to find a maximum matching in such a graph.
+`BipartiteGraph.find_matching()` can be used to find a maximum matching in such a graph. A `BipartiteGraphView` is a
+read-only view of a `BipartiteGraph` without some of its nodes or edges.
 
 The function `enum_maximum_matchings_iter` can be used to enumerate all maximum matchings of a `BipartiteGraph`.
+The function `enum_b_matchings_iter` enumerates the b-matchings of a `BipartiteGraph` where the nodes have
+multiplicities and `enum_b_matching_left_counts_iter` enumerates how often they use the left nodes.
 """
 
-from typing import (Dict, Generic, Hashable, Iterator, List, Set, Tuple, TypeVar, Union, cast, MutableMapping)
+from typing import (
+    Dict, FrozenSet, Generic, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar, Union, cast, Mapping,
+    MutableMapping
+)
 
 try:
     from graphviz import Digraph, Graph
 except ImportError:
     Digraph = Graph = None
-from hopcroftkarp import HopcroftKarp
 
-__all__ = ['BipartiteGraph', 'enum_maximum_matchings_iter']
+__all__ = [
+    'BipartiteGraph', 'BipartiteGraphView', 'enum_maximum_matchings_iter', 'enum_b_matchings_iter',
+    'enum_b_matching_left_counts_iter'
+]
 
 T = TypeVar('T')
 TLeft = TypeVar('TLeft', bound=Hashable)
@@ -76,12 +84,18 @@ class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TL
         if not isinstance(key, tuple) or len(key) != 2:
             raise TypeError("The edge must be a 2-tuple")
         self._edges.__delitem__(key)
-        if all(l != key[0] for (l, _) in self._edges):
+        if self._matching.get(key[0], _NO_NODE) == key[1]:
+            del self._matching[key[0]]
+        left_neighbours = self._graph[(LEFT, key[0])]
+        left_neighbours.remove((RIGHT, key[1]))
+        if not left_neighbours:
+            del self._graph[(LEFT, key[0])]
             self._left.remove(key[0])
-        if all(r != key[1] for (_, r) in self._edges):
+        right_neighbours = self._graph[(RIGHT, key[1])]
+        right_neighbours.remove((LEFT, key[0]))
+        if not right_neighbours:
+            del self._graph[(RIGHT, key[1])]
             self._right.remove(key[1])
-        self._graph[(LEFT, key[0])].remove((RIGHT, key[1]))
-        self._graph[(RIGHT, key[1])].remove((LEFT, key[0]))
 
     def edges_with_labels(self):
         """Returns a view on the edges with labels."""
@@ -95,13 +109,15 @@ class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TL
         self._left.clear()
         self._right.clear()
         self._graph.clear()
+        self._matching.clear()
 
     def __copy__(self):
         new_graph = type(self)()
         new_graph._edges = self._edges.copy()
         new_graph._left = self._left.copy()
         new_graph._right = self._right.copy()
-        new_graph._graph = self._graph.copy()
+        new_graph._graph = dict((node, neighbours.copy()) for node, neighbours in self._graph.items())
+        new_graph._matching = self._matching.copy()
         return new_graph
 
     def __iter__(self):
@@ -144,53 +160,295 @@ class BipartiteGraph(Generic[TLeft, TRight, TEdgeValue], MutableMapping[Tuple[TL
     def find_matching(self) -> Dict[TLeft, TRight]:
         """Finds a matching in the bipartite graph.
 
-        This is done using the Hopcroft-Karp algorithm with an implementation from the
-        `hopcroftkarp` package.
+        This is done using the Hopcroft-Karp algorithm on integer-indexed adjacency lists.
+
+        The matching found by the previous call is remembered and only the edges which have been removed since then
+        are dropped from it. The algorithm starts from the remaining matching, so after adding or removing a few edges
+        only a few augmenting paths need to be found:
+
+        >>> graph = BipartiteGraph({(0, 'a'): True, (1, 'a'): True})
+        >>> len(graph.find_matching())
+        1
+        >>> graph[1, 'b'] = True
+        >>> sorted(graph.find_matching().items())
+        [(0, 'a'), (1, 'b')]
 
         Returns:
             A dictionary where each edge of the matching is represented by a key-value pair
             with the key being from the left part of the graph and the value from te right part.
         """
-        # The directed graph is represented as a dictionary of edges
-        # The key is the tail of all edges which are represented by the value
-        # The value is a set of heads for the all edges originating from the tail (key)
-        # In addition, the graph stores which part of the bipartite graph a node originated from
-        # to avoid problems when a value exists in both halfs.
-        # Only one direction of the undirected edge is needed for the HopcroftKarp class
-        directed_graph = {}  # type: Dict[Tuple[int, TLeft], Set[Tuple[int, TRight]]]
-
-        for (left, right) in self._edges:
-            tail = (LEFT, left)
-            head = (RIGHT, right)
-            if tail not in directed_graph:
-                directed_graph[tail] = {head}
-            else:
-                directed_graph[tail].add(head)
+        self._matching = _find_matching(self._edges, self._matching)
+        return self._matching.copy()
 
-        matching = HopcroftKarp(directed_graph).maximum_matching()
+    def without_nodes(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view of this bipartite graph with the given edge and its adjacent nodes removed.
 
-        # Filter out the partitions (LEFT and RIGHT) and only return the matching edges
-        # that go from LEFT to RIGHT
-        return dict((tail[1], head[1]) for tail, head in matching.items() if tail[0] == LEFT)
+        See `BipartiteGraphView` for details on the view.
+        """
+        return BipartiteGraphView(self).without_nodes(edge)
+
+    def without_edge(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view of this bipartite graph with the given edge removed.
 
-    def without_nodes(self, edge: Edge) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns a copy of this bipartite graph with the given edge and its adjacent nodes removed."""
-        return BipartiteGraph(((n1, n2), v) for (n1, n2), v in self._edges.items() if n1 != edge[0] and n2 != edge[1])
+        See `BipartiteGraphView` for details on the view.
+        """
+        return BipartiteGraphView(self).without_edge(edge)
 
-    def without_edge(self, edge: Edge) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns a copy of this bipartite graph with the given edge removed."""
-        return BipartiteGraph((e2, v) for e2, v in self._edges.items() if edge != e2)
+    def limited_to(self, left: Set[TLeft], right: Set[TRight]) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view of the induced subgraph where only the nodes from the given sets are included.
 
-    def limited_to(self, left: Set[TLeft], right: Set[TRight]) -> 'BipartiteGraph[TLeft, TRight, TEdgeValue]':
-        """Returns the induced subgraph where only the nodes from the given sets are included."""
-        return BipartiteGraph(((n1, n2), v) for (n1, n2), v in self._edges.items() if n1 in left and n2 in right)
+        See `BipartiteGraphView` for details on the view.
+        """
+        return BipartiteGraphView(self).limited_to(left, right)
 
     def __repr__(self):
         return '{}({})'.format(self.__class__.__name__, self._edges)
 
 
+class BipartiteGraphView(Generic[TLeft, TRight, TEdgeValue], Mapping[Tuple[TLeft, TRight], TEdgeValue]):
+    """A read-only view of a `BipartiteGraph` without some of its nodes and edges.
+
+    The view does not copy the edges of the graph. Instead, it only stores which nodes and edges are excluded, so
+    removing a node or edge from a view only takes time proportional to the number of nodes and edges removed so far:
+
+    >>> graph = BipartiteGraph({(0, 0): True, (0, 1): True, (1, 1): True})
+    >>> view = graph.without_edge((0, 1))
+    >>> sorted(view)
+    [(0, 0), (1, 1)]
+    >>> sorted(view.without_nodes((1, 1)))
+    [(0, 0)]
+
+    Since the graph is shared, later changes to it are reflected by the view:
+
+    >>> graph[1, 0] = True
+    >>> sorted(view)
+    [(0, 0), (1, 0), (1, 1)]
+
+    Use ``BipartiteGraph(view)`` to get an independent copy of the view.
+    """
+
+    __slots__ = ('_base', '_left', '_right', '_excluded_left', '_excluded_right', '_excluded_edges')
+
+    def __init__(
+            self,
+            graph: BipartiteGraph[TLeft, TRight, TEdgeValue],
+            left: Optional[FrozenSet[TLeft]]=None,
+            right: Optional[FrozenSet[TRight]]=None,
+            excluded_left: FrozenSet[TLeft]=frozenset(),
+            excluded_right: FrozenSet[TRight]=frozenset(),
+            excluded_edges: FrozenSet[Edge]=frozenset()
+    ) -> None:
+        self._base = graph
+        self._left = left
+        self._right = right
+        self._excluded_left = excluded_left
+        self._excluded_right = excluded_right
+        self._excluded_edges = excluded_edges
+
+    def _includes(self, left: TLeft, right: TRight) -> bool:
+        if left in self._excluded_left or right in self._excluded_right or (left, right) in self._excluded_edges:
+            return False
+        return (self._left is None or left in self._left) and (self._right is None or right in self._right)
+
+    def _neighbours(self, node: Node) -> Iterator[Node]:
+        side, value = node
+        neighbours = self._base._graph.get(node, ())
+        if side == LEFT:
+            if value in self._excluded_left or (self._left is not None and value not in self._left):
+                return
+            excluded, allowed = self._excluded_right, self._right
+            edges = ((value, other) for _, other in neighbours)
+        else:
+            if value in self._excluded_right or (self._right is not None and value not in self._right):
+                return
+            excluded, allowed = self._excluded_left, self._left
+            edges = ((other, value) for _, other in neighbours)
+        excluded_edges = self._excluded_edges
+        for other, edge in zip(neighbours, edges):
+            if other[1] not in excluded and (allowed is None or other[1] in allowed) and edge not in excluded_edges:
+                yield other
+
+    def __getitem__(self, key: Edge) -> TEdgeValue:
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise TypeError("The edge must be a 2-tuple")
+        if not self._includes(*key):
+            raise KeyError(key)
+        return self._base._edges[key]
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, tuple) and len(key) == 2 and key in self._base._edges and self._includes(*key)
+
+    def __iter__(self) -> Iterator[Edge]:
+        return iter(self._edge_list())
+
+    def __len__(self) -> int:
+        return len(self._edge_list())
+
+    def _edge_list(self) -> List[Edge]:
+        # The edges are filtered with list comprehensions, which is a lot faster than a generator for the large number
+        # of views that are iterated when enumerating matchings.
+        excluded_left = self._excluded_left
+        if self._left is not None and len(self._left) < len(self._base._left):
+            lefts = [left for left in self._left if left not in excluded_left]  # type: Optional[List[TLeft]]
+        elif excluded_left:
+            lefts = [left for left in self._base._left if left not in excluded_left]
+        else:
+            lefts = None
+        if lefts is None:
+            edges = list(self._base._edges)
+        else:
+            neighbours = self._base._graph
+            edges = [(left, right) for left in lefts for _, right in neighbours.get((LEFT, left), ())]
+        if self._excluded_right:
+            excluded_right = self._excluded_right
+            edges = [edge for edge in edges if edge[1] not in excluded_right]
+        if self._excluded_edges:
+            excluded_edges = self._excluded_edges
+            edges = [edge for edge in edges if edge not in excluded_edges]
+        if self._left is not None and lefts is None:
+            left_nodes = self._left
+            edges = [edge for edge in edges if edge[0] in left_nodes]
+        if self._right is not None:
+            right_nodes = self._right
+            edges = [edge for edge in edges if edge[1] in right_nodes]
+        return edges
+
+    def edges_with_labels(self):
+        """Returns a view on the edges with labels."""
+        return self.items()
+
+    def edges(self):
+        return self.keys()
+
+    def _replace(self, **changes) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        masks = dict((name, getattr(self, '_' + name)) for name in (
+            'left', 'right', 'excluded_left', 'excluded_right', 'excluded_edges'
+        ))
+        masks.update(changes)
+        return BipartiteGraphView(self._base, **masks)
+
+    def without_nodes(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view with the given edge and its adjacent nodes removed as well."""
+        return self._replace(
+            excluded_left=self._excluded_left | {edge[0]}, excluded_right=self._excluded_right | {edge[1]}
+        )
+
+    def without_edge(self, edge: Edge) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view with the given edge removed as well."""
+        return self._replace(excluded_edges=self._excluded_edges | {edge})
+
+    def limited_to(self, left: Set[TLeft], right: Set[TRight]) -> 'BipartiteGraphView[TLeft, TRight, TEdgeValue]':
+        """Returns a view where only the nodes from the given sets are included as well."""
+        return self._replace(
+            left=frozenset(left) if self._left is None else self._left & left,
+            right=frozenset(right) if self._right is None else self._right & right
+        )
+
+    def find_matching(self) -> Dict[TLeft, TRight]:
+        """Finds a matching in the view like `BipartiteGraph.find_matching()`.
+
+        The algorithm starts from the part of the last matching found for the underlying graph that is in the view.
+        """
+        matching = dict((left, right) for left, right in self._base._matching.items() if self._includes(left, right))
+        return _find_matching(self, matching)
+
+    def as_graph(self) -> Graph:  # pragma: no cover
+        """Returns a :class:`graphviz.Graph` representation of this view."""
+        return BipartiteGraph(self).as_graph()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, dict(self.items()))
+
+
+_NO_NODE = object()
+
+
+def _find_matching(edges: Iterable[Edge], matching: Dict[TLeft, TRight]) -> Dict[TLeft, TRight]:
+    """Find a maximum matching for the edges with the Hopcroft-Karp algorithm, starting from the given matching."""
+    left_index = {}  # type: Dict[TLeft, int]
+    right_index = {}  # type: Dict[TRight, int]
+    left_nodes = []  # type: List[TLeft]
+    right_nodes = []  # type: List[TRight]
+    adjacency = []  # type: List[List[int]]
+    for left, right in edges:
+        l = left_index.get(left)
+        if l is None:
+            l = left_index[left] = len(left_nodes)
+            left_nodes.append(left)
+            adjacency.append([])
+        r = right_index.get(right)
+        if r is None:
+            r = right_index[right] = len(right_nodes)
+            right_nodes.append(right)
+        adjacency[l].append(r)
+
+    match_left = [-1] * len(left_nodes)
+    match_right = [-1] * len(right_nodes)
+    for left, right in matching.items():
+        l = left_index[left]
+        r = right_index[right]
+        match_left[l] = r
+        match_right[r] = l
+
+    _hopcroft_karp(adjacency, match_left, match_right)
+
+    return dict((left_nodes[l], right_nodes[r]) for l, r in enumerate(match_left) if r != -1)
+
+
+def _hopcroft_karp(adjacency: List[List[int]], match_left: List[int], match_right: List[int]) -> None:
+    """Extend a matching to a maximum matching with the Hopcroft-Karp algorithm.
+
+    The left nodes are the indices of *adjacency*, which contains the indices of the adjacent right nodes for each of
+    them. The matching is given by *match_left* and *match_right*, which contain the index of the matched node or -1
+    for every node of the respective part. Both are modified in place.
+    """
+    left_count = len(adjacency)
+    while True:
+        # Layer the left nodes by the length of the shortest alternating path from a free left node
+        distance = [-1] * left_count
+        queue = [l for l in range(left_count) if match_left[l] == -1]
+        for l in queue:
+            distance[l] = 0
+        found_free = False
+        for l in queue:
+            for r in adjacency[l]:
+                other = match_right[r]
+                if other == -1:
+                    found_free = True
+                elif distance[other] == -1:
+                    distance[other] = distance[l] + 1
+                    queue.append(other)
+        if not found_free:
+            return
+
+        # Augment along vertex-disjoint shortest paths found by a depth-first search through the layers
+        next_edge = [0] * left_count
+        for root in range(left_count):
+            if match_left[root] != -1:
+                continue
+            path = [root]
+            while path:
+                l = path[-1]
+                edges = adjacency[l]
+                if next_edge[l] == len(edges):
+                    # Dead end, do not visit this node again in this phase
+                    distance[l] = -1
+                    path.pop()
+                    continue
+                r = edges[next_edge[l]]
+                next_edge[l] += 1
+                other = match_right[r]
+                if other == -1:
+                    for l in reversed(path):
+                        match_left[l], r = r, match_left[l]
+                        match_right[match_left[l]] = l
+                    break
+                if distance[other] == distance[l] + 1:
+                    path.append(other)
+
+
 class _DirectedMatchGraph(Dict[Node, NodeSet], Generic[TLeft, TRight]):
-    def __init__(self, graph: BipartiteGraph[TLeft, TRight, TEdgeValue], matching: Dict[TLeft, TRight]) -> None:
+    def __init__(self, graph: Iterable[Edge], matching: Dict[TLeft, TRight]) -> None:
         super(_DirectedMatchGraph, self).__init__()
         for (tail, head) in graph:
             if tail in matching and matching[tail] == head:
@@ -229,159 +487,534 @@ class _DirectedMatchGraph(Dict[Node, NodeSet], Generic[TLeft, TRight]):
             graph.edge(tail_node, head_node)
         return graph
 
-    def find_cycle(self) -> NodeList:
-        visited = cast(NodeSet, set())
-        for n in self:
-            cycle = self._find_cycle(n, cast(NodeList, []), visited)
-            if cycle:
-                return cycle
-        return cast(NodeList, [])
-
-    def _find_cycle(self, node: Node, path: NodeList, visited: NodeSet) -> NodeList:
-        if node in visited:
-            try:
-                index = path.index(node)
-                return path[index:]
-            except ValueError:
-                return cast(NodeList, [])
-
-        visited.add(node)
-
-        if node not in self:
-            return cast(NodeList, [])
+    def strongly_connected_components(self) -> Dict[Node, int]:
+        """Return the index of the strongly connected component for every node, using Tarjan's algorithm."""
+        index = {}  # type: Dict[Node, int]
+        low_link = {}  # type: Dict[Node, int]
+        components = {}  # type: Dict[Node, int]
+        stack = []  # type: NodeList
+        component_count = 0
+        for root in self:
+            if root in index:
+                continue
+            index[root] = low_link[root] = len(index)
+            stack.append(root)
+            work = [(root, iter(self[root]))]
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = low_link[successor] = len(index)
+                        stack.append(successor)
+                        work.append((successor, iter(self.get(successor, ()))))
+                        break
+                    if successor not in components:
+                        low_link[node] = min(low_link[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low_link[parent] = min(low_link[parent], low_link[node])
+                    if low_link[node] == index[node]:
+                        while True:
+                            member = stack.pop()
+                            components[member] = component_count
+                            if member == node:
+                                break
+                        component_count += 1
+        return components
 
-        for other in self[node]:
-            cycle = self._find_cycle(other, path + [node], visited)
-            if cycle:
-                return cycle
+    def find_cycle(self) -> NodeList:
+        """Find a cycle in the graph with an iterative depth-first search.
 
+        Returns:
+            The nodes of the cycle in the order of its edges or an empty list if the graph has no cycle.
+        """
+        # The nodes on the current search path are in `parents`, but not yet `finished`
+        parents = {}  # type: Dict[Node, Node]
+        finished = cast(NodeSet, set())
+        for root in self:
+            if root in parents:
+                continue
+            parents[root] = root
+            stack = [(root, iter(self[root]))]
+            while stack:
+                node, successors = stack[-1]
+                for successor in successors:
+                    if successor not in parents:
+                        parents[successor] = node
+                        stack.append((successor, iter(self.get(successor, ()))))
+                        break
+                    if successor not in finished:
+                        # The successor is on the current path, so follow the path back to it
+                        cycle = [node]
+                        while node != successor:
+                            node = parents[node]
+                            cycle.append(node)
+                        cycle.reverse()
+                        return cycle
+                else:
+                    finished.add(node)
+                    stack.pop()
         return cast(NodeList, [])
 
 
-def enum_maximum_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue]) -> Iterator[Dict[TLeft, TRight]]:
+def enum_maximum_matchings_iter(graph: Union[BipartiteGraph[TLeft, TRight, TEdgeValue],
+                                              BipartiteGraphView[TLeft, TRight, TEdgeValue]]
+                                ) -> Iterator[Dict[TLeft, TRight]]:
+    """Enumerates all maximum matchings of the bipartite graph or view.
+
+    The graph is not copied. Instead, the enumeration works on a view of it that excludes nodes and edges, so the graph
+    must not be changed during the enumeration.
+    """
     matching = graph.find_matching()
     if matching:
         yield matching
-        graph = graph.__copy__()
-        yield from _enum_maximum_matchings_iter(graph, matching, _DirectedMatchGraph(graph, matching))
+        if isinstance(graph, BipartiteGraphView):
+            view = BipartiteGraphView(
+                graph._base, graph._left, graph._right, set(graph._excluded_left), set(graph._excluded_right),
+                set(graph._excluded_edges)
+            )
+        else:
+            view = BipartiteGraphView(graph, None, None, set(), set(), set())
+        yield from _enum_maximum_matchings_iter(view, matching)
 
 
-def _enum_maximum_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue], matching: Dict[TLeft, TRight],
-                                 directed_match_graph: _DirectedMatchGraph[TLeft, TRight]) \
-        -> Iterator[Dict[TLeft, TRight]]:
+def _enum_maximum_matchings_iter(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue],
+                                 matching: Dict[TLeft, TRight]) -> Iterator[Dict[TLeft, TRight]]:
     # Algorithm described in "Algorithms for Enumerating All Perfect, Maximum and Maximal Matchings in Bipartite Graphs"
     # By Takeaki Uno in "Algorithms and Computation: 8th International Symposium, ISAAC '97 Singapore,
     # December 17-19, 1997 Proceedings"
     # See http://dx.doi.org/10.1007/3-540-63890-3_11
+    #
+    # Instead of copying the graph for the recursive calls, nodes and edges are excluded from the view and included
+    # again afterwards. The view's sets of excluded nodes and edges are modified for this.
 
     # Step 1
-    if len(graph) == 0:
+    # The edges of the view are only collected once, as every pass over them has to check all the exclusions.
+    edges = graph._edge_list()
+    if not edges:
         return
+    directed_match_graph = _DirectedMatchGraph(edges, matching)
+
+    # Trimming
+    # Remove the edges that are not part of any maximum matching. Every edge that remains can be exchanged with a
+    # matching edge, so every recursive call below produces a new matching.
+    trimmed_edges = _trim(graph, edges, matching, directed_match_graph)
+    try:
+        matched = sum(1 for left, right in edges if matching.get(left, _NO_NODE) == right)
+        if len(edges) - len(trimmed_edges) == matched:
+            # Only the matching edges are left
+            return
+
+        # Step 2
+        # Find a circle in the directed matching graph
+        # Note that this circle alternates between nodes from the left and the right part of the graph
+        raw_cycle = directed_match_graph.find_cycle()
 
-    # Step 2
-    # Find a circle in the directed matching graph
-    # Note that this circle alternates between nodes from the left and the right part of the graph
-    raw_cycle = directed_match_graph.find_cycle()
+        if raw_cycle:
+            # Make sure the circle "starts"" in the the left part
+            # If not, start the circle from the second node, which is in the left part
+            if raw_cycle[0][0] != LEFT:
+                cycle = tuple([raw_cycle[-1][1]] + list(x[1] for x in raw_cycle[:-1]))
+            else:
+                cycle = tuple(x[1] for x in raw_cycle)
+
+            # Step 3
+            # Choose the matching edge of the cycle with an endpoint of maximum degree
+            edge = max(
+                (cast(Edge, cycle[i:i + 2]) for i in range(0, len(cycle), 2)),
+                key=lambda e: max(_degree(graph, (LEFT, e[0])), _degree(graph, (RIGHT, e[1])))
+            )
+
+            # Step 4
+            # Construct new matching M' by flipping edges along the cycle, i.e. change the direction of all the
+            # edges in the circle
+            new_match = matching.copy()
+            for i in range(0, len(cycle), 2):
+                new_match[cycle[i]] = cycle[i - 1]  # type: ignore
+
+            # Step 5
+            yield new_match
+
+            # Step 7
+            # Recurse with the new matching M' but without the edge e
+            graph._excluded_edges.add(edge)
+            try:
+                yield from _enum_maximum_matchings_iter(graph, new_match)
+            finally:
+                graph._excluded_edges.remove(edge)
+
+            # Step 6
+            # Recurse with the old matching M but without the edge e and its adjacent nodes
+            _exclude_nodes(graph, edge)
+            try:
+                yield from _enum_maximum_matchings_iter(graph, matching)
+            finally:
+                _include_nodes(graph, edge)
 
-    if raw_cycle:
-        # Make sure the circle "starts"" in the the left part
-        # If not, start the circle from the second node, which is in the left part
-        if raw_cycle[0][0] != LEFT:
-            cycle = tuple([raw_cycle[-1][1]] + list(x[1] for x in raw_cycle[:-1]))
         else:
-            cycle = tuple(x[1] for x in raw_cycle)
-
-        # Step 3 - TODO: Properly find right edge? (to get complexity bound)
-        edge = cast(Edge, cycle[:2])
-
-        # Step 4
-        # already done because we are not really finding the optimal edge
-
-        # Step 5
-        # Construct new matching M' by flipping edges along the cycle, i.e. change the direction of all the
-        # edges in the circle
-        new_match = matching.copy()
-        for i in range(0, len(cycle), 2):
-            new_match[cycle[i]] = cycle[i - 1]  # type: ignore
-
-        yield new_match
-
-        # Construct G+(e) and G-(e)
-        old_value = graph[edge]
-        del graph[edge]
-
-        # Step 7
-        # Recurse with the new matching M' but without the edge e
-        directed_match_graph_minus = _DirectedMatchGraph(graph, new_match)
-
-        yield from _enum_maximum_matchings_iter(graph, new_match, directed_match_graph_minus)
-
-        graph[edge] = old_value
-
-        # Step 6
-        # Recurse with the old matching M but without the edge e
-
-        graph_plus = graph
-
-        edges = []
-        for left, right in list(graph_plus.edges()):
-            if left == edge[0] or right == edge[1]:
-                edges.append((left, right, graph_plus[left, right]))
-                del graph_plus[left, right]
-
-        directed_match_graph_plus = _DirectedMatchGraph(graph_plus, matching)
-
-        yield from _enum_maximum_matchings_iter(graph_plus, matching, directed_match_graph_plus)
-
-        for left, right, value in edges:
-            graph_plus[left, right] = value
-
-    else:
-        # Step 8
-        # Find feasible path of length 2 in D(graph, matching)
-        # This path has the form left1 -> right -> left2
-        # left1 must be in the left part of the graph and in matching
-        # right must be in the right part of the graph
-        # left2 is also in the left part of the graph and but must not be in matching
-        left1 = None  # type: TLeft
-        left2 = None  # type: TLeft
-        right = None  # type: TRight
-
-        for part1, node1 in directed_match_graph:
-            if part1 == LEFT and node1 in matching:
-                left1 = cast(TLeft, node1)
-                right = matching[left1]
-                if (RIGHT, right) in directed_match_graph:
-                    for _, node2 in directed_match_graph[(RIGHT, right)]:
-                        if node2 not in matching:
-                            left2 = cast(TLeft, node2)
-                            break
-                    if left2 is not None:
-                        break
+            # Step 8
+            # Find feasible path of length 2 in D(graph, matching)
+            # This path starts at a node that is not in the matching, continues with an edge that is not in the
+            # matching and ends with a matching edge. After the trimming, every such edge is feasible.
+            # Construct M' by exchanging the two edges of the path.
+            edge, new_match = _find_feasible_path(graph, matching)
+
+            yield new_match
+
+            # Step 9
+            # Recurse with the new matching M' but without the edge e and its adjacent nodes
+            _exclude_nodes(graph, edge)
+            try:
+                yield from _enum_maximum_matchings_iter(graph, new_match)
+            finally:
+                _include_nodes(graph, edge)
+
+            # Step 10
+            # Recurse with the old matching M but without the edge e
+            graph._excluded_edges.add(edge)
+            try:
+                yield from _enum_maximum_matchings_iter(graph, matching)
+            finally:
+                graph._excluded_edges.remove(edge)
+    finally:
+        graph._excluded_edges.difference_update(trimmed_edges)
 
-        if left2 is None:
-            return
 
-        # Construct M'
-        # Exchange the direction of the path left1 -> right -> left2
-        # to left1 <- right <- left2 in the new matching
-        new_match = matching.copy()
-        del new_match[left1]
-        new_match[left2] = right
+def _degree(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue], node: Node) -> int:
+    return sum(1 for _ in graph._neighbours(node))
 
-        yield new_match
 
-        edge = (left2, right)
+def _exclude_nodes(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue], edge: Edge) -> None:
+    """Exclude the nodes of the edge from the view, which must be enumerating the matchings."""
+    graph._excluded_left.add(edge[0])
+    graph._excluded_right.add(edge[1])
 
-        # Construct G+(e) and G-(e)
-        graph_plus = graph.without_nodes(edge)
-        graph_minus = graph.without_edge(edge)
 
-        dgm_plus = _DirectedMatchGraph(graph_plus, new_match)
-        dgm_minus = _DirectedMatchGraph(graph_minus, matching)
+def _include_nodes(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue], edge: Edge) -> None:
+    """Undo `_exclude_nodes()`."""
+    graph._excluded_left.remove(edge[0])
+    graph._excluded_right.remove(edge[1])
 
-        # Step 9
-        yield from _enum_maximum_matchings_iter(graph_plus, new_match, dgm_plus)
 
-        # Step 10
-        yield from _enum_maximum_matchings_iter(graph_minus, matching, dgm_minus)
+def _trim(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue], edges: List[Edge], matching: Dict[TLeft, TRight],
+          directed_match_graph: _DirectedMatchGraph[TLeft, TRight]) -> List[Edge]:
+    """Exclude the edges from the view and the directed match graph that are not part of any maximum matching.
+
+    An edge that is not in the (maximum) matching is part of another maximum matching iff it is on a cycle of the
+    directed match graph or on an even alternating path starting at a node that is not matched.
+
+    Returns:
+        The excluded edges.
+    """
+    matched_right = dict((right, left) for left, right in matching.items())
+
+    # Nodes reachable on alternating paths from unmatched left nodes: left -> right -> matched left -> ...
+    left_reachable = set(left for left, _ in edges if left not in matching)
+    queue = list(left_reachable)
+    for left in queue:
+        for _, right in graph._neighbours((LEFT, left)):
+            other = matched_right.get(right)
+            if other is not None and other not in left_reachable:
+                left_reachable.add(other)
+                queue.append(other)
+
+    # Nodes reachable on alternating paths from unmatched right nodes: right -> left -> matched right -> ...
+    right_reachable = set(right for _, right in edges if right not in matched_right)
+    queue = list(right_reachable)
+    for right in queue:
+        for _, left in graph._neighbours((RIGHT, right)):
+            other = matching.get(left)
+            if other is not None and other not in right_reachable:
+                right_reachable.add(other)
+                queue.append(other)
+
+    candidates = [
+        (left, right) for left, right in edges
+        if matching.get(left, _NO_NODE) != right and left not in left_reachable and right not in right_reachable
+    ]
+    if not candidates:
+        return []
+    components = directed_match_graph.strongly_connected_components()
+    trimmed_edges = []
+    for left, right in candidates:
+        component = components.get((LEFT, left))
+        if component is None or component != components.get((RIGHT, right)):
+            trimmed_edges.append((left, right))
+            directed_match_graph[RIGHT, right].discard((LEFT, left))
+    graph._excluded_edges.update(trimmed_edges)
+    return trimmed_edges
+
+
+def _find_feasible_path(graph: BipartiteGraphView[TLeft, TRight, TEdgeValue],
+                        matching: Dict[TLeft, TRight]) -> Tuple[Edge, Dict[TLeft, TRight]]:
+    """Find an edge that is not in the matching but adjacent to an unmatched node and exchange it with the matching.
+
+    Returns:
+        The edge and the new matching with that edge.
+    """
+    matched_right = dict((right, left) for left, right in matching.items())
+    for left, right in graph.edges():
+        if left not in matching:
+            # left -> right -> matched left
+            new_match = matching.copy()
+            del new_match[matched_right[right]]
+            new_match[left] = right
+            return (left, right), new_match
+        if right not in matched_right:
+            # right -> left -> matched right
+            new_match = matching.copy()
+            new_match[left] = right
+            return (left, right), new_match
+    raise AssertionError('The trimmed graph must contain an edge that is not in the matching')
+
+
+def enum_b_matchings_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue], capacities: Mapping[TLeft, int],
+                          demands: Mapping[TRight, int]) -> Iterator[Dict[Edge, int]]:
+    """Enumerates all b-matchings of the bipartite graph that satisfy the demands of the right nodes.
+
+    A b-matching assigns a multiplicity to every edge, so that the multiplicities of the edges of every left node add
+    up to at most its capacity and the ones of every right node add up to exactly its demand. This corresponds to the
+    perfect matchings of the graph where every node is replaced by as many copies as its capacity or demand. But every
+    assignment is only enumerated once instead of once for every permutation of the copies:
+
+    >>> graph = BipartiteGraph({('a', 0): True, ('a', 1): True, ('b', 1): True})
+    >>> b_matchings = enum_b_matchings_iter(graph, {'a': 3, 'b': 1}, {0: 2, 1: 1})
+    >>> for b_matching in sorted(sorted(b_matching.items()) for b_matching in b_matchings):
+    ...     print(b_matching)
+    [(('a', 0), 2), (('a', 1), 1)]
+    [(('a', 0), 2), (('b', 1), 1)]
+
+    Only the nodes that have a capacity or demand are part of the b-matchings, all other nodes of the graph are ignored.
+
+    Args:
+        graph:
+            The bipartite graph.
+        capacities:
+            The capacities of the left nodes.
+        demands:
+            The demands of the right nodes.
+
+    Yields:
+        Every b-matching as a dictionary that maps the edges with a nonzero multiplicity to the multiplicity.
+    """
+    left_nodes, right_nodes, adjacency, demand = _b_matching_problem(graph, capacities, demands)
+    if not adjacency:
+        yield {}
+        return
+    capacity = [capacities[left] for left in left_nodes]
+    if _b_matching_size(adjacency, demand, capacity) < sum(demand):
+        return
+
+    # The demands of the right nodes are distributed one after another. Since the remaining demands can still be
+    # satisfied after every step, every branch of the search yields a b-matching.
+    distributions = [_distribute(adjacency[0], demand[0], capacity)]
+    counts = [None] * len(adjacency)  # type: List[List[int]]
+    while distributions:
+        r = len(distributions) - 1
+        counts[r] = next(distributions[-1], None)
+        if counts[r] is None:
+            distributions.pop()
+        elif r + 1 == len(adjacency):
+            yield dict(
+                ((left_nodes[l], right_nodes[r]), count)
+                for r, neighbours in enumerate(adjacency) for l, count in zip(neighbours, counts[r]) if count
+            )
+        elif _b_matching_size(adjacency, demand, capacity, r + 1) == sum(demand[r + 1:]):
+            distributions.append(_distribute(adjacency[r + 1], demand[r + 1], capacity))
+
+
+def enum_b_matching_left_counts_iter(graph: BipartiteGraph[TLeft, TRight, TEdgeValue],
+                                     capacities: Mapping[TLeft, int],
+                                     demands: Mapping[TRight, int]) -> Iterator[Dict[TLeft, int]]:
+    """Enumerates how often the left nodes are used by the b-matchings of the bipartite graph.
+
+    See `enum_b_matchings_iter` for the definition of the b-matchings. Many b-matchings can use the left nodes the same
+    number of times and only differ in which right nodes they are assigned to. Here, every distinct combination of the
+    left node counts is only enumerated once:
+
+    >>> graph = BipartiteGraph({('a', 0): True, ('a', 1): True, ('b', 0): True, ('b', 1): True})
+    >>> left_counts = enum_b_matching_left_counts_iter(graph, {'a': 2, 'b': 1}, {0: 1, 1: 1})
+    >>> sorted(sorted(counts.items()) for counts in left_counts)
+    [[('a', 1), ('b', 1)], [('a', 2)]]
+
+    The counts are chosen for one left node after another, from the highest feasible count down to zero. A count is
+    only feasible if the counts chosen so far can be part of a b-matching, so no combination is generated twice and no
+    branch of the search is a dead end.
+
+    Args:
+        graph:
+            The bipartite graph.
+        capacities:
+            The capacities of the left nodes.
+        demands:
+            The demands of the right nodes.
+
+    Yields:
+        Every distinct combination as a dictionary that maps the left nodes to their nonzero counts.
+    """
+    left_nodes, _, adjacency, demand = _b_matching_problem(graph, capacities, demands)
+    if not adjacency:
+        yield {}
+        return
+    limits = [capacities[left] for left in left_nodes]
+    capacity = limits[:]
+    if len(adjacency) == 1:
+        # With a single right node, every b-matching uses the left nodes differently
+        for counts in _distribute(adjacency[0], demand[0], capacity):
+            yield dict((left_nodes[l], count) for l, count in zip(adjacency[0], counts) if count)
+        return
+    total = sum(demand)
+    if _b_matching_size(adjacency, demand, capacity) < total:
+        return
+
+    def choices(l, used):
+        # The chosen counts of the left nodes before l are their capacities and the ones after l have their full
+        # capacities. Then the counts so far can be completed to a b-matching if and only if they can be matched on
+        # their own and a b-matching exists with those capacities. The size of a maximum b-matching only grows with
+        # the capacity of a single left node until it is limited by the other nodes, i.e. it is the minimum of its
+        # size without that node plus the capacity and its size with unlimited capacity. Hence, the feasible counts
+        # form a range whose bounds are found with a single b-matching each.
+        chosen = capacity[:l] + [0] * (len(capacity) - l)
+        chosen[l] = min(limits[l], total - used)
+        highest = _b_matching_size(adjacency, demand, chosen) - used
+        capacity[l] = 0
+        lowest = max(0, total - _b_matching_size(adjacency, demand, capacity))
+        for count in range(highest, lowest - 1, -1):
+            capacity[l] = count
+            yield count
+        capacity[l] = limits[l]
+
+    stack = [choices(0, 0)]
+    used = [0]
+    while stack:
+        l = len(stack) - 1
+        count = next(stack[-1], None)
+        if count is None:
+            stack.pop()
+            used.pop()
+        elif used[l] + count == total:
+            yield dict((left_nodes[i], capacity[i]) for i in range(l + 1) if capacity[i])
+        else:
+            stack.append(choices(l + 1, used[l] + count))
+            used.append(used[l] + count)
+
+
+def _b_matching_problem(graph: BipartiteGraph[TLeft, TRight, TEdgeValue], capacities: Mapping[TLeft, int],
+                        demands: Mapping[TRight, int]) -> Tuple[List[TLeft], List[TRight], List[List[int]], List[int]]:
+    """Index the nodes with a positive capacity or demand.
+
+    Returns:
+        The left nodes, the right nodes, the indices of the left neighbours of every right node and the demands of
+        the right nodes.
+    """
+    left_index = {}  # type: Dict[TLeft, int]
+    left_nodes = []  # type: List[TLeft]
+    right_nodes = []  # type: List[TRight]
+    adjacency = []  # type: List[List[int]]
+    demand = []  # type: List[int]
+    for right, count in demands.items():
+        if count <= 0:
+            continue
+        neighbours = []
+        for _, left in graph._graph.get((RIGHT, right), ()):
+            if capacities.get(left, 0) > 0:
+                l = left_index.get(left)
+                if l is None:
+                    l = left_index[left] = len(left_nodes)
+                    left_nodes.append(left)
+                neighbours.append(l)
+        right_nodes.append(right)
+        adjacency.append(neighbours)
+        demand.append(count)
+    return left_nodes, right_nodes, adjacency, demand
+
+
+def _distribute(neighbours: List[int], amount: int, capacity: List[int]) -> Iterator[List[int]]:
+    """Yield all distributions of the amount to the neighbours that are within their capacities.
+
+    While a distribution is yielded, the capacities are reduced by it. The yielded list is reused for the next one.
+    """
+    n = len(neighbours)
+    limits = [capacity[l] for l in neighbours]
+    room = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        room[i] = room[i + 1] + limits[i]
+    if room[0] < amount:
+        return
+    counts = [0] * n
+    start, rest = 0, amount
+    while True:
+        for i in range(start, n):
+            counts[i] = min(rest, limits[i])
+            rest -= counts[i]
+        for l, count in zip(neighbours, counts):
+            capacity[l] -= count
+        yield counts
+        for l, count in zip(neighbours, counts):
+            capacity[l] += count
+        # Move one unit from the last neighbour that can give one to the neighbours after it
+        rest = 0
+        for i in range(n - 2, -1, -1):
+            rest += counts[i + 1]
+            if counts[i] and room[i + 1] > rest:
+                counts[i] -= 1
+                start, rest = i + 1, rest + 1
+                break
+        else:
+            return
+
+
+def _b_matching_size(adjacency: List[List[int]], demand: List[int], capacity: List[int], start: int=0) -> int:
+    """Compute the size of a maximum b-matching of the right nodes from *start* on within the capacities.
+
+    This computes a maximum flow with augmenting paths that alternate between the right and left nodes. Once no
+    augmenting path starts at a right node, none will later, so every right node is only augmented until it fails.
+    """
+    size = 0
+    used = [0] * len(capacity)
+    flows = [{} for _ in capacity]  # type: List[Dict[int, int]]
+    for r in range(start, len(adjacency)):
+        missing = demand[r]
+        while missing:
+            left_parent = {}  # type: Dict[int, int]
+            right_parent = {r: -1}
+            queue = [r]
+            found = -1
+            for right in queue:
+                for l in adjacency[right]:
+                    if l in left_parent:
+                        continue
+                    left_parent[l] = right
+                    if used[l] < capacity[l]:
+                        found = l
+                        break
+                    for other in flows[l]:
+                        if other not in right_parent:
+                            right_parent[other] = l
+                            queue.append(other)
+                if found != -1:
+                    break
+            if found == -1:
+                break
+            amount = min(missing, capacity[found] - used[found])
+            right = left_parent[found]
+            while right != r:
+                l = right_parent[right]
+                amount = min(amount, flows[l][right])
+                right = left_parent[l]
+            used[found] += amount
+            l = found
+            while True:
+                right = left_parent[l]
+                flows[l][right] = flows[l].get(right, 0) + amount
+                if right == r:
+                    break
+                l = right_parent[right]
+                flows[l][right] -= amount
+                if not flows[l][right]:
+                    del flows[l][right]
+            missing -= amount
+            size += amount
+    return size
@@ -36,7 +36,9 @@ import html
 import itertools
 from collections import deque
 from operator import itemgetter
-from typing import Container, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, Union
+from typing import (
+    Container, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, Union
+)
 
 try:
     from graphviz import Digraph, Graph
@@ -48,16 +50,19 @@ from multiset import Multiset
 from ..expressions.expressions import (
     Expression, Operation, Symbol, SymbolWildcard, Wildcard, Pattern, AssociativeOperation, CommutativeOperation, OneIdentityOperation
 )
-from ..expressions.substitution import Substitution
+from ..expressions.substitution import Substitution, VariableReplacement
+from ..expressions.constraints import Constraint
 from ..expressions.functions import (
-    is_anonymous, contains_variables_from_set, create_operation_expression, preorder_iter_with_position,
-    rename_variables, op_iter, preorder_iter, op_len
+    is_anonymous, contains_variables_from_set, rename_variables, op_iter, preorder_iter, op_len
+)
+from ..utils import (
+    VariableWithCount, commutative_sequence_variable_partition_iter, commutative_sequence_variable_partition_count
 )
-from ..utils import (VariableWithCount, commutative_sequence_variable_partition_iter)
 from .. import functions
-from .bipartite import BipartiteGraph, enum_maximum_matchings_iter, LEFT
+from .bipartite import BipartiteGraph, enum_b_matchings_iter, enum_b_matching_left_counts_iter
 from .syntactic import OPERATION_END, is_operation
 from ._common import check_one_identity
+from .one_to_one import SubjectIndex
 
 __all__ = ['ManyToOneMatcher', 'ManyToOneReplacer']
 
@@ -83,20 +88,64 @@ _Transition = NamedTuple('_Transition', [
     ('subst', Substitution),
 ])  # yapf: disable
 
+_FrozenTransition = NamedTuple('_FrozenTransition', [
+    ('label', LabelType),
+    ('target', int),
+    ('variable_name', Optional[str]),
+    ('patterns', int),
+    ('check_constraints', Optional[Tuple[int, ...]]),
+    ('subst', Optional[Tuple[Tuple[str, VariableReplacement], ...]]),
+])  # yapf: disable
+
+_FrozenAutomaton = NamedTuple('_FrozenAutomaton', [
+    ('transitions', Tuple[Dict[HeadType, Tuple[_FrozenTransition, ...]], ...]),
+    ('matchers', Tuple[Optional['CommutativeMatcher'], ...]),
+    ('numbers', Tuple[int, ...]),
+    ('finals', FrozenSet[int]),
+    ('constraints', Tuple[Tuple[Constraint, int], ...]),
+    ('constraint_vars', Dict[str, Tuple[int, ...]]),
+])  # yapf: disable
+
 
 _VISITED = set()
 
+# Kinds of tasks on the stack of _MatchIter._match
+_TRANSITION, _CHECK, _UNDO, _SEQUENCE, _WILDCARD, _COMMUTATIVE, _RESUME, _EXIT = range(8)
+
+# Cache for the heads of the expression types in _MatchIter._get_heads
+_TYPE_HEADS = {}  # type: Dict[type, Tuple[List[type], bool]]
+
+
+def _iter_bits(mask: int) -> Iterator[int]:
+    """Yield the indices of the set bits in the mask in ascending order."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
 class _MatchIter:
-    def __init__(self, matcher, subject, intial_associative=None):
+    def __init__(self, matcher, subject, intial_associative=None, collapse=False, subject_rows=None):
         self.matcher = matcher
+        matcher.freeze()
+        self.automaton = matcher._frozen
         self.subjects = deque([subject]) if subject is not None else deque()
-        self.patterns = set(range(len(matcher.patterns)))
+        # The remaining patterns and unchecked constraints are stored as bitmasks of their indices
+        self.patterns = (1 << len(matcher.patterns)) - 1
         self.substitution = Substitution()
-        self.constraints = set(range(len(matcher.constraints)))
+        self.constraints = (1 << len(matcher.constraints)) - 1
         self.associative = [intial_associative]
+        # When collapse is set, the sequence variable distributions of commutative operations are counted instead of
+        # enumerated if their values can never be observed. The number of matches that each reached final state
+        # represents is tracked in multiplicity.
+        self.collapse = collapse
+        self.multiplicity = 1
+        # When matching many subjects in one pass, this maps the commutative matchers to the rows of the subjects that
+        # were already added to them, by identity of the subject. See CommutativeMatcher._subject_rows().
+        self.subject_rows = subject_rows
 
     def __iter__(self):
-        for _ in self._match(self.matcher.root):
+        for _ in self._match():
             yield from self._internal_iter()
 
     def grouped(self):
@@ -108,7 +157,7 @@ class _MatchIter:
         Yields:
             The grouped matches.
         """
-        for _ in self._match(self.matcher.root):
+        for _ in self._match():
             yield list(self._internal_iter())
 
     def any(self):
@@ -123,7 +172,7 @@ class _MatchIter:
         return True
 
     def _internal_iter(self):
-        for pattern_index in self.patterns:
+        for pattern_index in _iter_bits(self.patterns):
             renaming = self.matcher.pattern_vars[pattern_index]
             new_substitution = self.substitution.rename({renamed: original for original, renamed in renaming.items()})
             pattern, label, _ = self.matcher.patterns[pattern_index]
@@ -135,192 +184,296 @@ class _MatchIter:
             if valid:
                 yield label, new_substitution
 
-    def _match(self, state: _State) -> Iterator[_State]:
-        _VISITED.add(state.number)
-        if len(self.subjects) == 0:
-            if state.number in self.matcher.finals or OPERATION_END in state.transitions:
-                yield state
-            heads = [None]
-        else:
-            heads = list(self._get_heads(self.subjects[0]))
-        for head in heads:
-            for transition in state.transitions.get(head, []):
-                yield from self._match_transition(transition)
+    def _check_global_constraints(self, pattern_index):
+        renaming = self.matcher.pattern_vars[pattern_index]
+        substitution = self.substitution.rename({renamed: original for original, renamed in renaming.items()})
+        pattern = self.matcher.patterns[pattern_index][0]
+        return all(constraint(substitution) for constraint in pattern.global_constraints)
+
+    def _match(self, state: int=0) -> Iterator[int]:
+        """Yield every state in which all subjects have been consumed, starting the search from the given state.
+
+        The automaton is traversed depth-first using an explicit stack of tasks instead of a chain of nested
+        generators, so the cost of yielding a state does not grow with the nesting depth of the subject. Every change
+        to the match state is reverted by an undo task, which is placed on the stack below the tasks exploring the
+        rest of the search space behind the change. Hence, the match state is the same when a task is taken from the
+        stack as when it was put there. The operations which are currently being matched are kept on a separate stack,
+        so that reaching the end of their operands can be handled right where it happens.
+        """
+        stack = []
+        operations = []
+        tables = self.automaton.transitions
+        finals = self.automaton.finals
+        while True:
+            if state is None:
+                if not stack:
+                    return
+                task = stack.pop()
+                kind = task[0]
+                if kind == _TRANSITION:
+                    state = self._match_transition(stack, operations, task[1])
+                elif kind == _UNDO:
+                    self._undo(task)
+                elif kind == _CHECK:
+                    state = self._check_transition(stack, task[1], task[2], task[3])
+                elif kind == _SEQUENCE:
+                    state = self._match_sequence_variable(stack, task[1], task[2])
+                elif kind == _WILDCARD:
+                    if self.subjects:
+                        state = self._check_transition(stack, task[1], self.subjects.popleft())
+                elif kind == _COMMUTATIVE:
+                    state = self._match_commutative_operation(stack, task)
+                elif kind == _RESUME:
+                    context = task[1]
+                    self.subjects = context[1]
+                    self.associative.append(context[2])
+                    operations.append(context)
+                else:  # kind == _EXIT
+                    context = operations.pop()
+                    self.subjects = context[0]
+                    self.subjects.appendleft(task[1])
+                    self.associative.pop()
+                continue
 
-    def _match_transition(self, transition: _Transition) -> Iterator[_State]:
-        if self.patterns.isdisjoint(transition.patterns):
-            return
+            _VISITED.add(self.automaton.numbers[state])
+            subjects = self.subjects
+            patterns = self.patterns
+            table = tables[state]
+            for head in reversed(self._get_heads(subjects[0])) if subjects else (None, ):
+                transitions = table.get(head)
+                if transitions:
+                    for transition in reversed(transitions):
+                        if patterns & transition.patterns:
+                            stack.append((_TRANSITION, transition))
+            if not subjects and (state in finals or OPERATION_END in table):
+                if not operations:
+                    yield state
+                else:
+                    # End of the operands of the innermost operation: Continue after the operation and afterwards
+                    # resume with the operands to try the remaining transitions
+                    context = operations.pop()
+                    self.subjects = context[0]
+                    self.associative.pop()
+                    stack.append((_RESUME, context))
+                    end_transitions = table[OPERATION_END]
+                    for transition in reversed(end_transitions[1:]):
+                        stack.append((_CHECK, transition, None, False))
+                    state = self._check_transition(stack, end_transitions[0], None, False)
+                    continue
+            state = None
+
+    def _match_transition(self, stack, operations, transition: _FrozenTransition) -> Optional[int]:
         label = transition.label
         if label is _EPS:
             subject = self.subjects[0] if self.subjects else None
-            yield from self._check_transition(transition, subject, False)
-            return
+            return self._check_transition(stack, transition, subject, False)
         if is_operation(label):
-            if transition.target.matcher:
-                yield from self._match_commutative_operation(transition.target)
-            else:
-                yield from self._match_regular_operation(transition)
-            return
+            if self.automaton.matchers[transition.target] is not None:
+                return self._match_commutative_operation(stack, (_COMMUTATIVE, transition.target, None))
+            return self._match_regular_operation(stack, operations, transition)
         if isinstance(label, Wildcard) and not isinstance(label, SymbolWildcard):
             min_count = label.min_count
-            if label.optional is not None and min_count > 0:
-                yield from self._check_transition(transition, label.optional, False)
             if label.fixed_size and not self.associative[-1]:
                 assert min_count == 1, "Fixed wildcards with length != 1 are not supported."
-                if not self.subjects:
-                    return
+                if label.optional is None:
+                    if not self.subjects:
+                        return None
+                    return self._check_transition(stack, transition, self.subjects.popleft())
+                stack.append((_WILDCARD, transition))
+            elif label.optional is None or min_count == 0:
+                return self._match_sequence_variable(stack, transition, None)
             else:
-                yield from self._match_sequence_variable(label, transition)
-                return
+                stack.append((_SEQUENCE, transition, None))
+            return self._check_transition(stack, transition, label.optional, False)
         subject = self.subjects.popleft() if self.subjects else None
-        yield from self._check_transition(transition, subject)
-
-    def _check_transition(self, transition, subject, restore_subject=True):
-        if self.patterns.isdisjoint(transition.patterns):
-            return
-        restore_constraints = set()
-        restore_patterns = self.patterns - transition.patterns
-        self.patterns &= transition.patterns
-        old_values = {}
-        try:
-            if transition.subst is not None:
-                try:
-                    for name, value in transition.subst.items():
-                        old_values[name] = self.substitution.get(name, None)
-                        self.substitution.try_add_variable(name, value)
-                except ValueError:
-                    for k, v in old_values.items():
-                        if v is None:
-                            del self.substitution[k]
-                        else:
-                            self.substitution[k] = v
-                    return
-
-            if transition.variable_name is not None:
-                try:
-                    old_values[transition.variable_name] = self.substitution.get(transition.variable_name, None)
-                    self.substitution.try_add_variable(transition.variable_name, subject)
-                except ValueError:
-                    return
-                self._check_constraints(transition.check_constraints, restore_constraints, restore_patterns)
-                if not self.patterns:
-                    return
+        return self._check_transition(stack, transition, subject)
 
-            yield from self._match(transition.target)
-
-        finally:
+    def _check_transition(self, stack, transition: _FrozenTransition, subject, restore_subject=True
+                          ) -> Optional[int]:
+        _, target, variable_name, transition_patterns, check_constraints, subst = transition
+        old_patterns = self.patterns
+        if not old_patterns & transition_patterns:
             if restore_subject and subject is not None:
                 self.subjects.appendleft(subject)
-            self.constraints |= restore_constraints
-            self.patterns |= restore_patterns
-            for k, v in old_values.items():
-                if v is None:
-                    del self.substitution[k]
-                else:
-                    self.substitution[k] = v
+            return None
+        old_constraints = self.constraints
+        old_values = {}
+        undo = (_UNDO, subject if restore_subject else None, old_patterns, old_constraints, old_values)
+        self.patterns = old_patterns & transition_patterns
+        if subst is not None:
+            try:
+                for name, value in subst:
+                    old_values[name] = self.substitution.get(name, None)
+                    self.substitution.try_add_variable(name, value)
+            except ValueError:
+                self._undo(undo)
+                return None
 
-    def _check_constraints(self, variable: str, restore_constraints, restore_patterns) -> bool:
+        if variable_name is not None:
+            try:
+                old_values[variable_name] = self.substitution.get(variable_name, None)
+                self.substitution.try_add_variable(variable_name, subject)
+            except ValueError:
+                self._undo(undo)
+                return None
+            self._check_constraints(check_constraints)
+            if not self.patterns:
+                self._undo(undo)
+                return None
+
+        if self.patterns != old_patterns or old_values or undo[1] is not None:
+            stack.append(undo)
+        return target
+
+    def _undo(self, undo) -> None:
+        _, subject, self.patterns, self.constraints, old_values = undo
+        if subject is not None:
+            self.subjects.appendleft(subject)
+        for k, v in old_values.items():
+            if v is None:
+                del self.substitution[k]
+            else:
+                self.substitution[k] = v
+
+    def _check_constraints(self, variable: Union[str, Tuple[int, ...]]) -> None:
         if isinstance(variable, str):
-            check_constraints = self.matcher.constraint_vars.get(variable, [])
+            check_constraints = self.automaton.constraint_vars.get(variable, ())
         else:
             check_constraints = variable
         variables = set(self.substitution.keys())
+        constraints = self.automaton.constraints
         for constraint_index in check_constraints:
-            if constraint_index not in self.constraints:
+            constraint_bit = 1 << constraint_index
+            if not self.constraints & constraint_bit:
                 continue
-            constraint, patterns = self.matcher.constraints[constraint_index]
-            if constraint.variables <= variables and not self.patterns.isdisjoint(patterns):
-                self.constraints.remove(constraint_index)
-                restore_constraints.add(constraint_index)
+            constraint, patterns = constraints[constraint_index]
+            if constraint.variables <= variables and self.patterns & patterns:
+                self.constraints &= ~constraint_bit
                 if not constraint(self.substitution):
-                    restore_patterns |= self.patterns & patterns
-                    self.patterns -= patterns
+                    self.patterns &= ~patterns
                     if not self.patterns:
                         break
 
     @staticmethod
-    def _get_heads(expression: Expression) -> Iterator[HeadType]:
-        for base in type(expression).__mro__:
-            if base is not object:
-                yield base
-        if not isinstance(expression, Operation):
-            yield expression
-        yield None
-
-    def _match_sequence_variable(self, wildcard: Wildcard, transition: _Transition) -> Iterator[_State]:
-        min_count = wildcard.min_count
-        if len(self.subjects) < min_count:
-            return
-        matched_subject = []
-        for _ in range(min_count):
+    def _get_heads(expression: Expression) -> List[HeadType]:
+        expression_type = type(expression)
+        try:
+            bases, is_operation_type = _TYPE_HEADS[expression_type]
+        except KeyError:
+            bases = [base for base in expression_type.__mro__ if base is not object]
+            is_operation_type = issubclass(expression_type, Operation)
+            _TYPE_HEADS[expression_type] = bases, is_operation_type
+        if is_operation_type:
+            return bases + [None]
+        return bases + [expression, None]
+
+    def _match_sequence_variable(self, stack, transition: _FrozenTransition, matched_subject: Optional[list]
+                                 ) -> Optional[int]:
+        wildcard = transition.label
+        if matched_subject is None:
+            min_count = wildcard.min_count
+            if len(self.subjects) < min_count:
+                return None
+            matched_subject = [self.subjects.popleft() for _ in range(min_count)]
+        elif self.subjects:
             matched_subject.append(self.subjects.popleft())
-        while True:
-            if self.associative[-1] and wildcard.fixed_size:
-                assert min_count == 1, "Fixed wildcards with length != 1 are not supported."
-                if len(matched_subject) > 1:
-                    wrapped = self.associative[-1](*matched_subject)
-                else:
-                    wrapped = matched_subject[0]
+        else:
+            self.subjects.extendleft(reversed(matched_subject))
+            return None
+        if self.associative[-1] and wildcard.fixed_size:
+            assert wildcard.min_count == 1, "Fixed wildcards with length != 1 are not supported."
+            if len(matched_subject) > 1:
+                wrapped = self.associative[-1](*matched_subject)
             else:
-                if len(matched_subject) == 0 and wildcard.optional is not None:
-                    wrapped = wildcard.optional
-                else:
-                    wrapped = tuple(matched_subject)
-            yield from self._check_transition(transition, wrapped, False)
-            if not self.subjects:
+                wrapped = matched_subject[0]
+        else:
+            if len(matched_subject) == 0 and wildcard.optional is not None:
+                wrapped = wildcard.optional
+            else:
+                wrapped = tuple(matched_subject)
+        # Try to match one more subject once the current length has been explored
+        stack.append((_SEQUENCE, transition, matched_subject))
+        return self._check_transition(stack, transition, wrapped, False)
+
+    def _match_commutative_operation(self, stack, task) -> Optional[int]:
+        _, state, frame = task
+        if frame is None:
+            subject = self.subjects.popleft()
+            matcher = self.automaton.matchers[state]
+            matcher.add_subject(None)
+            if self.subject_rows is None:
+                rows = [matcher._add_subject(operand) for operand in op_iter(subject)]
+            else:
+                rows = matcher._subject_rows(subject, self.subject_rows.setdefault(id(matcher), {}))
+            occurrences = self._variable_occurrences() if self.collapse else None
+            matches = matcher._match(subject, self.substitution, occurrences, rows)
+            frame = (subject, self.substitution, self.multiplicity, matches, self.patterns, self.constraints)
+            task = (_COMMUTATIVE, state, frame)
+        subject, substitution, multiplicity, matches, self.patterns, self.constraints = frame
+        try:
+            matched_pattern, new_substitution, count = next(matches)
+        except StopIteration:
+            self.substitution = substitution
+            self.multiplicity = multiplicity
+            self.subjects.appendleft(subject)
+            return None
+        self.multiplicity = multiplicity * count
+        diff = set(new_substitution.keys()) - set(substitution.keys())
+        self.substitution = new_substitution
+        transition_set = self.automaton.transitions[state][matched_pattern]
+        potential_patterns = 0
+        for transition in transition_set:
+            potential_patterns |= transition.patterns
+        self.patterns &= potential_patterns
+        for variable in diff:
+            self._check_constraints(variable)
+            if not self.patterns:
                 break
-            matched_subject.append(self.subjects.popleft())
-        self.subjects.extendleft(reversed(matched_subject))
-
-    def _match_commutative_operation(self, state: _State) -> Iterator[_State]:
-        subject = self.subjects.popleft()
-        matcher = state.matcher
-        substitution = self.substitution
-        matcher.add_subject(None)
-        for operand in op_iter(subject):
-            matcher.add_subject(operand)
-        for matched_pattern, new_substitution in matcher.match(subject, substitution):
-            restore_constraints = set()
-            diff = set(new_substitution.keys()) - set(substitution.keys())
-            self.substitution = new_substitution
-            transition_set = state.transitions[matched_pattern]
-            t_iter = iter(t.patterns for t in transition_set)
-            potential_patterns = next(t_iter).union(*t_iter)
-            restore_patterns = self.patterns - potential_patterns
-            self.patterns &= potential_patterns
-            for variable in diff:
-                self._check_constraints(variable, restore_constraints, restore_patterns)
-                if not self.patterns:
-                    break
-            if self.patterns:
-                transition_set = state.transitions[matched_pattern]
-                for next_transition in transition_set:
-                    yield from self._check_transition(next_transition, subject, False)
-            self.constraints |= restore_constraints
-            self.patterns |= restore_patterns
-        self.substitution = substitution
-        self.subjects.appendleft(subject)
-
-    def _match_regular_operation(self, transition: _Transition) -> Iterator[_State]:
+        # Continue with the next match of the commutative matcher once the current one has been explored
+        stack.append(task)
+        if self.patterns:
+            for transition in reversed(transition_set):
+                stack.append((_CHECK, transition, subject, False))
+        return None
+
+    def _variable_occurrences(self) -> Optional[Dict[str, int]]:
+        """Return the maximum number of occurrences of each variable in the remaining patterns.
+
+        Variables that are checked by a constraint count as occurring infinitely often. If any of the remaining
+        patterns has a global constraint, all variables are observable and ``None`` is returned.
+        """
+        occurrences = {}
+        for pattern_index in _iter_bits(self.patterns):
+            pattern_occurrences = self.matcher.variable_occurrences[pattern_index]
+            if pattern_occurrences is None:
+                return None
+            for name, count in pattern_occurrences.items():
+                if count > occurrences.get(name, 0):
+                    occurrences[name] = count
+        return occurrences
+
+    def _match_regular_operation(self, stack, operations, transition: _FrozenTransition) -> Optional[int]:
         subject = self.subjects.popleft()
-        after_subjects = self.subjects
-        operand_subjects = self.subjects = deque(op_iter(subject))
-        new_associative = transition.label if issubclass(transition.label, AssociativeOperation) else None
+        label = transition.label
+        new_associative = label if issubclass(label, AssociativeOperation) else None
+        context = (self.subjects, deque(op_iter(subject)), new_associative)
+        self.subjects = context[1]
         self.associative.append(new_associative)
-        for new_state in self._check_transition(transition, subject, False):
-            self.subjects = after_subjects
-            self.associative.pop()
-            for end_transition in new_state.transitions[OPERATION_END]:
-                yield from self._check_transition(end_transition, None, False)
-            self.subjects = operand_subjects
-            self.associative.append(new_associative)
-        self.subjects = after_subjects
-        self.subjects.appendleft(subject)
-        self.associative.pop()
+        operations.append(context)
+        stack.append((_EXIT, subject))
+        return self._check_transition(stack, transition, subject, False)
+
+
+def _postorder_key(subexpression_with_position):
+    """Sort key for positions which orders them in postorder, i.e. every position after its descendants."""
+    return subexpression_with_position[1] + (math.inf, )
 
 
 class ManyToOneMatcher:
-    __slots__ = ('patterns', 'states', 'root', 'pattern_vars', 'constraints', 'constraint_vars', 'finals', 'rename')
+    __slots__ = (
+        'patterns', 'states', 'root', 'pattern_vars', 'constraints', 'constraint_vars', 'finals', 'rename',
+        'variable_occurrences', '_frozen'
+    )
 
     _state_id = 0
 
@@ -337,6 +490,8 @@ class ManyToOneMatcher:
         self.constraint_vars = {}
         self.finals = set()
         self.rename = rename
+        self.variable_occurrences = []
+        self._frozen = None
 
         for pattern in patterns:
             self.add(pattern)
@@ -378,11 +533,13 @@ class ManyToOneMatcher:
         Returns:
             The internal id for the pattern. This is mainly used by the :class:`CommutativeMatcher`.
         """
+        self._frozen = None
         pattern_index = len(self.patterns)
         renamed_constraints = [c.with_renamed_vars(renaming) for c in pattern.local_constraints]
         constraint_indices = [self._add_constraint(c, pattern_index) for c in renamed_constraints]
         self.patterns.append((pattern, label, constraint_indices))
         self.pattern_vars.append(renaming)
+        self.variable_occurrences.append(self._get_variable_occurrences(pattern, renaming))
         pattern = rename_variables(pattern.expression, renaming)
         state = self.root
         patterns_stack = [deque([pattern])]
@@ -416,6 +573,15 @@ class ManyToOneMatcher:
                     state = self._create_simple_transition(state, OPERATION_END, pattern_index)
         self.finals.add(state.number)
 
+    @staticmethod
+    def _get_variable_occurrences(pattern: Pattern, renaming: Dict[str, str]) -> Optional[Dict[str, int]]:
+        if pattern.global_constraints or not isinstance(pattern.expression, Expression):
+            return None
+        occurrences = dict((renaming.get(n, n), c) for n, c in pattern.expression.variables.items())
+        for constraint in pattern.local_constraints:
+            for name in constraint.variables:
+                occurrences[renaming.get(name, name)] = math.inf
+        return occurrences
 
     def _add_constraint(self, constraint, pattern):
         index = None
@@ -431,6 +597,57 @@ class ManyToOneMatcher:
             self.constraint_vars.setdefault(var, set()).add(index)
         return index
 
+    def freeze(self) -> None:
+        """Compile the automaton into compact, read-only tables that are used for matching.
+
+        The states are numbered consecutively and the transitions of each state are stored as tuples grouped by their
+        head. The sets of patterns and constraints are replaced by integer bitmasks and equal labels are shared. The
+        automata of nested commutative operations are frozen as well.
+
+        Matching compiles the automaton on demand, so calling this is optional. Calling it once all patterns have been
+        added avoids the compilation during the first match, e.g. before the matcher is shared with forked workers.
+        Adding another pattern discards the frozen tables and they are compiled again when needed.
+
+        Note that the tables are not completely read-only during matching: The matchers of nested commutative
+        operations cache the matches of every subject operand they encounter, so that they can be reused across
+        calls to :meth:`match`. These caches grow with the number of distinct subject operands and are written to
+        by each worker, so they are not shared between forked workers.
+        """
+        if self._frozen is not None:
+            return
+        ids = dict((state.number, state_id) for state_id, state in enumerate(self.states))
+        labels = {}
+        transitions = []
+        for state in self.states:
+            if state.matcher is not None:
+                state.matcher.automaton.freeze()
+            table = {}
+            for head, head_transitions in state.transitions.items():
+                table[labels.setdefault(head, head)] = tuple(
+                    _FrozenTransition(
+                        labels.setdefault(t.label, t.label), ids[t.target.number], t.variable_name,
+                        self._get_mask(t.patterns),
+                        tuple(sorted(t.check_constraints)) if t.check_constraints is not None else None,
+                        tuple(t.subst.items()) if t.subst is not None else None
+                    ) for t in head_transitions
+                )
+            transitions.append(table)
+        self._frozen = _FrozenAutomaton(
+            tuple(transitions),
+            tuple(state.matcher for state in self.states),
+            tuple(state.number for state in self.states),
+            frozenset(ids[number] for number in self.finals),
+            tuple((constraint, self._get_mask(patterns)) for constraint, patterns in self.constraints),
+            dict((name, tuple(sorted(indices))) for name, indices in self.constraint_vars.items()),
+        )
+
+    @staticmethod
+    def _get_mask(indices: Iterable[int]) -> int:
+        mask = 0
+        for index in indices:
+            mask |= 1 << index
+        return mask
+
     def match(self, subject: Expression) -> Iterator[Tuple[Expression, Substitution]]:
         """Match the subject against all the matcher's patterns.
 
@@ -454,6 +671,123 @@ class ManyToOneMatcher:
         """
         return _MatchIter(self, subject).any()
 
+    def count_matches(self, subject: Expression) -> Iterator[Tuple[Expression, int]]:
+        """Count the matches of every pattern without constructing their substitutions.
+
+        The substitutions are neither renamed nor copied. Distributions of sequence variables in commutative
+        operations are counted combinatorially if their value does not influence the match, i.e. the variable occurs
+        nowhere else in the pattern and no constraint depends on it.
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(___, ___)))
+        >>> for pattern, count in matcher.count_matches(f(a, b)):
+        ...     print(pattern, count)
+        f(a, x_) 1
+        f(___, ___) 3
+
+        Args:
+            subject: The subject to match.
+
+        Yields:
+            For every pattern that matches at least once, a tuple of the pattern's label and its number of matches.
+        """
+        match_iter = _MatchIter(self, subject, collapse=True)
+        counts = [0] * len(self.patterns)
+        for _ in match_iter._match():
+            for pattern_index in _iter_bits(match_iter.patterns):
+                pattern = self.patterns[pattern_index][0]
+                if pattern.global_constraints and not match_iter._check_global_constraints(pattern_index):
+                    continue
+                counts[pattern_index] += match_iter.multiplicity
+        for (_, label, _), count in zip(self.patterns, counts):
+            if count:
+                yield label, count
+
+    def matching_labels(self, subject: Expression) -> Iterator[Expression]:
+        """Yield the label of every pattern that matches the subject.
+
+        Each label is only yielded once per matching pattern and no substitutions are constructed for the caller.
+        The search stops early once every pattern has matched.
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(___, ___)), Pattern(f(b, x_)))
+        >>> for pattern in matcher.matching_labels(f(a, b)):
+        ...     print(pattern)
+        f(a, x_)
+        f(___, ___)
+
+        Args:
+            subject: The subject to match.
+
+        Yields:
+            The labels of the matching patterns.
+        """
+        found = 0
+        match_iter = _MatchIter(self, subject)
+        all_patterns = (1 << len(self.patterns)) - 1
+        for _ in match_iter._match():
+            for pattern_index in _iter_bits(match_iter.patterns & ~found):
+                pattern, label, _ = self.patterns[pattern_index]
+                if pattern.global_constraints and not match_iter._check_global_constraints(pattern_index):
+                    continue
+                found |= 1 << pattern_index
+                yield label
+            if found == all_patterns:
+                return
+
+    def match_anywhere(self, subject: Union[Expression, SubjectIndex]
+                      ) -> Iterator[Tuple[Tuple[int, ...], LabelType, Substitution]]:
+        """Match all the matcher's patterns against every subexpression of the subject.
+
+        >>> matcher = ManyToOneMatcher(Pattern(f(a, x_)), Pattern(f(x_, b)))
+        >>> for position, pattern, substitution in matcher.match_anywhere(f(f(a, b), f(f(a, b), b))):
+        ...     print(position, pattern, substitution)
+        (0,) f(a, x_) {x ↦ b}
+        (0,) f(x_, b) {x ↦ a}
+        (1, 0) f(a, x_) {x ↦ b}
+        (1, 0) f(x_, b) {x ↦ a}
+        (1,) f(x_, b) {x ↦ f(a, b)}
+
+        The subject is processed bottom-up in a single pass, i.e. the subexpressions are matched in postorder. Only
+        subexpressions whose head fits the head of any pattern are matched. A subexpression instance that occurs at
+        multiple positions, e.g. because the subject shares it, is only matched once and its matches are yielded for
+        every position. The results of the commutative operations' operands are cached in the matcher, so they are
+        reused for the parents and for other subexpressions with equal operands.
+
+        To search the same subject with multiple matchers, pass a :class:`~matchpy.matching.one_to_one.SubjectIndex`
+        of it, so that the subject is only indexed once.
+
+        Args:
+            subject: The subject to match or an index of it.
+
+        Yields:
+            For every match, a tuple of the position of the matching subexpression, the matching pattern's label and
+            the match substitution.
+
+        Raises:
+            ValueError:
+                If the subject is not constant.
+        """
+        index = subject if isinstance(subject, SubjectIndex) else SubjectIndex(subject)
+        if not self.patterns:
+            return
+        candidates = list(index.candidates(*(pattern for pattern, _, _ in self.patterns)))
+        candidates.sort(key=_postorder_key)
+        occurrences = {}
+        for subexpression, _ in candidates:
+            occurrences[id(subexpression)] = occurrences.get(id(subexpression), 0) + 1
+        shared_matches = {}
+        subject_rows = {}
+        for subexpression, position in candidates:
+            if occurrences[id(subexpression)] == 1:
+                for label, substitution in _MatchIter(self, subexpression, subject_rows=subject_rows):
+                    yield position, label, substitution
+                continue
+            matches = shared_matches.get(id(subexpression))
+            if matches is None:
+                matches = list(_MatchIter(self, subexpression, subject_rows=subject_rows))
+                shared_matches[id(subexpression)] = matches
+            for label, substitution in matches:
+                yield position, label, Substitution(substitution)
+
     def _create_expression_transition(
             self, state: _State, expression: Expression, variable_name: Optional[str], index: int, subst=None
     ) -> _State:
@@ -770,9 +1104,10 @@ class ManyToOneReplacer:
             rule:
                 The rule to add.
         """
-        self.matcher.add(rule.pattern, rule.replacement)
+        self.matcher.add(rule.pattern, rule)
 
-    def replace(self, expression: Expression, max_count: int=math.inf) -> Union[Expression, Sequence[Expression]]:
+    def replace(self, expression: Expression, max_count: int=math.inf,
+                trace: Optional['functions.RewriteTrace']=None) -> Union[Expression, Sequence[Expression]]:
         """Replace all occurrences of the patterns according to the replacement rules.
 
         Args:
@@ -782,28 +1117,47 @@ class ManyToOneReplacer:
                 If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
                 are applied until there is no more match. If the set of replacement rules is not confluent,
                 the replacement might not terminate without a *max_count* set.
+            trace:
+                An optional :class:`~matchpy.functions.RewriteTrace` that records the applied rules.
 
         Returns:
             The resulting expression after the application of the replacement rules. This can also be a sequence of
             expressions, if the root expression is replaced with a sequence of expressions by a rule.
         """
-        replaced = True
-        replace_count = 0
-        while replaced and replace_count < max_count:
-            replaced = False
-            for subexpr, pos in preorder_iter_with_position(expression):
-                try:
-                    replacement, subst = next(iter(self.matcher.match(subexpr)))
-                    result = replacement(**subst)
-                    expression = functions.replace(expression, pos, result)
-                    replaced = True
-                    break
-                except StopIteration:
-                    pass
-            replace_count += 1
-        return expression
+        return functions._replace_all_incremental(expression, self._find_rule, max_count, trace=trace)
+
+    def replace_bounded(
+            self,
+            expression: Expression,
+            budget: 'functions.RewriteBudget',
+            trace: Optional['functions.RewriteTrace']=None
+    ) -> 'functions.RewriteResult':
+        """Replace all occurrences of the patterns like :meth:`replace`, but within the limits of the *budget*.
+
+        Args:
+            expression:
+                The expression to which the replacement rules are applied.
+            budget:
+                The limits for the rewriting.
+            trace:
+                An optional :class:`~matchpy.functions.RewriteTrace` that records the applied rules.
 
-    def replace_post_order(self, expression: Expression) -> Union[Expression, Sequence[Expression]]:
+        Returns:
+            The resulting expression together with the number of rewrite steps and the reason why the rewriting
+            stopped.
+        """
+        run = budget._start()
+        result = functions._replace_all_incremental(expression, self._find_rule, run=run, trace=trace)
+        return run.result(result)
+
+    def _find_rule(self, expression):
+        for rule, subst in self.matcher.match(expression):
+            return rule, subst
+        return None
+
+    def replace_post_order(
+            self, expression: Expression, cache: Optional['functions.NormalFormCache']=None
+    ) -> Union[Expression, Sequence[Expression]]:
         """Replace all occurrences of the patterns according to the replacement rules.
 
         Replaces innermost expressions first.
@@ -811,37 +1165,45 @@ class ManyToOneReplacer:
         Args:
             expression:
                 The expression to which the replacement rules are applied.
-            max_count:
-                If given, at most *max_count* applications of the rules are performed. Otherwise, the rules
-                are applied until there is no more match. If the set of replacement rules is not confluent,
-                the replacement might not terminate without a *max_count* set.
+            cache:
+                An optional :class:`~matchpy.functions.NormalFormCache` that is used to look up and store the normal
+                forms of subexpressions. It must only be used with this replacer and no rules must be added to the
+                replacer while the cache is in use.
 
         Returns:
             The resulting expression after the application of the replacement rules. This can also be a sequence of
             expressions, if the root expression is replaced with a sequence of expressions by a rule.
         """
-        return self._replace_post_order(expression)[0]
+        return functions._replace_post_order(expression, self._find_rule, cache)[0]
 
-    def _replace_post_order(self, expression):
-        any_replaced = False
-        while True:
-            if isinstance(expression, Operation):
-                new_operands = [self._replace_post_order(o) for o in op_iter(expression)]
-                if any(r for _, r in new_operands):
-                    new_operands = [o for o, _ in new_operands]
-                    expression = create_operation_expression(expression, new_operands)
-                    any_replaced = True
-            try:
-                replacement, subst = next(iter(self.matcher.match(expression)))
-                expression = replacement(**subst)
-                any_replaced = True
-            except StopIteration:
-                break
-        return expression, any_replaced
+    def replace_post_order_bounded(
+            self,
+            expression: Expression,
+            budget: 'functions.RewriteBudget',
+            cache: Optional['functions.NormalFormCache']=None
+    ) -> 'functions.RewriteResult':
+        """Replace all occurrences of the patterns like :meth:`replace_post_order`, but within the limits of the
+        *budget*.
+
+        Cycles are detected separately for every subexpression, i.e. the rewriting stops if the rewrites of a
+        subexpression repeat.
 
+        Args:
+            expression:
+                The expression to which the replacement rules are applied.
+            budget:
+                The limits for the rewriting.
+            cache:
+                An optional :class:`~matchpy.functions.NormalFormCache`. Subexpressions whose rewriting was stopped are
+                not added to it.
 
-Subgraph = BipartiteGraph[Tuple[int, int], Tuple[int, int], Substitution]
-Matching = Dict[Tuple[int, int], Tuple[int, int]]
+        Returns:
+            The resulting expression together with the number of rewrite steps and the reason why the rewriting
+            stopped.
+        """
+        run = budget._start()
+        result, _ = functions._replace_post_order(expression, self._find_rule, cache, run)
+        return run.result(result)
 
 
 class CommutativeMatcher(object):
@@ -873,24 +1235,59 @@ class CommutativeMatcher(object):
 
     def get_match_iter(self, subject):
         match_iter = _MatchIter(self.automaton, subject, self.associative)
-        for _ in match_iter._match(self.automaton.root):
-            for pattern_index in match_iter.patterns:
+        for _ in match_iter._match():
+            for pattern_index in _iter_bits(match_iter.patterns):
                 substitution = Substitution(match_iter.substitution)
                 yield pattern_index, substitution
 
 
     def add_subject(self, subject: Expression) -> None:
-        if subject not in self.subjects:
-            subject_id, pattern_set = self.subjects[subject] = (len(self.subjects), set())
+        return self._add_subject(subject)[0]
+
+    def _add_subject(self, subject: Expression) -> Tuple[int, Set[int]]:
+        """Add the subject and return its row, i.e. its id and the set of the patterns that it matches."""
+        row = self.subjects.get(subject)
+        if row is None:
+            subject_id, pattern_set = row = self.subjects[subject] = (len(self.subjects), set())
             self.subjects_by_id[subject_id] = subject
             for pattern_index, substitution in self.get_match_iter(subject):
                 self.bipartite.setdefault((subject_id, pattern_index), []).append(Substitution(substitution))
                 pattern_set.add(pattern_index)
-        else:
-            subject_id, _ = self.subjects[subject]
-        return subject_id
+        return row
+
+    def _subject_rows(self, subjects: Sequence[Expression], cache: Dict[int, Tuple[Expression, Tuple[int, Set[int]]]]
+                      ) -> List[Tuple[int, Set[int]]]:
+        """Add the subjects and return their rows.
+
+        The *cache* maps the ids of subjects to the subject and its row, so that the row of a subject instance is
+        only looked up once. Since the lookup hashes the subject, this saves hashing the same operands again for
+        every operation they occur in.
+        """
+        rows = []
+        for subject in op_iter(subjects):
+            entry = cache.get(id(subject))
+            if entry is None:
+                entry = cache[id(subject)] = (subject, self._add_subject(subject))
+            rows.append(entry[1])
+        return rows
 
     def match(self, subjects: Sequence[Expression], substitution: Substitution) -> Iterator[Tuple[int, Substitution]]:
+        for pattern_index, result_substitution, _ in self._match(subjects, substitution, None):
+            yield pattern_index, result_substitution
+
+    def _match(self, subjects: Sequence[Expression], substitution: Substitution,
+               occurrences: Optional[Dict[str, int]],
+               rows: Optional[List[Tuple[int, Set[int]]]]=None) -> Iterator[Tuple[int, Substitution, int]]:
+        """Match the subjects and yield triples of pattern index, substitution and multiplicity.
+
+        If *occurrences* is given, it maps the variables to how often they occur at most in the remaining outer
+        patterns. Sequence variables that occur nowhere else are not bound in the yielded substitution. Instead, all
+        their possible distributions are counted and represented by a single result with the count as multiplicity.
+
+        The *rows* of the subjects are looked up unless they are given.
+        """
+        if rows is None:
+            rows = [self.subjects[subject] for subject in op_iter(subjects)]
         subject_ids = Multiset()
         pattern_ids = Multiset()
         if self.max_optional_count > 0:
@@ -898,8 +1295,7 @@ class CommutativeMatcher(object):
             subject_ids.add(subject_id)
             for _ in range(self.max_optional_count):
                 pattern_ids.update(subject_pattern_ids)
-        for subject in op_iter(subjects):
-            subject_id, subject_pattern_ids = self.subjects[subject]
+        for subject_id, subject_pattern_ids in rows:
             subject_ids.add(subject_id)
             pattern_ids.update(subject_pattern_ids)
         for pattern_index, pattern_set, pattern_vars in self.patterns.values():
@@ -911,19 +1307,43 @@ class CommutativeMatcher(object):
                     ids = subject_ids - matched_subjects
                     remaining = Multiset(self.subjects_by_id[id] for id in ids if self.subjects_by_id[id] is not None)
                     if pattern_vars:
+                        if self._can_collapse(pattern_vars, bipartite_substitution, occurrences):
+                            count = self._count_sequence_variables(remaining, pattern_vars)
+                            if count:
+                                yield pattern_index, bipartite_substitution, count
+                            continue
                         sequence_var_iter = self._match_sequence_variables(
                             remaining, pattern_vars, bipartite_substitution
                         )
                         for result_substitution in sequence_var_iter:
-                            yield pattern_index, result_substitution
+                            yield pattern_index, result_substitution, 1
                     elif len(remaining) == 0:
-                        yield pattern_index, bipartite_substitution
+                        yield pattern_index, bipartite_substitution, 1
             elif pattern_vars:
-                sequence_var_iter = self._match_sequence_variables(Multiset(op_iter(subjects)), pattern_vars, substitution)
+                remaining = Multiset(op_iter(subjects))
+                if self._can_collapse(pattern_vars, substitution, occurrences):
+                    count = self._count_sequence_variables(remaining, pattern_vars)
+                    if count:
+                        yield pattern_index, substitution, count
+                    continue
+                sequence_var_iter = self._match_sequence_variables(remaining, pattern_vars, substitution)
                 for variable_substitution in sequence_var_iter:
-                    yield pattern_index, variable_substitution
+                    yield pattern_index, variable_substitution, 1
             elif op_len(subjects) == 0:
-                yield pattern_index, substitution
+                yield pattern_index, substitution, 1
+
+    @staticmethod
+    def _can_collapse(pattern_vars, substitution: Substitution, occurrences: Optional[Dict[str, int]]) -> bool:
+        if occurrences is None:
+            return False
+        for (name, count, _, _), _ in pattern_vars:
+            if name is not None and (name in substitution or occurrences.get(name, 0) > count):
+                return False
+        return True
+
+    @staticmethod
+    def _count_sequence_variables(subjects: MultisetOfExpression, pattern_vars) -> int:
+        return commutative_sequence_variable_partition_count(subjects, [info for info, _ in pattern_vars])
 
     def _extract_sequence_wildcards(self, operands: Iterable[Expression],
                                     constraints) -> Tuple[MultisetOfInt, Dict[str, Tuple[VariableWithCount, bool]]]:
@@ -982,19 +1402,83 @@ class CommutativeMatcher(object):
             pattern_set: MultisetOfInt,
             substitution: Substitution,
     ) -> Iterator[Tuple[Substitution, MultisetOfInt]]:
-        bipartite = self._build_bipartite(subject_ids, pattern_set)
-        for matching in enum_maximum_matchings_iter(bipartite):
-            if len(matching) < len(pattern_set):
-                break
-            if not self._is_canonical_matching(matching):
+        """Match the subpatterns to the subjects and yield the substitutions with the matched subjects.
+
+        The multiplicities of the subjects and subpatterns are used as capacities and demands of a b-matching, so
+        that the copies of a subject or subpattern are not matched individually.
+        The anonymous subpatterns do not bind any variables, so it only matters which subjects they use. Hence, only
+        the distinct multisets of subjects which the anonymous subpatterns can be matched to are enumerated for them.
+        """
+        anonymous_patterns = self.anonymous_patterns
+        named_demands = {}
+        anonymous_demands = {}
+        for pattern, count in pattern_set.items():
+            if pattern in anonymous_patterns:
+                anonymous_demands[pattern] = count
+            else:
+                named_demands[pattern] = count
+        for b_matching in enum_b_matchings_iter(self.bipartite, subject_ids, named_demands):
+            named_subjects = Multiset()
+            remaining = dict(subject_ids.items())
+            for (subject, _), count in b_matching.items():
+                named_subjects.add(subject, count)
+                remaining[subject] -= count
+            bipartite_substitutions = None
+            for anonymous_subjects in enum_b_matching_left_counts_iter(self.bipartite, remaining, anonymous_demands):
+                if bipartite_substitutions is None:
+                    bipartite_substitutions = list(self._union_substitutions(b_matching, substitution))
+                matched_subjects = named_subjects.combine(anonymous_subjects) if anonymous_subjects else named_subjects
+                for bipartite_substitution in bipartite_substitutions:
+                    yield bipartite_substitution, matched_subjects
+
+    def _union_substitutions(self, b_matching: Dict[Tuple[int, int], int],
+                             substitution: Substitution) -> Iterator[Substitution]:
+        """Yield the unions of the substitution with the ones of the subpatterns matched by the b-matching.
+
+        If a subject is matched to the same subpattern multiple times, the order of their substitutions is irrelevant.
+        The substitutions are merged one edge at a time, so that a conflict rules out all combinations with the same
+        prefix at once. The edges whose variables are already bound come first, because they can conflict early.
+        """
+        edge_choices = []
+        for edge, count in b_matching.items():
+            substitutions = self.bipartite[edge]
+            if count == 1:
+                choices = list(substitutions)
+            else:
+                choices = []
+                for substs in itertools.combinations_with_replacement(substitutions, count):
+                    try:
+                        choices.append(substs[0].union(*substs[1:]))
+                    except ValueError:
+                        continue
+            if not choices:
+                return
+            edge_choices.append((choices, set().union(*choices)))
+
+        bound = set(substitution)
+        ordered_choices = []
+        while edge_choices:
+            index = max(
+                range(len(edge_choices)), key=lambda i: (len(edge_choices[i][1] & bound), -len(edge_choices[i][0]))
+            )
+            choices, variables = edge_choices.pop(index)
+            ordered_choices.append(choices)
+            bound.update(variables)
+
+        if not ordered_choices:
+            yield Substitution(substitution)
+            return
+        stack = [(0, substitution)]
+        while stack:
+            depth, partial = stack.pop()
+            if depth == len(ordered_choices):
+                yield partial
                 continue
-            for substs in itertools.product(*(bipartite[edge] for edge in matching.items())):
+            for choice in reversed(ordered_choices[depth]):
                 try:
-                    bipartite_substitution = substitution.union(*substs)
+                    stack.append((depth + 1, partial.union(choice)))
                 except ValueError:
                     continue
-                matched_subjects = Multiset(subexpression for subexpression, _ in matching)
-                yield bipartite_substitution, matched_subjects
 
     def _match_sequence_variables(
             self,
@@ -1018,43 +1502,6 @@ class CommutativeMatcher(object):
                 continue
             yield result_substitution
 
-    def _build_bipartite(self, subjects: MultisetOfInt, patterns: MultisetOfInt) -> Subgraph:
-        bipartite = BipartiteGraph()
-        n = 0
-        m = 0
-        p_states = {}
-        for subject, s_count in subjects.items():
-            if (LEFT, subject) in self.bipartite._graph:
-                any_patterns = False
-                for _, pattern in self.bipartite._graph[LEFT, subject]:
-                    if pattern in patterns:
-                        any_patterns = True
-                        subst = self.bipartite[subject, pattern]
-                        p_count = patterns[pattern]
-                        if pattern in p_states:
-                            p_start = p_states[pattern]
-                        else:
-                            p_start = p_states[pattern] = m
-                            m += p_count
-                        for i in range(n, n + s_count):
-                            for j in range(p_start, p_start + p_count):
-                                bipartite[(subject, i), (pattern, j)] = subst
-                if any_patterns:
-                    n += s_count
-
-        return bipartite
-
-    def _is_canonical_matching(self, matching: Matching) -> bool:
-        anonymous_patterns = self.anonymous_patterns
-        for (s1, n1), (p1, m1) in matching.items():
-            for (s2, n2), (p2, m2) in matching.items():
-                if p1 in anonymous_patterns and p2 in anonymous_patterns:
-                    if n1 < n2 and m1 > m2:
-                        return False
-                elif s1 == s2 and n1 < n2 and m1 > m2:
-                    return False
-        return True
-
     def bipartite_as_graph(self) -> Graph:  # pragma: no cover
         """Returns a :class:`graphviz.Graph` representation of this bipartite graph."""
         if Graph is None:
@@ -1081,27 +1528,29 @@ class CommutativeMatcher(object):
         return graph
 
     def concrete_bipartite_as_graph(self, subjects, patterns) -> Graph:  # pragma: no cover
-        """Returns a :class:`graphviz.Graph` representation of this bipartite graph."""
+        """Returns a :class:`graphviz.Graph` representation of the bipartite graph for the given subjects and patterns.
+
+        The nodes are labeled with the multiplicities of the subjects and patterns.
+        """
         if Graph is None:
             raise ImportError('The graphviz package is required to draw the graph.')
-        bipartite = self._build_bipartite(subjects, patterns)
         graph = Graph()
         nodes_left = {}  # type: Dict[TLeft, str]
         nodes_right = {}  # type: Dict[TRight, str]
         node_id = 0
-        for (left, right), value in bipartite._edges.items():
+        for (left, right), value in self.bipartite._edges.items():
+            if left not in subjects or right not in patterns:
+                continue
             if left not in nodes_left:
-                subject_id, i = left
                 name = 'node{:d}'.format(node_id)
                 nodes_left[left] = name
-                label = '{}, {}'.format(i, self.subjects_by_id[subject_id])
+                label = '{}, {}'.format(subjects[left], self.subjects_by_id[left])
                 graph.node(name, label=label)
                 node_id += 1
             if right not in nodes_right:
-                pattern, i = right
                 name = 'node{:d}'.format(node_id)
                 nodes_right[right] = name
-                label = '{}, {}'.format(i, self.automaton.patterns[pattern][0])
+                label = '{}, {}'.format(patterns[right], self.automaton.patterns[right][0])
                 graph.node(name, label=label)
                 node_id += 1
             edge_label = value is not True and str(value) or ''
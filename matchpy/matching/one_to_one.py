@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Iterable, Iterator, List, Sequence, Tuple, cast, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union, cast, Set
 
 from multiset import Multiset
 
@@ -9,15 +9,15 @@ from ..expressions.expressions import (
 from ..expressions.constraints import Constraint
 from ..expressions.substitution import Substitution
 from ..expressions.functions import (
-    is_constant, preorder_iter_with_position, match_head, create_operation_expression, op_iter, op_len
+    is_constant, preorder_iter_with_position, match_head, create_operation_expression, op_iter, op_len, get_head
 )
 from ..utils import (
-    VariableWithCount, commutative_sequence_variable_partition_iter, fixed_integer_vector_iter, weak_composition_iter,
-    generator_chain, optional_iter
+    VariableWithCount, commutative_sequence_variable_partition_iter, commutative_sequence_variable_partition_count,
+    fixed_integer_vector_iter, weak_composition_iter, generator_chain, optional_iter
 )
 from ._common import CommutativePatternsParts, check_one_identity
 
-__all__ = ['match', 'match_anywhere']
+__all__ = ['match', 'match_anywhere', 'count_matches', 'matching_labels', 'SubjectIndex']
 
 
 def match(subject: Expression, pattern: Pattern) -> Iterator[Substitution]:
@@ -50,7 +50,76 @@ def match(subject: Expression, pattern: Pattern) -> Iterator[Substitution]:
             yield subst
 
 
-def match_anywhere(subject: Expression, pattern: Pattern) -> Iterator[Tuple[Substitution, Tuple[int, ...]]]:
+def count_matches(subject: Expression, pattern: Pattern) -> int:
+    """Count the number of ways the given *pattern* matches the given *subject*.
+
+    This is equivalent to counting the substitutions yielded by :func:`match`, but the matches are not collected.
+    If the pattern is a commutative operation without constraints, the distributions of its sequence variables are
+    counted combinatorially instead of constructing a substitution for each of them.
+
+    >>> count_matches(f(a, b), Pattern(f(___, ___)))
+    3
+
+    Parameters:
+        subject:
+            An subject to match.
+        pattern:
+            The pattern to match.
+
+    Returns:
+        The number of matches.
+
+    Raises:
+        ValueError:
+            If the subject is not constant.
+    """
+    if not is_constant(subject):
+        raise ValueError("The subject for matching must be constant.")
+    expression = pattern.expression
+    if (not pattern.constraints and isinstance(expression, CommutativeOperation) and
+            not isinstance(expression, OneIdentityOperation) and not getattr(expression, 'variable_name', None) and
+            op_len(expression) > 0):
+        if not isinstance(subject, expression.__class__):
+            return 0
+        parts = CommutativePatternsParts(type(expression), *op_iter(expression))
+        return _count_commutative_operation(subject, parts)
+    count = 0
+    for _ in match(subject, pattern):
+        count += 1
+    return count
+
+
+def matching_labels(subject: Expression, patterns: Iterable[Pattern]) -> Iterator[Pattern]:
+    """Yield every one of the given *patterns* that matches the given *subject*.
+
+    The matching for each pattern stops at its first match.
+
+    >>> list(matching_labels(f(a, b), [Pattern(f(a, x_)), Pattern(f(b, x_)), Pattern(f(___, ___))]))
+    [Pattern(f(a, x_)), Pattern(f(___, ___))]
+
+    Parameters:
+        subject:
+            An subject to match.
+        patterns:
+            The patterns to match.
+
+    Yields:
+        The matching patterns.
+
+    Raises:
+        ValueError:
+            If the subject is not constant.
+    """
+    if not is_constant(subject):
+        raise ValueError("The subject for matching must be constant.")
+    for pattern in patterns:
+        for _ in match(subject, pattern):
+            yield pattern
+            break
+
+
+def match_anywhere(subject: Union[Expression, 'SubjectIndex'],
+                   pattern: Pattern) -> Iterator[Tuple[Substitution, Tuple[int, ...]]]:
     """Tries to match the given *pattern* to the any subexpression of the given *subject*.
 
     Yields each match in form of a substitution and a position tuple.
@@ -58,9 +127,12 @@ def match_anywhere(subject: Expression, pattern: Pattern) -> Iterator[Tuple[Subs
     :code:`(0, )` refers to the first child (operand) of the subject, :code:`(0, 0)` to the first child of
     the first child etc.
 
+    Only the subexpressions whose head fits the head of the pattern are matched. To search the same subject
+    with multiple patterns, pass a `SubjectIndex` of it, so that the subject is only indexed once.
+
     Parameters:
         subject:
-            An subject to match.
+            An subject to match or an index of it.
         pattern:
             The pattern to match.
 
@@ -71,12 +143,98 @@ def match_anywhere(subject: Expression, pattern: Pattern) -> Iterator[Tuple[Subs
         ValueError:
             If the subject is not constant.
     """
-    if not is_constant(subject):
-        raise ValueError("The subject for matching must be constant.")
-    for child, pos in preorder_iter_with_position(subject):
-        if match_head(child, pattern):
-            for subst in match(child, pattern):
-                yield subst, pos
+    index = subject if isinstance(subject, SubjectIndex) else SubjectIndex(subject)
+    for child, pos in index.candidates(pattern):
+        for subst in match(child, pattern):
+            yield subst, pos
+
+
+class SubjectIndex:
+    """An index of the subexpressions of a subject by their heads.
+
+    Building the index traverses the subject once. Afterwards, the subexpressions whose head can match the head of
+    a pattern can be looked up without visiting all the other subexpressions:
+
+    >>> index = SubjectIndex(f(a, f(b), Symbol('d')))
+    >>> [(str(e), p) for e, p in index.candidates(Pattern(f(x_)))]
+    [('f(a, f(b), d)', ()), ('f(b)', (1,))]
+    >>> [(str(e), p) for e, p in index.candidates(Pattern(a), Pattern(Symbol('d')))]
+    [('a', (0,)), ('d', (2,))]
+
+    Operations are indexed by their type and symbols additionally by their name. The candidates for a pattern are
+    computed once per head and remembered. The subject must not be modified while the index is in use.
+    """
+
+    def __init__(self, subject: Expression) -> None:
+        """
+        Args:
+            subject:
+                The subject to index.
+
+        Raises:
+            ValueError:
+                If the subject is not constant.
+        """
+        if not is_constant(subject):
+            raise ValueError("The subject for matching must be constant.")
+        self.subject = subject
+        self._subexpressions = []  # type: List[Tuple[Expression, Tuple[int, ...]]]
+        self._by_type = {}  # type: Dict[type, List[int]]
+        self._by_symbol_name = {}  # type: Dict[str, List[int]]
+        self._candidates = {}  # type: Dict[type, List[int]]
+        for subexpression, position in preorder_iter_with_position(subject):
+            index = len(self._subexpressions)
+            self._subexpressions.append((subexpression, position))
+            self._by_type.setdefault(type(subexpression), []).append(index)
+            if isinstance(subexpression, Symbol):
+                self._by_symbol_name.setdefault(subexpression.name, []).append(index)
+
+    def __len__(self):
+        return len(self._subexpressions)
+
+    def __iter__(self) -> Iterator[Tuple[Expression, Tuple[int, ...]]]:
+        return iter(self._subexpressions)
+
+    def candidates(self, *patterns: Pattern) -> Iterator[Tuple[Expression, Tuple[int, ...]]]:
+        """Yield the subexpressions whose head fits the head of any of the patterns.
+
+        Yields:
+            Pairs of subexpression and position in preorder.
+        """
+        indices = None  # type: Optional[List[int]]
+        for pattern in patterns:
+            pattern_indices = self._candidate_indices(pattern)
+            if pattern_indices is None:
+                return iter(self._subexpressions)
+            if indices is None:
+                indices = pattern_indices
+            elif pattern_indices:
+                indices = sorted(set(indices).union(pattern_indices))
+        if indices is None:
+            return iter(())
+        subexpressions = self._subexpressions
+        return (subexpressions[i] for i in indices)
+
+    def _candidate_indices(self, pattern):
+        """Return the preorder indices of the candidates for a pattern or None if every subexpression is one."""
+        if isinstance(pattern, Pattern):
+            pattern = pattern.expression
+        head = get_head(pattern)
+        if head is None or issubclass(head, OneIdentityOperation):
+            return None
+        if isinstance(pattern, Symbol):
+            return [
+                i for i in self._by_symbol_name.get(pattern.name, ())
+                if isinstance(self._subexpressions[i][0], head)
+            ]
+        try:
+            return self._candidates[head]
+        except KeyError:
+            indices = [i for subject_type, type_indices in self._by_type.items() if issubclass(subject_type, head)
+                       for i in type_indices]
+            indices.sort()
+            self._candidates[head] = indices
+            return indices
 
 
 def _match(subjects: List[Expression], pattern: Expression, subst: Substitution,
@@ -260,6 +418,32 @@ def _match_commutative_operation(
         substitution: Substitution,
         constraints
 ) -> Iterator[Substitution]:
+    for rem_expr, substitution, sequence_vars in _match_commutative_fixed_parts(
+            subject_operands, pattern, substitution, constraints
+    ):
+        yield from _match_commutative_sequence_variables(rem_expr, pattern, substitution, sequence_vars, constraints)
+
+
+def _count_commutative_operation(subject_operands: Iterable[Expression], pattern: CommutativePatternsParts) -> int:
+    count = 0
+    for rem_expr, substitution, sequence_vars in _match_commutative_fixed_parts(
+            subject_operands, pattern, Substitution(), set()
+    ):
+        if any(v.name in substitution for v in sequence_vars):
+            # The variable already has a value, so the distributions must be checked against it
+            for _ in _match_commutative_sequence_variables(rem_expr, pattern, substitution, sequence_vars, set()):
+                count += 1
+        else:
+            count += commutative_sequence_variable_partition_count(Multiset(rem_expr), sequence_vars)
+    return count
+
+
+def _match_commutative_fixed_parts(subject_operands, pattern, substitution, constraints):
+    """Match everything except the sequence variables of a commutative pattern.
+
+    Yields the remaining subject operands, the substitution and the sequence variables among which the remaining
+    operands have to be distributed.
+    """
     subjects = Multiset(op_iter(subject_operands))  # type: Multiset
     if not pattern.constant <= subjects:
         return
@@ -316,29 +500,32 @@ def _match_commutative_operation(
                 sequence_vars += (VariableWithCount(None, 1, pattern.wildcard_min_length, None), )
         if pattern.wildcard_fixed is False:
             sequence_vars += (VariableWithCount(None, 1, pattern.wildcard_min_length, None), )
+        yield rem_expr, substitution, sequence_vars
 
-        for sequence_subst in commutative_sequence_variable_partition_iter(Multiset(rem_expr), sequence_vars):
-            if issubclass(pattern.operation, AssociativeOperation):
-                for v in fixed_vars.distinct_elements():
-                    if v not in sequence_subst:
-                        continue
-                    l = pattern.fixed_variable_infos[v].min_count
-                    value = cast(Sequence, sequence_subst[v])
-                    if isinstance(value, (list, tuple, Multiset)):
-                        if len(value) > l:
-                            normal = Multiset(list(value)[:l - 1])
-                            wrapped = pattern.operation(*(value - normal))
-                            normal.add(wrapped)
-                            sequence_subst[v] = normal if l > 1 else next(iter(normal))
-                        else:
-                            assert len(value) == 1 and l == 1, "Fixed variables with length != 1 are not supported."
-                            sequence_subst[v] = next(iter(value))
-            try:
-                result = substitution.union(sequence_subst)
-            except ValueError:
-                pass
-            else:
-                yield from _check_constraints(result, constraints)
+
+def _match_commutative_sequence_variables(rem_expr, pattern, substitution, sequence_vars, constraints):
+    for sequence_subst in commutative_sequence_variable_partition_iter(Multiset(rem_expr), sequence_vars):
+        if issubclass(pattern.operation, AssociativeOperation):
+            for v in pattern.fixed_variables.distinct_elements():
+                if v not in sequence_subst:
+                    continue
+                l = pattern.fixed_variable_infos[v].min_count
+                value = cast(Sequence, sequence_subst[v])
+                if isinstance(value, (list, tuple, Multiset)):
+                    if len(value) > l:
+                        normal = Multiset(list(value)[:l - 1])
+                        wrapped = pattern.operation(*(value - normal))
+                        normal.add(wrapped)
+                        sequence_subst[v] = normal if l > 1 else next(iter(normal))
+                    else:
+                        assert len(value) == 1 and l == 1, "Fixed variables with length != 1 are not supported."
+                        sequence_subst[v] = next(iter(value))
+        try:
+            result = substitution.union(sequence_subst)
+        except ValueError:
+            pass
+        else:
+            yield from _check_constraints(result, constraints)
 
 
 def _variables_with_counts(variables, infos):
@@ -11,6 +11,7 @@ Furthermore, the module contains some utility functions for working with flatter
 """
 
 import itertools
+from array import array
 from reprlib import recursive_repr
 from typing import (Any, Dict, FrozenSet, Generic, Iterator, List, Optional, Sequence, Set, Tuple, Type, TypeVar, Union)
 
@@ -55,6 +56,26 @@ def _get_symbol_wildcard_label(state: '_State', symbol: Symbol) -> Type[Symbol]:
 TermAtom = Union[Symbol, Wildcard, Type[Operation], Type[Symbol], type(OPERATION_END)]
 TransitionLabel = Union[Symbol, Type[Operation], Type[Symbol], Type[Wildcard], type(OPERATION_END), type(EPSILON)]
 
+_UNKNOWN_ATOM = -1
+"""Code of the atoms that are not the transition label of any :class:`DiscriminationNet` state."""
+
+_label_codes = {}  # type: Dict[TransitionLabel, int]
+_next_label_code = itertools.count()
+
+
+def _label_code(label: TransitionLabel) -> int:
+    """Return the integer code of the transition label, assigning a new one if needed.
+
+    Equal labels have the same code, so the codes can be compared and looked up instead of the labels, which is faster
+    for labels that implement equality and hashing in Python like symbols. Only transition labels are interned, so
+    the table does not grow with the subjects that are matched. The counter and `dict.setdefault` make sure that
+    different labels never get the same code, even if multiple threads intern labels at the same time.
+    """
+    code = _label_codes.get(label)
+    if code is None:
+        code = _label_codes.setdefault(label, next(_next_label_code))
+    return code
+
 
 class FlatTerm(Sequence[TermAtom]):
     """A flattened representation of an :class:`.Expression`.
@@ -94,9 +115,12 @@ class FlatTerm(Sequence[TermAtom]):
 
     >>> FlatTerm(f(_, _s))
     [f, _, <class '__main__.SpecialSymbol'>, )]
+
+    Use `FlatTerm.of()` to get the flatterm of an expression that is matched repeatedly. It caches the flatterm in the
+    expression, so it only has to be flattened once.
     """
 
-    __slots__ = '_terms', '_is_syntactic'
+    __slots__ = '_terms', '_is_syntactic', '_codes', '_skips'
 
     def __init__(self, expression: Union[Expression, Sequence[TermAtom]]) -> None:
         if isinstance(expression, Expression):
@@ -137,6 +161,62 @@ class FlatTerm(Sequence[TermAtom]):
                 return False
         return True
 
+    @slot_cached_property('_codes')
+    def codes(self) -> array:
+        """The terms encoded as integers.
+
+        Every term that is a transition label of a :class:`DiscriminationNet` has the code of that label, so equal
+        terms have the same code, even in different flatterms. All other terms have the code ``-1``:
+
+        >>> net = DiscriminationNet(Pattern(f(a, _)))
+        >>> net.is_match(f(a, b))
+        True
+        >>> codes = FlatTerm(f(a, Symbol('unknown'))).codes
+        >>> codes[1] == FlatTerm(f(b, a)).codes[2]
+        True
+        >>> codes[2]
+        -1
+        """
+        get = _label_codes.get
+        return array('l', (get(term, _UNKNOWN_ATOM) for term in self._terms))
+
+    @slot_cached_property('_skips')
+    def skips(self) -> array:
+        """The index after the end of the subterm that starts at each index.
+
+        For an operation, this is the index after its :const:`OPERATION_END`. For all other terms, it is the next index:
+
+        >>> list(FlatTerm(f(a, f(b), a)).skips)
+        [6, 2, 5, 4, 5, 6, 7]
+        """
+        skips = array('l', range(1, len(self._terms) + 1))
+        starts = []
+        for index, term in enumerate(self._terms):
+            if is_operation(term):
+                starts.append(index)
+            elif term == OPERATION_END and starts:
+                skips[starts.pop()] = index + 1
+        for index in starts:
+            skips[index] = len(skips)
+        return skips
+
+    @classmethod
+    def of(cls, expression: Expression) -> 'FlatTerm':
+        """Return the flatterm of the expression, which is cached in the expression.
+
+        Like the other cached properties of an expression, the flatterm is not updated when the expression is
+        modified.
+
+        >>> expression = f(a, b)
+        >>> FlatTerm.of(expression) is FlatTerm.of(expression)
+        True
+        """
+        try:
+            return expression.__dict__['_flatterm']
+        except KeyError:
+            flatterm = expression.__dict__['_flatterm'] = cls(expression)
+            return flatterm
+
     @classmethod
     def empty(cls) -> 'FlatTerm':
         """An empty flatterm."""
@@ -146,6 +226,12 @@ class FlatTerm(Sequence[TermAtom]):
     def merged(cls, *flatterms: 'FlatTerm') -> 'FlatTerm':
         """Concatenate the given flatterms to a single flatterm.
 
+        This takes time linear in the total length of the flatterms. If no wildcards are merged at the boundaries, the
+        codes of the flatterms (see `codes`) are reused if they have already been computed:
+
+        >>> FlatTerm.merged(FlatTerm(f(a)), FlatTerm(_), FlatTerm(__))
+        [f, a, ), _[2+]]
+
         Args:
             *flatterms:
                 The flatterms which are concatenated.
@@ -153,7 +239,17 @@ class FlatTerm(Sequence[TermAtom]):
         Returns:
             The concatenated flatterms.
         """
-        return cls(cls._combined_wildcards_iter(sum(flatterms, cls.empty())))
+        merged = cls(cls._combined_wildcards_iter(itertools.chain.from_iterable(flatterms)))
+        if len(merged) == sum(map(len, flatterms)):
+            codes = array('l')
+            try:
+                for flatterm in flatterms:
+                    codes.extend(flatterm._codes)
+            except AttributeError:
+                pass
+            else:
+                merged._codes = codes
+        return merged
 
     @classmethod
     def _flatterm_iter(cls, expression: Expression) -> Iterator[TermAtom]:
@@ -225,6 +321,17 @@ class _State(Dict[TransitionLabel, '_State'], Generic[T]):
         self.id = _State._id
         _State._id += 1
         self.payload = payload if payload is not None else []
+        self._code_transitions = None  # type: Optional[Dict[int, _State[T]]]
+
+    @property
+    def code_transitions(self) -> Dict[int, '_State[T]']:
+        """The transitions with the codes of their labels (see `FlatTerm.codes`) as keys.
+
+        This is computed on the first access, so the state must not be modified after that.
+        """
+        if self._code_transitions is None:
+            self._code_transitions = dict((_label_code(label), target) for label, target in self.items())
+        return self._code_transitions
 
     def _target_str(self, value: '_State') -> str:  # pragma: no cover
         """Return a string representation of a transition target."""
@@ -342,19 +449,35 @@ class DiscriminationNet(Generic[T]):
             label once a match is found.
         """
         index = len(self._patterns)
-        self._patterns.append((pattern, final_label))
+        self._patterns.append((pattern, final_label, self._needs_substitution_check(pattern)))
         flatterm = FlatTerm(pattern.expression) if not isinstance(pattern, FlatTerm) else pattern
         if flatterm.is_syntactic or len(flatterm) == 1:
             net = self._generate_syntactic_net(flatterm, index)
         else:
             net = self._generate_net(flatterm, index)
 
+        # The terms of the pattern are the labels of the net, so they need codes before any subject is encoded
+        for label in itertools.chain((Wildcard, OPERATION_END), flatterm):
+            if not isinstance(label, Wildcard):
+                _label_code(label)
+
         if self._root:
             self._root = self._product_net(self._root, net)
         else:
             self._root = net
         return index
 
+    @staticmethod
+    def _needs_substitution_check(pattern: Union[Pattern, FlatTerm]) -> bool:
+        """Return True iff a match of the net has to be confirmed by extracting the substitution.
+
+        The net treats all patterns as linear, so this is only necessary for non-linear patterns or patterns with
+        constraints.
+        """
+        if isinstance(pattern, FlatTerm):
+            return False
+        return bool(pattern.constraints) or any(count > 1 for count in pattern.expression.variables.values())
+
     @staticmethod
     def _create_child_state(state: _State[T], label: TransitionLabel) -> _State[T]:
         new_state = _State()
@@ -610,37 +733,62 @@ class DiscriminationNet(Generic[T]):
         return root
 
     def _match(self, subject: Union[Expression, FlatTerm], collect: bool=False) -> List[Tuple[Expression, T]]:
-        flatterm = FlatTerm(subject) if isinstance(subject, Expression) else subject
-        state = self._root
-        depth = 0
-        result = state.payload[:]
-        for term in flatterm:
-            if depth > 0:
-                if is_operation(term):
-                    depth += 1
-                elif term == OPERATION_END:
-                    depth -= 1
-            else:
+        if isinstance(subject, Expression):
+            flatterm = FlatTerm.of(subject)
+        elif isinstance(subject, FlatTerm):
+            flatterm = subject
+        else:
+            flatterm = FlatTerm(subject)
+        result = self._root.payload[:]
+        state = self._run(self._root, flatterm, result)
+        if collect:
+            return result
+        return state.payload[:] if state is not None else []
+
+    @staticmethod
+    def _run(state: _State[T], flatterm: FlatTerm, payloads: List[T]) -> Optional[_State[T]]:
+        """Run the automaton over the flatterm starting in the given state.
+
+        The payloads of all states that are reached after the given state are added to *payloads*.
+
+        Returns:
+            The state reached at the end of the flatterm or ``None`` if the automaton fails before that.
+        """
+        terms = flatterm._terms
+        codes = flatterm.codes
+        skips = flatterm.skips
+        index = 0
+        length = len(terms)
+        while index < length:
+            next_index = index + 1
+            code = codes[index]
+            try:
+                if code != _UNKNOWN_ATOM:
+                    state = state.code_transitions[code]
+                else:
+                    # The code may have been computed before the term became a label, so look the term up itself
+                    state = state[terms[index]]
+            except KeyError:
+                term = terms[index]
                 try:
-                    try:
-                        state = state[term]
-                    except KeyError:
-                        if is_operation(term):
-                            depth = 1
-                            state = state[Wildcard]
-                        elif term == OPERATION_END:
-                            return []
-                        elif isinstance(term, Symbol):
-                            symbol_wildcard_key = _get_symbol_wildcard_label(state, term)
-                            state = state[symbol_wildcard_key or Wildcard]
-                        else:
-                            raise TypeError("Subject {} contains non-terminal atom: {}".format(subject, term))
+                    if skips[index] != next_index:
+                        # An operation is skipped completely by a wildcard
+                        next_index = skips[index]
+                        state = state[Wildcard]
+                    elif term == OPERATION_END:
+                        return None
+                    elif isinstance(term, Symbol):
+                        symbol_wildcard_key = _get_symbol_wildcard_label(state, term)
+                        state = state[symbol_wildcard_key or Wildcard]
+                    else:
+                        raise TypeError("Subject {} contains non-terminal atom: {}".format(flatterm, term))
                 except KeyError:
-                    return result if collect else []
+                    return None
 
-                result.extend(state.payload)
+            payloads.extend(state.payload)
+            index = next_index
 
-        return result if collect else state.payload[:]
+        return state
 
     def match(self, subject: Union[Expression, FlatTerm]) -> Iterator[Tuple[T, Substitution]]:
         """Match the given subject against all patterns in the net.
@@ -654,7 +802,7 @@ class DiscriminationNet(Generic[T]):
             the pattern as given when using :meth:`add()` and the second one is the match substitution.
         """
         for index in self._match(subject):
-            pattern, label = self._patterns[index]
+            pattern, label, _ = self._patterns[index]
             subst = Substitution()
             if subst.extract_substitution(subject, pattern.expression):
                 for constraint in pattern.constraints:
@@ -663,6 +811,45 @@ class DiscriminationNet(Generic[T]):
                 else:
                     yield label, subst
 
+    def matching_labels(self, subject: Union[Expression, FlatTerm]) -> Iterator[T]:
+        """Yield the labels of all patterns in the net that match the given subject.
+
+        In contrast to :meth:`match`, the substitution is only extracted if it is needed to decide whether the
+        pattern matches, i.e. for non-linear patterns or patterns with constraints.
+
+        Args:
+            subject:
+                The subject that is matched. Must be constant.
+
+        Yields:
+            The final label of every matching pattern.
+        """
+        for index in self._match(subject):
+            pattern, label, needs_check = self._patterns[index]
+            if needs_check:
+                subst = Substitution()
+                if not subst.extract_substitution(subject, pattern.expression):
+                    continue
+                if not all(constraint(subst) for constraint in pattern.constraints):
+                    continue
+            yield label
+
+    def count_matches(self, subject: Union[Expression, FlatTerm]) -> Iterator[Tuple[T, int]]:
+        """Count the matches of every pattern in the net on the given subject.
+
+        As the net only supports :term:`syntactic` patterns, every pattern can match at most once.
+        See :meth:`matching_labels` for when substitutions are constructed.
+
+        Args:
+            subject:
+                The subject that is matched. Must be constant.
+
+        Yields:
+            A tuple :code:`(final label, count)` for every matching pattern.
+        """
+        for label in self.matching_labels(subject):
+            yield label, 1
+
     def is_match(self, subject: Union[Expression, FlatTerm]) -> bool:
         """Check if the given subject matches any pattern in the net.
 
@@ -837,35 +1024,66 @@ class SequenceMatcher:
             return
 
         subjects = list(op_iter(subject))
-        flatterms = [FlatTerm(o) for o in subjects]
+        for start, index in self._candidates_iter(subjects):
+            match_index = self._net._patterns[index][1]
+            pattern, first_name, last_name = self._patterns[match_index]
+            operand_count = op_len(pattern.expression) - 2
+            expr_operands = subjects[start:start + operand_count]
+            patt_operands = list(op_iter(pattern.expression))[1:-1]
+
+            substitution = Substitution()
+            if not all(itertools.starmap(substitution.extract_substitution, zip(expr_operands, patt_operands))):
+                continue
 
-        for i in range(len(flatterms)):
-            flatterm = FlatTerm.merged(*flatterms[i:])
+            try:
+                if first_name is not None:
+                    substitution.try_add_variable(first_name, tuple(subjects[:start]))
+                if last_name is not None:
+                    substitution.try_add_variable(last_name, tuple(subjects[start + operand_count:]))
+            except ValueError:
+                continue
 
-            for index in self._net._match(flatterm, collect=True):
-                match_index = self._net._patterns[index][1]
-                pattern, first_name, last_name = self._patterns[match_index]
-                operand_count = op_len(pattern.expression) - 2
-                expr_operands = subjects[i:i + operand_count]
-                patt_operands = list(op_iter(pattern.expression))[1:-1]
+            for constraint in pattern.constraints:
+                if not constraint(substitution):
+                    break
+            else:
+                yield pattern, substitution
 
-                substitution = Substitution()
-                if not all(itertools.starmap(substitution.extract_substitution, zip(expr_operands, patt_operands))):
-                    continue
+    def _candidates_iter(self, subjects: List[Expression]) -> Iterator[Tuple[int, int]]:
+        """Yield the start index and the net index of every pattern that the net matches somewhere in the subjects.
 
+        This is done in a single pass over the subjects, similar to the Aho-Corasick algorithm: A new run of the net
+        starts at every subject and all runs are advanced together by one subject at a time. Runs that are in the same
+        state at the same time continue the same way, so they are merged and only the distinct states are advanced.
+        How a state is advanced by a subject is remembered for the case that an equal subject occurs again.
+        """
+        root = self._net._root
+        run = self._net._run
+        steps = {}  # type: Dict[Tuple[int, int], Tuple[Optional[_State], List[int]]]
+        subject_ids = {}  # type: Dict[Expression, int]
+        runs = {}  # type: Dict[int, Tuple[_State, List[int]]]
+        for position, subject in enumerate(subjects):
+            flatterm = FlatTerm.of(subject)
+            subject_id = subject_ids.setdefault(subject, len(subject_ids))
+            runs.setdefault(root.id, (root, []))[1].append(position)
+            next_runs = {}  # type: Dict[int, Tuple[_State, List[int]]]
+            for state, starts in runs.values():
+                key = (state.id, subject_id)
                 try:
-                    if first_name is not None:
-                        substitution.try_add_variable(first_name, tuple(subjects[:i]))
-                    if last_name is not None:
-                        substitution.try_add_variable(last_name, tuple(subjects[i + operand_count:]))
-                except ValueError:
-                    continue
-
-                for constraint in pattern.constraints:
-                    if not constraint(substitution):
-                        break
-                else:
-                    yield pattern, substitution
+                    target, payloads = steps[key]
+                except KeyError:
+                    payloads = []
+                    target = run(state, flatterm, payloads)
+                    steps[key] = target, payloads
+                for index in payloads:
+                    for start in starts:
+                        yield start, index
+                if target is not None:
+                    if target.id in next_runs:
+                        next_runs[target.id][1].extend(starts)
+                    else:
+                        next_runs[target.id] = (target, list(starts))
+            runs = next_runs
 
     def as_graph(self) -> Digraph:  # pragma: no cover
         """Renders the underlying discrimination net as graphviz digraph."""
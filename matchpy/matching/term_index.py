@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+"""This module contains indexes that retrieve stored expressions by matching them with a query.
+
+The `TermIndex` stores constant expressions to retrieve those that match a pattern and the `GeneralisationIndex`
+stores patterns to retrieve those that are more general than a pattern.
+
+The term index is the reverse of the many-to-one matchers: Instead of matching a single subject against many
+patterns, a single pattern is matched against many stored subjects:
+
+>>> index = TermIndex(f(a, b), f(b, b), f(a), b)
+>>> for term, substitution in sorted(index.instances(Pattern(f(x_, b))), key=str):
+...     print(term, substitution)
+f(a, b) {x ↦ a}
+f(b, b) {x ↦ b}
+
+The terms are stored in a trie of their flatterms (see :class:`~matchpy.matching.syntactic.FlatTerm`), which is
+also known as a discrimination tree. For a pattern, the trie is traversed along the pattern's flatterm where
+wildcards skip whole subterms. Only the terms that are reached are matched with the pattern to get the substitutions.
+"""
+import itertools
+import math
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from multiset import Multiset
+
+from ..expressions.expressions import (
+    Expression, Operation, Pattern, Symbol, SymbolWildcard, Wildcard, AssociativeOperation, CommutativeOperation,
+    OneIdentityOperation
+)
+from ..expressions.functions import create_operation_expression, get_variables, is_constant, op_iter
+from ..expressions.substitution import Substitution
+from .one_to_one import match
+from .syntactic import FlatTerm, OPERATION_END, is_operation
+
+__all__ = ['TermIndex', 'GeneralisationIndex']
+
+# The kinds of instructions that a pattern is compiled to for the traversal of the trie
+_SYMBOL = 0
+_SYMBOL_TYPE = 1
+_OPERATION = 2
+_END = 3
+_SKIP = 4
+
+
+class _Node:
+    """A node in the trie of a `TermIndex`.
+
+    The children are split by the kind of their label, so that each kind can be looked up without going over the
+    others. Since the flatterm of a term never is the prefix of the flatterm of another term, only leaves have terms.
+    """
+
+    __slots__ = ('symbols', 'operations', 'end', 'terms')
+
+    def __init__(self) -> None:
+        self.symbols = {}  # type: Dict[str, _Node]
+        self.operations = {}  # type: Dict[Type[Operation], _Node]
+        self.end = None  # type: Optional[_Node]
+        self.terms = []  # type: List[Expression]
+
+    def is_empty(self) -> bool:
+        return not (self.symbols or self.operations or self.end or self.terms)
+
+
+class TermIndex:
+    """An index of constant expressions which retrieves the expressions that are instances of a pattern.
+
+    Terms can be added and removed at any time:
+
+    >>> index = TermIndex()
+    >>> index.add(f(a, b))
+    True
+    >>> index.add(f(a, b))
+    False
+    >>> len(index)
+    1
+    >>> index.remove(f(a, b))
+    >>> f(a, b) in index
+    False
+
+    All kinds of patterns are supported. The trie traversal does not check variable consistency, constraints or
+    the order of the operands of commutative operations, so these are left to the one-to-one matching of the
+    reached terms. The operands of commutative and associative operations as well as one-identity operations are
+    skipped entirely in the traversal, so the more syntactic a pattern is, the fewer terms need to be matched.
+    """
+
+    def __init__(self, *terms: Expression) -> None:
+        """
+        Args:
+            *terms:
+                The initial terms of the index.
+        """
+        self._root = _Node()
+        self._size = 0
+        for term in terms:
+            self.add(term)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, term: Expression) -> bool:
+        leaf = self._find_leaf(term)
+        return leaf is not None and term in leaf.terms
+
+    def __iter__(self) -> Iterator[Expression]:
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            yield from node.terms
+            if node.end is not None:
+                stack.append(node.end)
+            stack.extend(node.operations.values())
+            stack.extend(node.symbols.values())
+
+    def add(self, term: Expression) -> bool:
+        """Add a term to the index.
+
+        Args:
+            term:
+                The term to add.
+
+        Returns:
+            True, if the term was added, or False if an equal term already was in the index.
+
+        Raises:
+            ValueError:
+                If the term is not constant.
+        """
+        if not is_constant(term):
+            raise ValueError("The terms in the index must be constant, got {!s}".format(term))
+        node = self._root
+        for atom in FlatTerm(term):
+            if atom is OPERATION_END:
+                if node.end is None:
+                    node.end = _Node()
+                node = node.end
+            elif is_operation(atom):
+                child = node.operations.get(atom)
+                if child is None:
+                    child = node.operations[atom] = _Node()
+                node = child
+            else:
+                child = node.symbols.get(atom.name)
+                if child is None:
+                    child = node.symbols[atom.name] = _Node()
+                node = child
+        if term in node.terms:
+            return False
+        node.terms.append(term)
+        self._size += 1
+        return True
+
+    def remove(self, term: Expression) -> None:
+        """Remove a term from the index.
+
+        Args:
+            term:
+                The term to remove.
+
+        Raises:
+            KeyError:
+                If the term is not in the index.
+        """
+        if not is_constant(term):
+            raise KeyError(term)
+        path = []  # type: List[Tuple[_Node, object]]
+        node = self._root
+        for atom in FlatTerm(term):
+            path.append((node, atom))
+            node = self._child(node, atom)
+            if node is None:
+                break
+        if node is None or term not in node.terms:
+            raise KeyError(term)
+        node.terms.remove(term)
+        self._size -= 1
+        # Remove the nodes that became empty
+        for parent, atom in reversed(path):
+            if not node.is_empty():
+                break
+            if atom is OPERATION_END:
+                parent.end = None
+            elif is_operation(atom):
+                del parent.operations[atom]
+            else:
+                del parent.symbols[atom.name]
+            node = parent
+
+    def instances(self, pattern: Pattern) -> Iterator[Tuple[Expression, Substitution]]:
+        """Retrieve the terms that match the pattern.
+
+        Args:
+            pattern:
+                The pattern to match.
+
+        Yields:
+            For every match, a tuple of the matching term and the match substitution.
+        """
+        for term in self.candidates(pattern):
+            for substitution in match(term, pattern):
+                yield term, substitution
+
+    def candidates(self, pattern: Pattern) -> Iterator[Expression]:
+        """Yield the terms that can possibly match the pattern according to the trie, without matching them.
+
+        Every term that matches the pattern is a candidate, but not every candidate matches the pattern.
+        """
+        expression = pattern.expression if isinstance(pattern, Pattern) else pattern
+        instructions = []  # type: List[tuple]
+        _compile_query(expression, True, instructions)
+        seen = set()
+        for leaf in _retrieve(self._root, instructions, 0):
+            if id(leaf) not in seen:
+                seen.add(id(leaf))
+                yield from leaf.terms
+
+    def _find_leaf(self, term: Expression) -> Optional[_Node]:
+        if not is_constant(term):
+            return None
+        node = self._root
+        for atom in FlatTerm(term):
+            node = self._child(node, atom)
+            if node is None:
+                return None
+        return node
+
+    @staticmethod
+    def _child(node: _Node, atom) -> Optional[_Node]:
+        if atom is OPERATION_END:
+            return node.end
+        if is_operation(atom):
+            return node.operations.get(atom)
+        return node.symbols.get(atom.name)
+
+
+def _compile_query(expression: Expression, top_level: bool, instructions: List[tuple]) -> None:
+    """Compile the pattern expression into instructions for the traversal of the trie."""
+    if isinstance(expression, SymbolWildcard):
+        instructions.append((_SYMBOL_TYPE, ))
+    elif isinstance(expression, Wildcard):
+        if top_level:
+            instructions.append((_SKIP, 1, 1))
+        else:
+            min_count = 0 if expression.optional is not None else expression.min_count
+            max_count = expression.min_count if expression.fixed_size else math.inf
+            instructions.append((_SKIP, min_count, max_count))
+    elif isinstance(expression, Symbol):
+        instructions.append((_SYMBOL, expression.name))
+    elif isinstance(expression, OneIdentityOperation):
+        # The operation can also match its single operand, so the subject can be any term
+        instructions.append((_SKIP, 1, 1))
+    elif isinstance(expression, Operation):
+        instructions.append((_OPERATION, type(expression)))
+        if isinstance(expression, (CommutativeOperation, AssociativeOperation)):
+            # The operands can be matched in any order or grouping, so they are left to the one-to-one matching
+            instructions.append((_SKIP, 0, math.inf))
+        else:
+            for operand in op_iter(expression):
+                _compile_query(operand, False, instructions)
+        instructions.append((_END, ))
+    else:
+        raise TypeError("Unsupported pattern expression {!r}".format(expression))
+
+
+def _retrieve(node: _Node, instructions: List[tuple], index: int) -> Iterator[_Node]:
+    """Yield the nodes which are reached from the node by executing the instructions starting at the index."""
+    while index < len(instructions):
+        instruction = instructions[index]
+        kind = instruction[0]
+        index += 1
+        if kind == _SYMBOL:
+            node = node.symbols.get(instruction[1])
+        elif kind == _END:
+            node = node.end
+        elif kind == _OPERATION:
+            operation = instruction[1]
+            children = [child for label, child in node.operations.items() if issubclass(label, operation)]
+            if len(children) != 1:
+                for child in children:
+                    yield from _retrieve(child, instructions, index)
+                return
+            node = children[0]
+        elif kind == _SYMBOL_TYPE:
+            for child in node.symbols.values():
+                yield from _retrieve(child, instructions, index)
+            return
+        else:
+            _, min_count, max_count = instruction
+            for child in _skip_terms(node, min_count, max_count):
+                yield from _retrieve(child, instructions, index)
+            return
+        if node is None:
+            return
+    yield node
+
+
+def _skip_terms(node: _Node, min_count: int, max_count: float) -> Iterator[_Node]:
+    """Yield the nodes reached by skipping between *min_count* and *max_count* complete terms from the node."""
+    frontier = [node]
+    count = 0
+    while frontier:
+        if count >= min_count:
+            yield from frontier
+        if count >= max_count:
+            return
+        frontier = [end for start in frontier for end in _skip_term(start)]
+        count += 1
+
+
+def _skip_term(node: _Node) -> Iterator[_Node]:
+    """Yield the nodes reached by skipping one complete term from the node."""
+    yield from node.symbols.values()
+    for child in node.operations.values():
+        yield from _skip_operands(child)
+
+
+def _skip_operands(node: _Node) -> Iterator[_Node]:
+    """Yield the nodes reached by skipping any number of terms and the end of the operation from the node."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current.end is not None:
+            yield current.end
+        stack.extend(_skip_term(current))
+
+
+class GeneralisationIndex:
+    """An index of patterns which retrieves the stored patterns that generalise a given pattern.
+
+    A pattern generalises another one if it matches every subject that the other pattern matches:
+
+    >>> index = GeneralisationIndex(Pattern(f(x_, b)), Pattern(f(a, ___)), Pattern(f(a)))
+    >>> for pattern in index.generalisations(Pattern(f(a, b))):
+    ...     print(pattern)
+    f(x_, b)
+    f(a, ___)
+    >>> for pattern in index.generalisations(Pattern(f(a, y_))):
+    ...     print(pattern)
+    f(a, ___)
+
+    To decide this, the wildcards of the query pattern are replaced with placeholder symbols and the stored patterns
+    are matched against the result like against a subject. The stored patterns are kept in the same kind of trie as
+    the terms of a `TermIndex`, but the trie is traversed along the query and the wildcards of the stored patterns
+    skip subterms of it. Only the patterns that are reached are matched.
+
+    The decision is conservative: Every reported pattern generalises the query, but for queries with sequence or
+    optional wildcards some generalisations can be missed. Constraints cannot be decided on placeholders, so a stored
+    pattern with constraints only generalises a query if the two patterns are equal.
+    """
+
+    def __init__(self, *patterns: Pattern) -> None:
+        """
+        Args:
+            *patterns:
+                The initial patterns of the index. They are used as their own labels.
+        """
+        self._root = _PatternNode()
+        self._size = 0
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, pattern: Pattern, label=None) -> None:
+        """Add a pattern to the index.
+
+        Args:
+            pattern:
+                The pattern to add.
+            label:
+                An optional label that is yielded by `generalisations()` instead of the pattern.
+        """
+        instructions = []  # type: List[tuple]
+        _compile_query(pattern.expression, True, instructions)
+        node = self._root
+        for instruction in instructions:
+            kind = instruction[0]
+            if kind == _OPERATION:
+                children, key = node.operations, instruction[1]
+            elif kind == _SKIP:
+                children, key = node.skips, instruction[1:]
+            else:
+                children, key = node.children, instruction
+            child = children.get(key)
+            if child is None:
+                child = children[key] = _PatternNode()
+            node = child
+        node.patterns.append(_StoredPattern(pattern, pattern if label is None else label))
+        self._size += 1
+
+    def generalisations(self, pattern: Pattern) -> Iterator[object]:
+        """Yield the labels of the stored patterns that generalise the given pattern in the order they were added.
+
+        Args:
+            pattern:
+                The query pattern.
+
+        Yields:
+            The label of every stored pattern that generalises the query.
+        """
+        subject = _freeze(pattern.expression)
+        flatterm = FlatTerm(subject)
+        atoms = list(flatterm)
+        # The index of the next sibling for the start of every subterm of the query
+        next_sibling = flatterm.skips
+
+        leaves = {}  # type: Dict[int, _PatternNode]
+        stack = [(self._root, 0)]
+        while stack:
+            node, index = stack.pop()
+            if index == len(atoms):
+                if node.patterns:
+                    leaves[id(node)] = node
+                continue
+            atom = atoms[index]
+            if atom is OPERATION_END:
+                child = node.children.get((_END, ))
+                if child is not None:
+                    stack.append((child, index + 1))
+            elif is_operation(atom):
+                for operation, child in node.operations.items():
+                    if issubclass(atom, operation):
+                        stack.append((child, index + 1))
+            else:
+                for key in ((_SYMBOL, atom.name), (_SYMBOL_TYPE, )):
+                    child = node.children.get(key)
+                    if child is not None:
+                        stack.append((child, index + 1))
+            for (min_count, max_count), child in node.skips.items():
+                count = 0
+                position = index
+                while True:
+                    if count >= min_count:
+                        stack.append((child, position))
+                    if count >= max_count or position == len(atoms) or atoms[position] is OPERATION_END:
+                        break
+                    position = next_sibling[position]
+                    count += 1
+
+        stored_patterns = [stored for leaf in leaves.values() for stored in leaf.patterns]
+        stored_patterns.sort(key=lambda stored: stored.index)
+        for stored in stored_patterns:
+            if stored.generalises(pattern, subject):
+                yield stored.label
+
+
+class _PatternNode:
+    """A node in the trie of a `GeneralisationIndex`.
+
+    The edges are labeled with the instructions that the stored patterns compile to (see `_compile_query()`).
+    """
+
+    __slots__ = ('children', 'operations', 'skips', 'patterns')
+
+    def __init__(self) -> None:
+        self.children = {}  # type: Dict[tuple, _PatternNode]
+        self.operations = {}  # type: Dict[Type[Operation], _PatternNode]
+        self.skips = {}  # type: Dict[Tuple[int, float], _PatternNode]
+        self.patterns = []  # type: List[_StoredPattern]
+
+
+class _StoredPattern:
+    """A pattern in a `GeneralisationIndex` together with the information needed to check its matches."""
+
+    _counter = itertools.count()
+
+    def __init__(self, pattern: Pattern, label) -> None:
+        self.pattern = pattern
+        self.label = label
+        self.index = next(self._counter)
+        # Anonymous wildcards are named, so that their matches can be checked as well
+        names = iter('_{}'.format(i) for i in itertools.count())
+        taken = get_variables(pattern.expression)
+        self.variables = {}  # type: Dict[str, Wildcard]
+        self.expression = _name_wildcards(pattern.expression, names, taken, self.variables)
+
+    def generalises(self, pattern: Pattern, subject: Expression) -> bool:
+        if self.pattern == pattern:
+            return True
+        if self.pattern.constraints:
+            return False
+        return any(self._is_valid(substitution) for substitution in match(subject, Pattern(self.expression)))
+
+    def _is_valid(self, substitution: Substitution) -> bool:
+        """Check that the substitution does not depend on placeholders standing for more than they can."""
+        for name, value in substitution.items():
+            wildcard = self.variables.get(name)
+            if wildcard is None:
+                continue
+            items = value if isinstance(value, (tuple, Multiset)) else (value, )
+            if wildcard.fixed_size:
+                for item in items:
+                    if isinstance(item, _SequencePlaceholder) and not (
+                            isinstance(item, _OptionalPlaceholder) and wildcard.optional is not None):
+                        return False
+                    if isinstance(wildcard, SymbolWildcard) and isinstance(item, _TermPlaceholder):
+                        return False
+                    # An associative operation formed from operands which all could be empty
+                    if isinstance(item, AssociativeOperation) and sum(
+                            1 for o in op_iter(item) if not isinstance(o, _SequencePlaceholder)) < 2:
+                        return False
+            elif sum(1 for item in items if not isinstance(item, _SequencePlaceholder)) < wildcard.min_count:
+                return False
+        return True
+
+
+def _name_wildcards(expression: Expression, names: Iterator[str], taken: Set[str],
+                    variables: Dict[str, Wildcard]) -> Expression:
+    """Give the anonymous wildcards in the expression unique names and collect all the wildcards by name."""
+    if isinstance(expression, Wildcard):
+        name = expression.variable_name
+        if name is None:
+            name = next(names)
+            while name in taken:
+                name = next(names)
+            if isinstance(expression, SymbolWildcard):
+                expression = SymbolWildcard(expression.symbol_type, name)
+            else:
+                expression = Wildcard(expression.min_count, expression.fixed_size, name, expression.optional)
+        variables[name] = expression
+        return expression
+    if isinstance(expression, Operation):
+        operands = [_name_wildcards(o, names, taken, variables) for o in op_iter(expression)]
+        return create_operation_expression(expression, operands)
+    return expression
+
+
+class _TermPlaceholder(Symbol):
+    """A symbol that stands in for a single term in a pattern."""
+
+
+class _SymbolPlaceholder(Symbol):
+    """A symbol that stands in for a single symbol in a pattern."""
+
+
+class _SequencePlaceholder(Symbol):
+    """A symbol that stands in for any number of terms (including none) in a pattern."""
+
+
+class _OptionalPlaceholder(_SequencePlaceholder):
+    """A symbol that stands in for a single optional term in a pattern."""
+
+
+_SYMBOL_PLACEHOLDER_TYPES = {Symbol: _SymbolPlaceholder}  # type: Dict[Type[Symbol], Type[_SymbolPlaceholder]]
+
+
+def _freeze(expression: Expression) -> Expression:
+    """Replace the wildcards in the pattern expression with placeholder symbols."""
+    names = ('?{}'.format(i) for i in itertools.count())
+    return _freeze_operands(expression, names, True)[0]
+
+
+def _freeze_operands(expression: Expression, names: Iterator[str], top_level: bool) -> List[Expression]:
+    if isinstance(expression, Wildcard):
+        name = '?' + expression.variable_name if expression.variable_name else next(names)
+        if isinstance(expression, SymbolWildcard):
+            symbol_type = expression.symbol_type
+            placeholder_type = _SYMBOL_PLACEHOLDER_TYPES.get(symbol_type)
+            if placeholder_type is None:
+                placeholder_type = type(symbol_type.__name__, (_SymbolPlaceholder, symbol_type), {})
+                _SYMBOL_PLACEHOLDER_TYPES[symbol_type] = placeholder_type
+            return [placeholder_type(name)]
+        if top_level:
+            return [_TermPlaceholder(name)]
+        if expression.optional is not None:
+            return [_OptionalPlaceholder(name) if expression.fixed_size else _SequencePlaceholder(name)]
+        terms = [_TermPlaceholder('{}.{}'.format(name, i)) for i in range(expression.min_count)]
+        if not expression.fixed_size:
+            terms.append(_SequencePlaceholder(name))
+        return terms
+    if isinstance(expression, Symbol):
+        return [type(expression)(expression.name)]
+    if isinstance(expression, Operation):
+        operands = [term for operand in op_iter(expression) for term in _freeze_operands(operand, names, False)]
+        return [create_operation_expression(expression, operands, variable_name=False)]
+    return [expression]
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""This module contains rewriting strategies which control where and how often replacement rules are applied.
+
+A strategy is built from a :class:`.ManyToOneReplacer` (or just a list of replacement rules), which rewrites a
+single expression at its root. The strategies are then combined with traversals:
+
+>>> rules = [
+...     ReplacementRule(Pattern(f(a, x_)), lambda x: f(x)),
+...     ReplacementRule(Pattern(f(f(x_))), lambda x: x),
+... ]
+>>> expression = f(a, f(a, f(a, b)))
+>>> print(OnceTopDown(rules)(expression))
+f(f(a, f(a, b)))
+>>> print(OnceBottomUp(rules)(expression))
+f(a, f(a, f(b)))
+>>> print(Innermost(rules)(expression))
+f(b)
+>>> print(Outermost(rules)(expression))
+f(b)
+
+- `Rewrite` applies the rules at the root of the expression only.
+- `OnceTopDown` applies a strategy once, at the first position in preorder where it succeeds.
+- `OnceBottomUp` applies a strategy once, at the first position in postorder where it succeeds.
+- `Innermost` applies the rules until no rule matches anymore, rewriting the innermost subexpressions first.
+- `Outermost` applies the rules until no rule matches anymore, rewriting the outermost subexpressions first.
+- `Fixpoint` repeats a strategy until it does not succeed anymore.
+- `Chain` applies multiple strategies in sequence.
+
+Every strategy can be called with an expression and returns the rewritten expression, or the unchanged expression if
+the strategy did not succeed. Strategies share unchanged subexpressions between the original and the rewritten
+expression and only rebuild the ancestors of the rewritten positions.
+"""
+import math
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+from .expressions.expressions import Expression, Operation
+from .expressions.functions import create_operation_expression, op_iter
+from .expressions.substitution import Substitution
+from .functions import Replacement, ReplacementRule, _replace_all_incremental
+from .matching.many_to_one import ManyToOneReplacer
+
+__all__ = ['Strategy', 'Rewrite', 'OnceTopDown', 'OnceBottomUp', 'Innermost', 'Outermost', 'Fixpoint', 'Chain']
+
+StrategyLike = Union['Strategy', ManyToOneReplacer, Iterable[ReplacementRule]]
+
+
+class Strategy:
+    """Base class for rewriting strategies.
+
+    Subclasses implement `apply()`.
+    """
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        """Apply the strategy to the expression.
+
+        Args:
+            expression:
+                The expression to rewrite.
+
+        Returns:
+            The rewritten expression or ``None`` if the strategy did not succeed, i.e. nothing was rewritten.
+        """
+        raise NotImplementedError()
+
+    def __call__(self, expression: Expression) -> Replacement:
+        result = self.apply(expression)
+        return expression if result is None else result
+
+
+def _as_strategy(strategy: StrategyLike) -> Strategy:
+    if isinstance(strategy, Strategy):
+        return strategy
+    return Rewrite(strategy)
+
+
+def _as_rewrite(strategy: StrategyLike) -> 'Rewrite':
+    strategy = _as_strategy(strategy)
+    if not isinstance(strategy, Rewrite):
+        raise TypeError("Expected replacement rules, a ManyToOneReplacer or a Rewrite, got {!r}".format(strategy))
+    return strategy
+
+
+def _replace_operand(operation: Operation, operands: List[Expression], index: int,
+                     replacement: Replacement) -> Replacement:
+    """Create a copy of the operation with the operand at the given index replaced like `replace` does."""
+    operands = list(operands)
+    operands[index] = replacement
+    return _create_operation(operation, operands)
+
+
+def _create_operation(operation: Operation, operands: List[Replacement]) -> Replacement:
+    """Create a copy of the operation with new operands, inserting the expressions of sequence operands."""
+    new_operands = []
+    for operand in operands:
+        if isinstance(operand, Sequence):
+            new_operands.extend(operand)
+        else:
+            new_operands.append(operand)
+    return create_operation_expression(operation, new_operands)
+
+
+def _is_absorbed(replacement: Replacement, operation: Operation) -> bool:
+    """Check whether the replacement of an operand is merged into the operation instead of becoming an operand."""
+    return isinstance(replacement, Sequence) or (
+        getattr(operation, 'associative', False) and isinstance(replacement, type(operation))
+    )
+
+
+class Rewrite(Strategy):
+    """Rewrite the root of an expression with the first rule of a :class:`.ManyToOneReplacer` that matches it."""
+
+    def __init__(self, rules: Union[ManyToOneReplacer, Iterable[ReplacementRule]]) -> None:
+        """
+        Args:
+            rules:
+                A replacer or the replacement rules to build one from.
+        """
+        if not isinstance(rules, ManyToOneReplacer):
+            rules = ManyToOneReplacer(*rules)
+        self.replacer = rules
+
+    def find_rule(self, expression: Expression) -> Optional[Tuple[ReplacementRule, Substitution]]:
+        """Return the first matching rule and the substitution of its match or ``None`` if there is none."""
+        return self.replacer._find_rule(expression)
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        rewrite = self.replacer._find_rule(expression)
+        if rewrite is None:
+            return None
+        rule, subst = rewrite
+        return rule.replacement(**subst)
+
+
+class OnceTopDown(Strategy):
+    """Apply a strategy once at the first position in preorder where it succeeds."""
+
+    def __init__(self, strategy: StrategyLike) -> None:
+        self.strategy = _as_strategy(strategy)
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        result = self.strategy.apply(expression)
+        if result is not None:
+            return result
+        if isinstance(expression, Operation):
+            operands = list(op_iter(expression))
+            for index, operand in enumerate(operands):
+                result = self.apply(operand)
+                if result is not None:
+                    return _replace_operand(expression, operands, index, result)
+        return None
+
+
+class OnceBottomUp(Strategy):
+    """Apply a strategy once at the first position in postorder where it succeeds."""
+
+    def __init__(self, strategy: StrategyLike) -> None:
+        self.strategy = _as_strategy(strategy)
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        if isinstance(expression, Operation):
+            operands = list(op_iter(expression))
+            for index, operand in enumerate(operands):
+                result = self.apply(operand)
+                if result is not None:
+                    return _replace_operand(expression, operands, index, result)
+        return self.strategy.apply(expression)
+
+
+class Innermost(Strategy):
+    """Rewrite an expression to normal form, always rewriting the innermost subexpressions first.
+
+    The result is the same as repeating `OnceBottomUp` until it does not succeed anymore. However, the operands of an
+    expression are normalised before the expression itself and every subexpression instance that is already known to
+    be normalised (e.g. because a rule copied it from the substitution into its replacement) is not visited again.
+
+    If the rules are not terminating, neither is the rewriting.
+    """
+
+    def __init__(self, rules: StrategyLike) -> None:
+        """
+        Args:
+            rules:
+                The replacement rules, a replacer or a `Rewrite`.
+        """
+        self.strategy = _as_rewrite(rules)
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        return self._normalise(expression, {}, None)
+
+    def _normalise(self, expression, normal_forms, parent):
+        """Return the normal form of the expression or None if it is already normalised.
+
+        The *normal_forms* map the ids of visited expressions to the expression (to keep the id valid) and its normal
+        form, which is None if it is the expression itself.
+
+        If a rewrite results in a sequence or in an operation that is flattened into the associative *parent*, the
+        result is returned right away, because its operands become operands of the parent and are normalised there.
+        """
+        entry = normal_forms.get(id(expression))
+        if entry is not None:
+            return entry[1]
+        result = None
+        current = expression
+        while True:
+            if isinstance(current, Operation):
+                new_operation = self._normalise_operands(current, normal_forms)
+                if new_operation is not None:
+                    current = result = new_operation
+            rewritten = self.strategy.apply(current)
+            if rewritten is None:
+                break
+            current = result = rewritten
+            if parent is not None and _is_absorbed(rewritten, parent):
+                return rewritten
+            if isinstance(rewritten, Sequence):
+                result = [self._normalise(e, normal_forms, None) or e for e in rewritten]
+                break
+            entry = normal_forms.get(id(rewritten))
+            if entry is not None:
+                result = entry[1] or rewritten
+                break
+        normal_forms[id(expression)] = (expression, result)
+        if result is not None:
+            normal_forms[id(result)] = (result, None)
+        return result
+
+    def _normalise_operands(self, operation, normal_forms):
+        result = None
+        while True:
+            operands = list(op_iter(operation))
+            changed = absorbed = False
+            for index, operand in enumerate(operands):
+                new_operand = self._normalise(operand, normal_forms, operation)
+                if new_operand is not None:
+                    operands[index] = new_operand
+                    changed = True
+                    if _is_absorbed(new_operand, operation):
+                        absorbed = True
+                        break
+            if not changed:
+                return result
+            operation = result = _create_operation(operation, operands)
+            # Operands merged into the operation still have to be normalised
+            if not absorbed or not isinstance(operation, Operation):
+                return result
+
+
+class Outermost(Strategy):
+    """Rewrite an expression to normal form, always rewriting the outermost subexpressions first.
+
+    This is the same strategy that :func:`~matchpy.functions.replace_all` and :meth:`.ManyToOneReplacer.replace`
+    use: The first subexpression in preorder that can be rewritten is rewritten until there is none left. After a
+    rewrite, only the ancestors of the rewritten position are checked again before the traversal continues at the
+    rewritten position.
+    """
+
+    def __init__(self, rules: StrategyLike, max_count: int=math.inf) -> None:
+        """
+        Args:
+            rules:
+                The replacement rules, a replacer or a `Rewrite`.
+            max_count:
+                If given, at most *max_count* rewrites are performed.
+        """
+        self.strategy = _as_rewrite(rules)
+        self.max_count = max_count
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        rewritten = []
+
+        def find_rule(subexpression):
+            rewrite = self.strategy.find_rule(subexpression)
+            if rewrite is not None:
+                rewritten.append(True)
+            return rewrite
+
+        result = _replace_all_incremental(expression, find_rule, self.max_count)
+        return result if rewritten else None
+
+
+class Fixpoint(Strategy):
+    """Repeat a strategy until it does not succeed anymore.
+
+    Succeeds if the strategy succeeded at least once. If the strategy always succeeds, the rewriting does not
+    terminate unless a *max_count* is given.
+    """
+
+    def __init__(self, strategy: StrategyLike, max_count: int=math.inf) -> None:
+        """
+        Args:
+            strategy:
+                The strategy to repeat.
+            max_count:
+                If given, the strategy is applied at most *max_count* times.
+        """
+        self.strategy = _as_strategy(strategy)
+        self.max_count = max_count
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        result = None
+        count = 0
+        while count < self.max_count:
+            rewritten = self.strategy.apply(expression)
+            if rewritten is None:
+                break
+            expression = result = rewritten
+            count += 1
+        return result
+
+
+class Chain(Strategy):
+    """Apply multiple strategies in sequence.
+
+    A strategy that does not succeed leaves the expression unchanged and the next strategy is applied to it. The
+    sequence succeeds if any of the strategies succeeds.
+
+    >>> simplify = Chain(
+    ...     Innermost([ReplacementRule(Pattern(f(a, x_)), lambda x: x)]),
+    ...     OnceTopDown([ReplacementRule(Pattern(x_), lambda x: f(x))]),
+    ... )
+    >>> print(simplify(f(a, f(a, b))))
+    f(b)
+    """
+
+    def __init__(self, *strategies: StrategyLike) -> None:
+        """
+        Args:
+            *strategies:
+                The strategies in the order in which they are applied.
+        """
+        self.strategies = tuple(_as_strategy(s) for s in strategies)  # type: Tuple[Strategy, ...]
+
+    def apply(self, expression: Expression) -> Optional[Replacement]:
+        result = None
+        for strategy in self.strategies:
+            rewritten = strategy.apply(expression)
+            if rewritten is not None:
+                expression = result = rewritten
+        return result
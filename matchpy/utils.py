@@ -17,8 +17,8 @@ from multiset import Multiset
 
 __all__ = [
     'fixed_integer_vector_iter', 'weak_composition_iter', 'commutative_sequence_variable_partition_iter',
-    'get_short_lambda_source', 'solve_linear_diop', 'generator_chain', 'cached_property', 'slot_cached_property',
-    'extended_euclid', 'base_solution_linear'
+    'commutative_sequence_variable_partition_count', 'get_short_lambda_source', 'solve_linear_diop', 'generator_chain',
+    'cached_property', 'slot_cached_property', 'extended_euclid', 'base_solution_linear'
 ]
 
 T = TypeVar('T')
@@ -231,6 +231,62 @@ def commutative_sequence_variable_partition_iter(values: 'Multiset[T]', variable
                 del subst[None]
             yield subst
 
+
+def commutative_sequence_variable_partition_count(values: 'Multiset[T]', variables: List[VariableWithCount]) -> int:
+    """Count the substitutions that `commutative_sequence_variable_partition_iter` would yield.
+
+    Instead of enumerating every partition, the number of partitions is computed combinatorially. For every distinct
+    value, the ways to distribute its occurrences among the variables are combined with a dynamic programming table
+    that only tracks how many values each variable has received so far (capped at what is needed to satisfy its
+    minimum length).
+
+    Example:
+
+        >>> x = VariableWithCount(name='x', count=1, minimum=1, default=None)
+        >>> y = VariableWithCount(name='y', count=2, minimum=0, default=None)
+        >>> commutative_sequence_variable_partition_count(Multiset('aaabbc'), [x, y])
+        4
+
+    Args:
+        values:
+            The multiset of values which are partitioned and distributed among the variables.
+        variables:
+            A list of the variables to distribute the values among.
+
+    Returns:
+        The number of possible substitutions.
+    """
+    if len(variables) == 1:
+        return sum(1 for _ in _commutative_single_variable_partiton_iter(values, variables[0]))
+
+    var_counts = tuple(v.count for v in variables)
+    caps = tuple(max(v.minimum, 1) for v in variables)
+    table = {(0, ) * len(variables): 1}
+    for count in values.values():
+        cache_key = (count, *var_counts)
+        if cache_key in _linear_diop_solution_cache:
+            solutions = _linear_diop_solution_cache[cache_key]
+        else:
+            solutions = list(solve_linear_diop(count, *var_counts))
+            _linear_diop_solution_cache[cache_key] = solutions
+        new_table = {}
+        for lengths, ways in table.items():
+            for solution in solutions:
+                key = tuple(min(l + s, c) for l, s, c in zip(lengths, solution, caps))
+                new_table[key] = new_table.get(key, 0) + ways
+        table = new_table
+        if not table:
+            return 0
+
+    total = 0
+    for lengths, ways in table.items():
+        for length, var in zip(lengths, variables):
+            if not (var.default is not None and length == 0) and length < var.minimum:
+                break
+        else:
+            total += ways
+    return total
+
 class LambdaNodeVisitor(ast.NodeVisitor):
     def __init__(self, lines):
         self.lines = lines
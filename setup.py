@@ -38,7 +38,6 @@ setup(
         'hypothesis',
     ],
     install_requires=[
-        'hopcroftkarp>=1.2,<2.0',
         'multiset>=2.0,<3.0',
     ],
     extras_require={
@@ -6,7 +6,10 @@ import hypothesis.strategies as st
 from hypothesis import given
 import pytest
 
-from matchpy.matching.bipartite import BipartiteGraph, _DirectedMatchGraph, enum_maximum_matchings_iter
+from matchpy.matching.bipartite import (
+    BipartiteGraph, BipartiteGraphView, _DirectedMatchGraph, enum_maximum_matchings_iter, enum_b_matchings_iter,
+    enum_b_matching_left_counts_iter
+)
 
 
 @st.composite
@@ -39,6 +42,84 @@ def test_enum_maximum_matchings_iter_correctness(graph):
         matchings.add(frozen_matching)
 
 
+def _maximum_matching_size(graph):
+    left = sorted({l for l, _ in graph})
+    right = sorted({r for _, r in graph})
+    for size in range(min(len(left), len(right)), 0, -1):
+        for lefts in itertools.combinations(left, size):
+            for rights in itertools.permutations(right, size):
+                if all(edge in graph for edge in zip(lefts, rights)):
+                    return size
+    return 0
+
+
+def _assert_maximum_matching(graph, matching):
+    assert len(set(matching.values())) == len(matching)
+    for edge in matching.items():
+        assert edge in graph
+    assert len(matching) == _maximum_matching_size(graph)
+
+
+@given(bipartite_graph(), st.data())
+def test_enum_maximum_matchings_iter_view(graph, data):
+    edges = sorted(graph)
+    if edges:
+        edge = data.draw(st.sampled_from(edges))
+        view = graph.without_nodes(edge) if data.draw(st.booleans()) else graph.without_edge(edge)
+    else:
+        view = graph.limited_to({0}, {0})
+    original = dict(graph)
+    matchings = sorted(sorted(matching.items()) for matching in enum_maximum_matchings_iter(view))
+    expected = sorted(sorted(matching.items()) for matching in enum_maximum_matchings_iter(BipartiteGraph(view)))
+    assert matchings == expected
+    assert graph == original
+    assert dict(view) == dict(BipartiteGraph(view))
+
+
+@given(bipartite_graph())
+def test_find_matching(graph):
+    _assert_maximum_matching(graph, graph.find_matching())
+
+
+@given(bipartite_graph(), st.lists(st.tuples(st.booleans(), st.integers(0, 4), st.integers(0, 3)), max_size=10))
+def test_find_matching_incremental(graph, changes):
+    _assert_maximum_matching(graph, graph.find_matching())
+    for add, left, right in changes:
+        if add:
+            graph[left, right] = True
+        elif (left, right) in graph:
+            del graph[left, right]
+        _assert_maximum_matching(graph, graph.find_matching())
+    copy = graph.__copy__()
+    assert copy.find_matching() == graph.find_matching()
+
+
+def test_find_matching_long_augmenting_path():
+    n = 2000
+    graph = BipartiteGraph(((i, i), True) for i in range(n))
+    assert graph.find_matching() == {i: i for i in range(n)}
+    for i in range(n):
+        graph[i + 1, i] = True
+    del graph[0, 0]
+    assert graph.find_matching() == {i + 1: i for i in range(n)}
+
+
+@given(bipartite_graph())
+def test_enum_maximum_matchings_iter_completeness(graph):
+    size = _maximum_matching_size(graph)
+    left = sorted({l for l, _ in graph})
+    right = sorted({r for _, r in graph})
+    expected = set()
+    if size > 0:
+        for lefts in itertools.combinations(left, size):
+            for rights in itertools.permutations(right, size):
+                if all(edge in graph for edge in zip(lefts, rights)):
+                    expected.add(frozenset(zip(lefts, rights)))
+    edges = dict(graph.edges_with_labels())
+    assert set(frozenset(m.items()) for m in enum_maximum_matchings_iter(graph)) == expected
+    assert graph == edges
+
+
 @pytest.mark.parametrize('n, m', filter(lambda x: x[0] >= x[1], itertools.product(range(1, 6), range(0, 4))))
 def test_completeness(n, m):
     graph = BipartiteGraph(map(lambda x: (x, True), itertools.product(range(n), range(m))))
@@ -47,6 +128,61 @@ def test_completeness(n, m):
     assert count == expected_count
 
 
+@st.composite
+def b_matching_problem(draw):
+    n = draw(st.integers(min_value=1, max_value=3))
+    m = draw(st.integers(min_value=1, max_value=3))
+    graph = BipartiteGraph()
+    for i in range(n):
+        for j in range(m):
+            if draw(st.booleans()):
+                graph[i, j] = True
+    capacities = {i: draw(st.integers(min_value=0, max_value=3)) for i in range(n)}
+    demands = {j: draw(st.integers(min_value=0, max_value=2)) for j in range(m)}
+    return graph, capacities, demands
+
+
+@given(b_matching_problem())
+def test_enum_b_matchings_iter_completeness(problem):
+    graph, capacities, demands = problem
+    edges = sorted(graph)
+    expected = set()
+    for counts in itertools.product(range(3), repeat=len(edges)):
+        left_counts = dict.fromkeys(capacities, 0)
+        right_counts = dict.fromkeys(demands, 0)
+        for (left, right), count in zip(edges, counts):
+            left_counts[left] += count
+            right_counts[right] += count
+        if all(left_counts[l] <= c for l, c in capacities.items()) and right_counts == demands:
+            expected.add(frozenset((edge, count) for edge, count in zip(edges, counts) if count))
+    b_matchings = [frozenset(b_matching.items()) for b_matching in enum_b_matchings_iter(graph, capacities, demands)]
+    assert len(b_matchings) == len(set(b_matchings)), "B-matching was duplicate"
+    assert set(b_matchings) == expected
+
+
+@given(b_matching_problem())
+def test_enum_b_matching_left_counts_iter(problem):
+    graph, capacities, demands = problem
+    expected = set()
+    for b_matching in enum_b_matchings_iter(graph, capacities, demands):
+        counts = dict.fromkeys(capacities, 0)
+        for (left, _), count in b_matching.items():
+            counts[left] += count
+        expected.add(frozenset((left, count) for left, count in counts.items() if count))
+    left_counts = [frozenset(counts.items()) for counts in enum_b_matching_left_counts_iter(graph, capacities, demands)]
+    assert len(left_counts) == len(set(left_counts)), "Left counts were duplicate"
+    assert set(left_counts) == expected
+
+
+@pytest.mark.parametrize('n, m', itertools.product(range(1, 4), range(1, 4)))
+def test_enum_b_matchings_iter_multiplicities(n, m):
+    """A complete graph with one left node of capacity n * m and m right nodes of demand n has one b-matching."""
+    graph = BipartiteGraph(((0, j), True) for j in range(m))
+    b_matchings = list(enum_b_matchings_iter(graph, {0: n * m}, {j: n for j in range(m)}))
+    assert b_matchings == [{(0, j): n for j in range(m)}]
+    assert list(enum_b_matchings_iter(graph, {0: n * m - 1}, {j: n for j in range(m)})) == []
+
+
 @pytest.mark.parametrize(
     '   graph,                      expected_cycle',
     [
@@ -75,6 +211,15 @@ def test_directed_graph_find_cycle(graph, expected_cycle):
     assert cycle == expected_cycle
 
 
+def test_directed_graph_find_cycle_long_path():
+    n = 5000
+    dmg = _DirectedMatchGraph({}, {})
+    dmg.update((i, {i + 1}) for i in range(n))
+    assert dmg.find_cycle() == []
+    dmg[n] = {n - 10}
+    assert dmg.find_cycle() == list(range(n - 10, n + 1))
+
+
 class TestBipartiteGraphTest:
     def test_setitem(self):
         graph = BipartiteGraph()
@@ -146,3 +291,82 @@ class TestBipartiteGraphTest:
         assert not {(1, 2): True} == BipartiteGraph({(1, 1): True})
         assert not BipartiteGraph() == ''
         assert not '' == BipartiteGraph()
+
+
+class TestBipartiteGraphViewTest:
+    def test_without_nodes(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 0): True, (1, 1): True, (0, 1): True, (2, 2): True})
+        view = graph.without_nodes((0, 0))
+
+        assert isinstance(view, BipartiteGraphView)
+        assert view == {(1, 1): True, (2, 2): True}
+        assert view.without_nodes((2, 2)) == {(1, 1): True}
+        assert len(graph) == 5
+
+    def test_without_edge(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 0): True, (1, 1): True})
+        view = graph.without_edge((1, 0))
+
+        assert view == {(0, 0): True, (1, 1): True}
+        assert view.without_edge((0, 0)) == {(1, 1): True}
+        assert (1, 0) in graph
+
+    def test_chained(self):
+        graph = BipartiteGraph({(l, r): True for l in range(3) for r in range(3)})
+        view = graph.limited_to({0, 1}, {0, 1, 2}).without_edge((0, 2)).without_nodes((1, 0))
+
+        assert view == {(0, 1): True}
+        assert view.limited_to({1, 2}, {1}) == {}
+
+    def test_getitem(self):
+        graph = BipartiteGraph({(0, 0): 'a', (1, 1): 'b'})
+        view = graph.without_nodes((0, 0))
+
+        assert view[1, 1] == 'b'
+        assert (1, 1) in view
+        assert (0, 0) not in view
+        assert 0 not in view
+
+        with pytest.raises(KeyError):
+            _ = view[0, 0]
+
+        with pytest.raises(TypeError):
+            _ = view[0]
+
+        with pytest.raises(TypeError):
+            _ = view[0, 1, 2]
+
+    def test_read_only(self):
+        view = BipartiteGraph({(0, 0): True}).without_edge((0, 0))
+
+        with pytest.raises(TypeError):
+            view[1, 1] = True
+
+    def test_reflects_base_changes(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 1): True})
+        view = graph.without_nodes((0, 0))
+
+        graph[2, 2] = True
+        graph[0, 2] = True
+        del graph[1, 1]
+
+        assert view == {(2, 2): True}
+
+    def test_find_matching(self):
+        graph = BipartiteGraph({(0, 0): True, (0, 1): True, (1, 0): True})
+        assert graph.find_matching() == {0: 1, 1: 0}
+
+        view = graph.without_edge((0, 1))
+        matching = view.find_matching()
+        assert len(matching) == 1
+        assert all(edge in view for edge in matching.items())
+        assert graph.without_nodes((1, 0)).find_matching() == {0: 1}
+        assert graph.find_matching() == {0: 1, 1: 0}
+
+    def test_copy(self):
+        graph = BipartiteGraph({(0, 0): True, (1, 1): True})
+        copy = BipartiteGraph(graph.without_edge((0, 0)))
+
+        del graph[1, 1]
+
+        assert copy == {(1, 1): True}
@@ -2,13 +2,20 @@
 from hypothesis import assume, given
 import hypothesis.strategies as st
 import pytest
-
-from matchpy.expressions.expressions import Arity, Operation, Symbol, Wildcard, Pattern
-from matchpy.functions import ReplacementRule, replace, replace_all, substitute, replace_many, is_match
+from multiset import Multiset
+
+from matchpy.expressions.expressions import Arity, Expression, Operation, Symbol, Wildcard, Pattern
+from matchpy.expressions.functions import preorder_iter_with_position
+from matchpy.functions import (
+    ReplacementRule, replace, replace_all, substitute, replace_many, is_match, replace_all_post_order, NormalFormCache,
+    ReplacementRuleIndex, RewriteBudget, StopReason, replace_all_bounded, replace_all_post_order_bounded,
+    RewriteTrace, ReplacementTemplate, minimise_rules
+)
 from matchpy.matching.one_to_one import match_anywhere
 from matchpy.matching.one_to_one import match as match_one_to_one
 from matchpy.matching.many_to_one import ManyToOneReplacer
 from .common import *
+from .test_matching import PARAM_MATCHES, PARAM_PATTERNS
 
 
 @pytest.mark.parametrize(
@@ -23,7 +30,12 @@ def test_is_match(expr, pattern, do_match):
     assert is_match(expr, Pattern(pattern)) == do_match
 
 
+def template_substitute_wrapper(expression, substitution):
+    return ReplacementTemplate(expression).substitute(substitution)
+
+
 class TestSubstitute:
+    @pytest.mark.parametrize('substitute', [substitute, template_substitute_wrapper])
     @pytest.mark.parametrize(
         '   expression,                         substitution,           expected_result,    replaced',
         [
@@ -42,10 +54,16 @@ class TestSubstitute:
             (f(x_, y_),                         {'x': a, 'y': b},       f(a, b),            True),
             (f(x_, y_),                         {'x': [a, c], 'y': b},  f(a, c, b),         True),
             (f(x_, y_),                         {'x': a, 'y': [b, c]},  f(a, b, c),         True),
-            (Pattern(f(x_)),                    {'x': a},               f(a),               True)
+            (Pattern(f(x_)),                    {'x': a},               f(a),               True),
+            (f(a, f(b, x_), f(c)),              {'x': a},               f(a, f(b, a), f(c)), True),
+            (f(a, f(b, x_), f(c)),              {'y': a},               f(a, f(b, x_), f(c)), False),
+            (f(x_, f(y_)),                      {'y': [a, b]},          f(x_, f(a, b)),     True),
+            (f_c(x_, a),                        {'x': Multiset([c, b])}, f_c(a, b, c),      True),
+            (f(a, variable_name='z'),           {'z': [b, c]},          [b, c],             True),
+            (f(x_, variable_name='z'),          {'x': b},               f(b, variable_name='z'), True),
         ]
     )  # yapf: disable
-    def test_substitute(self, expression, substitution, expected_result, replaced):
+    def test_substitute(self, substitute, expression, substitution, expected_result, replaced):
         result = substitute(expression, substitution)
         assert result == expected_result, "Substitution did not yield expected result"
         if replaced:
@@ -54,6 +72,30 @@ class TestSubstitute:
             assert result is expression, "When nothing is substituted, the original expression has to be returned"
 
 
+class TestReplacementTemplate:
+    def test_constant_subexpressions_are_shared(self):
+        constant = f(a, f2(b, c))
+        template = ReplacementTemplate(f(x_, constant, f2(constant, y_)))
+        result = template.substitute({'x': a, 'y': b})
+        assert result == f(a, constant, f2(constant, b))
+        assert result[1, ] is constant
+        assert result[2, 0] is constant
+
+    def test_without_variables(self):
+        expression = f(a, f2(b, c))
+        template = ReplacementTemplate(expression)
+        assert template.substitute({'x': a}) is expression
+        assert template() is expression
+
+    def test_as_replacement(self):
+        rules = [
+            ReplacementRule(Pattern(f(a, x_, y_)), ReplacementTemplate(f2(y_, f(b, x_)))),
+            ReplacementRule(Pattern(f2(x_, f(b, y___))), ReplacementTemplate(f(y___, x_))),
+        ]
+        assert replace_all(f(a, b, c), rules) == f(b, c)
+        assert ManyToOneReplacer(*rules).replace(f(a, b, c)) == f(b, c)
+
+
 def many_replace_wrapper(expression, position, replacement):
     return replace_many(expression, [(position, replacement)])
 
@@ -117,6 +159,9 @@ class TestReplaceManyTest:
             (f(f2(a, b), f2(c)),    [((0, 1),  a), ((1, 0),  b)],           f(f2(a, a), f2(b))),
             (f_c(f2(c), f2(a, b)),   [((0, 0),  b), ((1, 1),  a)],           f_c(f2(b), f2(a, a))),
             (f_c(f2(c), f2(a, b)),   [((1, 1),  a), ((0, 0),  b)],           f_c(f2(b), f2(a, a))),
+            (f(f2(a, b), c, f2(c)), [((2, 0), [a, b]), ((0, ), []), ((1, ), [c, c])], f(c, c, f2(a, b))),
+            (f(f2(a, f(b)), c),     [((0, 1, 0), [a, a]), ((0, 0), [])],    f(f2(f(a, a)), c)),
+            (f(a, b, c),            [((2, ), a), ((0, ), c), ((1, ), b)],   f(c, b, a)),
         ]
     )  # yapf: disable
     def test_substitution_match(self, expression, replacements, expected_result):
@@ -133,6 +178,27 @@ class TestReplaceManyTest:
             replace_many(a, [((), b), ((0, ), b)])
         with pytest.raises(IndexError):
             replace_many(a, [((0, ), b), ((1, ), b)])
+        with pytest.raises(IndexError):
+            replace_many(f(f2(a)), [((0, ), b), ((0, 0), b)])
+        with pytest.raises(IndexError):
+            replace_many(f(f2(a)), [((0, 0), b), ((0, ), b)])
+        with pytest.raises(IndexError):
+            replace_many(f(a, b), [((0, ), b), ((0, ), c)])
+        with pytest.raises(IndexError):
+            replace_many(f(a, b), [((0, ), b), ((2, ), c)])
+        with pytest.raises(IndexError):
+            replace_many(f(a, b), [((0, ), b), ((-1, ), c)])
+        with pytest.raises(IndexError):
+            replace_many(f(a, b), [((0, ), b), ((1, 0), c)])
+
+    @given(st.sets(st.tuples(st.integers(0, 3), st.integers(0, 3)), min_size=1))
+    def test_same_as_replace(self, positions):
+        expression = f(*(f2(*(f(a, f2(b)) for _ in range(4))) for _ in range(4)))
+        replacements = [(position, [Symbol('s{}{}'.format(*position))] * position[1]) for position in positions]
+        expected_result = expression
+        for position, replacement in sorted(replacements, reverse=True):
+            expected_result = replace(expected_result, position, replacement)
+        assert replace_many(expression, replacements) == expected_result
 
     def test_empty_replace(self):
         expression = f(a, b)
@@ -178,8 +244,12 @@ def test_match_error():
 def _many_to_one_replace(expression, rules):
     return ManyToOneReplacer(*rules).replace(expression)
 
+
+def _indexed_replace(expression, rules):
+    return replace_all(expression, ReplacementRuleIndex(rules))
+
 @pytest.mark.parametrize(
-    'replacer', [replace_all, _many_to_one_replace]
+    'replacer', [replace_all, _many_to_one_replace, _indexed_replace]
 )
 def test_logic_simplify(replacer):
     LAnd = Operation.new('and', Arity.variadic, 'LAnd', associative=True, one_identity=True, commutative=True)
@@ -331,3 +401,355 @@ def test_logic_simplify(replacer):
     result = replacer(expression, rules)
 
     assert result == LBot
+
+
+def _replace_all_restarting(expression, find_rewrite, max_count):
+    """Reference implementation that restarts the preorder traversal from the root after every replacement."""
+    for _ in range(max_count):
+        for subexpr, position in preorder_iter_with_position(expression):
+            rewrite = find_rewrite(subexpr)
+            if rewrite is not None:
+                replacement, subst = rewrite
+                expression = replace(expression, position, replacement(**subst))
+                break
+        else:
+            break
+    return expression
+
+
+INCREMENTAL_RULES = [
+    ReplacementRule(Pattern(f(a, x___)), lambda x: f(*x, b)),
+    ReplacementRule(Pattern(f2(x_, y_)), lambda x, y: [y, x, c]),
+    ReplacementRule(Pattern(f_u(x_)), lambda x: f_a(x, f_a(x, d))),
+    ReplacementRule(Pattern(f_i(b, x___)), lambda x: f_i(*x)),
+    ReplacementRule(Pattern(f_c(c, x___)), lambda x: f_c(a, *x)),
+    ReplacementRule(Pattern(f_a(x_, d)), lambda x: f2(x, x)),
+    ReplacementRule(Pattern(f(b, b, x___)), lambda x: [f2(a)] * len(x)),
+]
+
+
+@pytest.mark.parametrize(
+    '   expression',
+    [
+        f(a, f2(b, c), f_u(a)),
+        f(f_i(b, f(a, a)), f_c(c, f2(a, b)), f_u(f_u(b))),
+        f2(f(a, b), f(b, b, c, c), f_a(f_u(a), f_a(c, d))),
+        f_i(b, f_i(b, f2(c, f_u(a)))),
+        f_c(c, c, f(a, f2(a, b), a)),
+        f_c(d, f2(a, b), f_u(c)),
+        f(f_i(f(b, b), c), f_a(f_u(a), c)),
+    ]
+)  # yapf: disable
+@pytest.mark.parametrize('many_to_one', [False, True])
+def test_replace_all_incremental(expression, many_to_one):
+    if many_to_one:
+        replacer = ManyToOneReplacer(*INCREMENTAL_RULES)
+        find_rewrite = lambda e: next(((r.replacement, s) for r, s in replacer.matcher.match(e)), None)
+        replace_incremental = replacer.replace
+    else:
+        find_rewrite = lambda e: next(((r, s) for p, r in INCREMENTAL_RULES for s in match_one_to_one(e, p)), None)
+        replace_incremental = lambda e, m: replace_all(e, INCREMENTAL_RULES, m)
+
+    for max_count in range(30):
+        expected_result = _replace_all_restarting(expression, find_rewrite, max_count)
+        result = replace_incremental(expression, max_count)
+        assert result == expected_result, "Different result after {} replacements of {!s}".format(max_count, expression)
+
+
+class TestNormalFormCache:
+    RULES = [
+        ReplacementRule(Pattern(f(a, x_)), lambda x: x),
+        ReplacementRule(Pattern(f2(x_, x_)), lambda x: f(a, x)),
+        ReplacementRule(Pattern(f_u(f_u(x_))), lambda x: f2(x, x)),
+    ]
+
+    @pytest.mark.parametrize(
+        '   expression',
+        [
+            a,
+            f(a, b),
+            f2(f(a, b), b),
+            f(f_u(f(a, c)), f2(f(a, c), c), f_u(f_u(f(a, c)))),
+            f_c(f_u(f_u(a)), f2(f2(b, b), f(a, b)), f2(c, c)),
+        ]
+    )  # yapf: disable
+    @pytest.mark.parametrize('by_identity', [False, True])
+    @pytest.mark.parametrize('many_to_one', [False, True])
+    def test_same_result(self, expression, by_identity, many_to_one):
+        if many_to_one:
+            replacer = ManyToOneReplacer(*self.RULES)
+            replace_post_order = replacer.replace_post_order
+        else:
+            replace_post_order = lambda e, c=None: replace_all_post_order(e, self.RULES, c)
+        expected_result = replace_post_order(expression)
+        cache = NormalFormCache(by_identity=by_identity)
+        assert replace_post_order(expression, cache) == expected_result
+        assert replace_post_order(expression, cache) == expected_result
+
+    def test_shared_subexpressions(self):
+        calls = []
+
+        def replacement(x):
+            calls.append(x)
+            return f2(x)
+
+        expression = a
+        for _ in range(30):
+            expression = f(expression, expression)
+        rules = [ReplacementRule(Pattern(f(x_, x_)), replacement)]
+        cache = NormalFormCache(by_identity=True)
+
+        result = replace_all_post_order(expression, rules, cache)
+
+        expected_result = a
+        for _ in range(30):
+            expected_result = f2(expected_result)
+        assert result == expected_result
+        assert len(calls) == 30
+
+    def test_irreducible(self):
+        cache = NormalFormCache()
+        assert not cache.is_irreducible(f(a, b))
+        assert replace_all_post_order(f(f(a, b), c), self.RULES, cache) == f(b, c)
+        assert cache.get(f(a, b)) == b
+        assert not cache.is_irreducible(f(a, b))
+        assert cache.is_irreducible(b)
+        assert cache.is_irreducible(f(b, c))
+        assert cache.get(f(b, c)) == f(b, c)
+
+    def test_interning(self):
+        cache = NormalFormCache()
+        first = f(b, c)
+        replace_all_post_order(first, self.RULES, cache)
+        second = f(b, c)
+        assert replace_all_post_order(f(a, second), self.RULES, cache) is first
+
+    def test_max_size(self):
+        cache = NormalFormCache(max_size=2)
+        cache.add(f(a), f(b))
+        assert len(cache) == 2
+        cache.add(f(c), c)
+        assert len(cache) == 2
+        assert cache.get(f(a)) is None
+        assert cache.get(f(c)) == c
+        assert cache.get(c) == c
+        cache.get(f(c))
+        cache.add(f2(a), f2(a))
+        assert cache.get(f(c)) == c
+        assert cache.get(c) is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_invalid_max_size(self):
+        with pytest.raises(ValueError):
+            NormalFormCache(max_size=0)
+
+
+class TestReplacementRuleIndex:
+    @pytest.mark.parametrize('expression, pattern', PARAM_MATCHES.keys())
+    def test_candidates(self, expression, pattern):
+        pattern = Pattern(pattern)
+        index = ReplacementRuleIndex([ReplacementRule(pattern, lambda: None)])
+        is_candidate = bool(index.candidates(expression))
+        if any(True for _ in match_one_to_one(expression, pattern)):
+            assert is_candidate, "{!s} is no candidate for {!s} but matches".format(pattern, expression)
+
+    @pytest.mark.parametrize('expression, patterns', PARAM_PATTERNS.items())
+    def test_rule_order(self, expression, patterns):
+        patterns = sorted((Pattern(p) for p in patterns), key=str)
+        rules = [ReplacementRule(p, lambda i=i, **_: i) for i, p in enumerate(patterns)]
+        matching = (i for i, p in enumerate(patterns) if any(True for _ in match_one_to_one(expression, p)))
+        expected_index = next(matching, None)
+
+        rewrite = ReplacementRuleIndex(rules).find_rewrite(expression)
+
+        if expected_index is None:
+            assert rewrite is None
+        else:
+            replacement, substitution = rewrite
+            assert replacement(**substitution) == expected_index
+
+    def test_add(self):
+        index = ReplacementRuleIndex([ReplacementRule(Pattern(f(a, x_)), lambda x: x)])
+        assert index.find_rewrite(f(b, c)) is None
+        index.add(ReplacementRule(Pattern(f(x_, c)), lambda x: x))
+        replacement, substitution = index.find_rewrite(f(b, c))
+        assert replacement(**substitution) == b
+        assert len(index) == 2
+        assert [rule.pattern for rule in index] == [Pattern(f(a, x_)), Pattern(f(x_, c))]
+
+    def test_shapes(self):
+        rules = [
+            ReplacementRule(Pattern(a), lambda: None),
+            ReplacementRule(Pattern(f(x_, y_)), lambda x, y: None),
+            ReplacementRule(Pattern(f(x_, y__)), lambda x, y: None),
+            ReplacementRule(Pattern(f_a(x_, y_)), lambda x, y: None),
+            ReplacementRule(Pattern(f_c(x_, _, y___)), lambda x, y: None),
+            ReplacementRule(Pattern(x_), lambda x: None),
+        ]
+        index = ReplacementRuleIndex(rules)
+
+        def candidates(expression):
+            return [rules.index(rule) for rule in index.candidates(expression)]
+
+        assert candidates(a) == [0, 5]
+        assert candidates(b) == [5]
+        assert candidates(f(a)) == [5]
+        assert candidates(f(a, b)) == [1, 2, 5]
+        assert candidates(f(a, b, c)) == [2, 5]
+        assert candidates(f_a(a, b, c)) == [3, 5]
+        assert candidates(f_c(a)) == [5]
+        assert candidates(f_c(a, b, c)) == [4, 5]
+
+
+MINIMISE_PATTERNS = sorted({p for _, p in PARAM_MATCHES}, key=str)
+MINIMISE_RULES = [ReplacementRule(Pattern(p), lambda i=i, **_: i) for i, p in enumerate(MINIMISE_PATTERNS)]
+
+
+def test_minimise_rules_example():
+    rules = [
+        ReplacementRule(Pattern(f(a, x_)), lambda x: x),
+        ReplacementRule(Pattern(f(a, b)), lambda: b),
+        ReplacementRule(Pattern(f(x___)), lambda x: f2(*x)),
+        ReplacementRule(Pattern(f(x_, b)), lambda x: x),
+        ReplacementRule(Pattern(f2(x_)), lambda x: x),
+        ReplacementRule(Pattern(f2(a)), lambda: a),
+    ]
+    assert minimise_rules(rules) == [rules[0], rules[2], rules[4]]
+    assert minimise_rules([]) == []
+
+
+@pytest.mark.parametrize('expression', PARAM_PATTERNS.keys())
+def test_minimise_rules(expression):
+    minimised = minimise_rules(MINIMISE_RULES)
+    assert len(minimised) < len(MINIMISE_RULES)
+    expected = ReplacementRuleIndex(MINIMISE_RULES).find_rewrite(expression)
+    rewrite = ReplacementRuleIndex(minimised).find_rewrite(expression)
+    if expected is None:
+        assert rewrite is None
+    else:
+        assert rewrite[0](**rewrite[1]) == expected[0](**expected[1])
+
+
+class TestRewriteBudget:
+    REPLACERS = {
+        'replace_all': lambda e, rules, budget, **kw: replace_all_bounded(e, rules, budget),
+        'replace_all_post_order': lambda e, rules, budget, **kw: replace_all_post_order_bounded(e, rules, budget, **kw),
+        'many_to_one': lambda e, rules, budget, **kw: ManyToOneReplacer(*rules).replace_bounded(e, budget),
+        'many_to_one_post_order':
+            lambda e, rules, budget, **kw: ManyToOneReplacer(*rules).replace_post_order_bounded(e, budget, **kw),
+    }
+    UNBOUNDED_REPLACERS = {
+        'replace_all': replace_all,
+        'replace_all_post_order': replace_all_post_order,
+        'many_to_one': lambda e, rules: ManyToOneReplacer(*rules).replace(e),
+        'many_to_one_post_order': lambda e, rules: ManyToOneReplacer(*rules).replace_post_order(e),
+    }
+
+    @pytest.mark.parametrize('replacer', sorted(REPLACERS))
+    def test_normal_form(self, replacer):
+        rules = [ReplacementRule(Pattern(f(a, x_)), lambda x: x), ReplacementRule(Pattern(f2(x_)), lambda x: f(x, x))]
+        expression = f2(f(a, f(a, f2(b))), f(a, c))
+        result = self.REPLACERS[replacer](expression, rules, RewriteBudget(detect_cycles=True))
+        assert result.reason is StopReason.NORMAL_FORM
+        assert result.expression == self.UNBOUNDED_REPLACERS[replacer](expression, rules)
+        assert result.steps == 4
+
+    @pytest.mark.parametrize('replacer', sorted(REPLACERS))
+    def test_step_limit(self, replacer):
+        rules = [ReplacementRule(Pattern(f(x_)), lambda x: f(f(x)))]
+        result = self.REPLACERS[replacer](f2(f(a), b), rules, RewriteBudget(max_steps=5))
+        assert result.reason is StopReason.STEP_LIMIT
+        assert result.steps == 5
+        assert result.expression == f2(f(f(f(f(f(f(a)))))), b)
+
+    @pytest.mark.parametrize('replacer', sorted(REPLACERS))
+    def test_exact_step_limit(self, replacer):
+        rules = [ReplacementRule(Pattern(f(x_)), lambda x: x)]
+        result = self.REPLACERS[replacer](f2(f(a), f(b)), rules, RewriteBudget(max_steps=2))
+        assert result == (f2(a, b), 2, StopReason.NORMAL_FORM)
+
+    @pytest.mark.parametrize('replacer', sorted(REPLACERS))
+    def test_cycle(self, replacer):
+        rules = [ReplacementRule(Pattern(f(x_, y_)), lambda x, y: f(y, x))]
+        result = self.REPLACERS[replacer](f2(f(a, b), c), rules, RewriteBudget(detect_cycles=True))
+        assert result.reason is StopReason.CYCLE
+        assert result.steps == 2
+        assert result.expression == f2(f(a, b), c)
+
+    @pytest.mark.parametrize('replacer', sorted(REPLACERS))
+    def test_timeout(self, replacer):
+        rules = [ReplacementRule(Pattern(f(x_)), lambda x: f(f(x)))]
+        result = self.REPLACERS[replacer](f2(f(a), b), rules, RewriteBudget(timeout=0))
+        assert result == (f2(f(a), b), 0, StopReason.TIMEOUT)
+
+    @pytest.mark.parametrize('replacer', ['replace_all_post_order', 'many_to_one_post_order'])
+    def test_cache_is_not_filled_when_stopped(self, replacer):
+        rules = [ReplacementRule(Pattern(f(x_)), lambda x: f(f(x)))]
+        cache = NormalFormCache()
+        result = self.REPLACERS[replacer](f2(f(a), b), rules, RewriteBudget(max_steps=1), cache=cache)
+        assert result.steps == 1
+        assert cache.get(f(a)) is None
+        assert cache.get(f2(f(a), b)) is None
+        assert cache.is_irreducible(a)
+
+    @pytest.mark.parametrize('max_steps, timeout', [(-1, None), (1, -1)])
+    def test_invalid(self, max_steps, timeout):
+        with pytest.raises(ValueError):
+            RewriteBudget(max_steps, timeout)
+
+
+class TestRewriteTrace:
+    EXPRESSIONS = [
+        f(a, f2(b, c), f_u(a)),
+        f(f_i(b, f(a, a)), f_c(c, f2(a, b)), f_u(f_u(b))),
+        f2(f(a, b), f(b, b, c, c), f_a(f_u(a), f_a(c, d))),
+        f_c(d, f2(a, b), f_u(c)),
+    ]  # yapf: disable
+
+    @staticmethod
+    def _replay(expression, trace):
+        for rule, position, substitution in trace.steps:
+            if isinstance(expression, Expression):
+                assert list(match_one_to_one(expression[position], rule.pattern))
+            expression = replace(expression, position, rule.replacement(**substitution))
+        return expression
+
+    @pytest.mark.parametrize('expression', EXPRESSIONS)
+    @pytest.mark.parametrize('many_to_one', [False, True])
+    def test_replay(self, expression, many_to_one):
+        trace = RewriteTrace()
+        if many_to_one:
+            result = ManyToOneReplacer(*INCREMENTAL_RULES).replace(expression, 20, trace=trace)
+        else:
+            result = replace_all(expression, INCREMENTAL_RULES, 20, trace=trace)
+        assert len(trace) == len(trace.steps) > 0
+        assert self._replay(expression, trace) == result
+        for rule, count in trace.rule_counts():
+            assert count == sum(1 for step in trace.steps if step.rule is rule)
+        assert all(any(rule is r for r in INCREMENTAL_RULES) for rule, _ in trace.rule_counts())
+
+    @pytest.mark.parametrize('many_to_one', [False, True])
+    def test_counts_only(self, many_to_one):
+        rules = [ReplacementRule(Pattern(f(a, x_)), lambda x: x), ReplacementRule(Pattern(f2(x_)), lambda x: f(a, x))]
+        trace = RewriteTrace(record_steps=False)
+        expression = f2(f(a, f2(f(a, b))))
+        if many_to_one:
+            assert ManyToOneReplacer(*rules).replace(expression, trace=trace) == b
+        else:
+            assert replace_all(expression, rules, trace=trace) == b
+        assert trace.steps == []
+        assert len(trace) == 6
+        assert [(rule is rules[0], count) for rule, count in trace.rule_counts()] == [(False, 2), (True, 4)]
+
+        trace.clear()
+        assert len(trace) == 0
+        assert trace.rule_counts() == []
+
+    def test_bounded(self):
+        rules = [ReplacementRule(Pattern(f(x_)), lambda x: f(f(x)))]
+        trace = RewriteTrace()
+        result = replace_all_bounded(f2(f(a), b), rules, RewriteBudget(max_steps=3), trace=trace)
+        assert result.steps == len(trace) == 3
+        assert [step.position for step in trace.steps] == [(0, ), (0, ), (0, )]
+        assert self._replay(f2(f(a), b), trace) == result.expression
@@ -6,8 +6,11 @@ from multiset import Multiset
 
 from matchpy.expressions.constraints import CustomConstraint
 from matchpy.expressions.expressions import Symbol, Wildcard, Pattern
-from matchpy.expressions.functions import get_variables
+from matchpy.expressions.functions import get_variables, preorder_iter_with_position
 from matchpy.matching.many_to_one import ManyToOneMatcher
+from matchpy.matching.one_to_one import (
+    match as match_one_to_one, count_matches, matching_labels, match_anywhere, SubjectIndex
+)
 from matchpy.functions import substitute
 from .utils import MockConstraint, assert_match_as_expected
 from .common import *
@@ -875,4 +878,74 @@ for name, obj in TestMatch.__dict__.items():
                 if get_variables(pattern) and is_match:
                     continue
                 PARAM_PATTERNS.setdefault(expression, set()).add(pattern)
-                PARAM_MATCHES[expression, pattern] = [{}] if is_match else []
\ No newline at end of file
+                PARAM_MATCHES[expression, pattern] = [{}] if is_match else []
+
+
+@pytest.mark.parametrize('expression, pattern', PARAM_MATCHES.keys())
+def test_count_matches(expression, pattern):
+    pattern = Pattern(pattern)
+    expected_count = sum(1 for _ in match_one_to_one(expression, pattern))
+    assert count_matches(expression, pattern) == expected_count
+
+
+@pytest.mark.parametrize('expression, patterns', PARAM_PATTERNS.items())
+def test_matching_labels(expression, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    expected_labels = [p for p in patterns if any(True for _ in match_one_to_one(expression, p))]
+    assert list(matching_labels(expression, patterns)) == expected_labels
+
+
+@pytest.mark.parametrize('expression, patterns', PARAM_PATTERNS.items())
+def test_match_anywhere(expression, patterns):
+    subject = f2(expression, f(a, expression))
+    index = SubjectIndex(subject)
+    for pattern in patterns:
+        pattern = Pattern(pattern)
+        expected_matches = [
+            (substitution, position)
+            for subexpression, position in preorder_iter_with_position(subject)
+            for substitution in match_one_to_one(subexpression, pattern)
+        ]
+        assert list(match_anywhere(index, pattern)) == expected_matches
+        assert list(match_anywhere(subject, pattern)) == expected_matches
+
+
+class TestSubjectIndex:
+    SUBJECT = f(a, f2(b, s), f_i(f(s, a), c), f_c(a, f_i(b, b)))
+
+    @pytest.mark.parametrize(
+        '   pattern,        expected_positions',
+        [
+            (a,             [(0, ), (2, 0, 1), (3, 0)]),
+            (b,             [(1, 0), (3, 1, 0), (3, 1, 1)]),
+            (s,             [(1, 1), (2, 0, 0)]),
+            (d,             []),
+            (x_,            'all'),
+            (_s,            [(0, ), (1, 0), (1, 1), (2, 0, 0), (2, 0, 1), (2, 1), (3, 0), (3, 1, 0), (3, 1, 1)]),
+            (_ss,           [(1, 1), (2, 0, 0)]),
+            (f(x___),       [(), (2, 0)]),
+            (f2(x_, y_),    [(1, )]),
+            (f_i(b, x___),  'all'),
+            (f_c(x___),     [(3, )]),
+            (f_a(x___),     []),
+        ]
+    )  # yapf: disable
+    def test_candidates(self, pattern, expected_positions):
+        index = SubjectIndex(self.SUBJECT)
+        if expected_positions == 'all':
+            expected_positions = [p for _, p in preorder_iter_with_position(self.SUBJECT)]
+        assert [p for _, p in index.candidates(Pattern(pattern))] == expected_positions
+        assert [p for _, p in index.candidates(Pattern(pattern))] == expected_positions
+        for subexpression, position in index.candidates(Pattern(pattern)):
+            assert subexpression is self.SUBJECT[position]
+
+    def test_multiple_patterns(self):
+        index = SubjectIndex(self.SUBJECT)
+        positions = [p for _, p in index.candidates(Pattern(f_c(x___)), Pattern(b), Pattern(f(x___)))]
+        assert positions == [(), (1, 0), (2, 0), (3, ), (3, 1, 0), (3, 1, 1)]
+        assert list(index.candidates()) == []
+        assert len(index) == len(list(preorder_iter_with_position(self.SUBJECT)))
+
+    def test_not_constant(self):
+        with pytest.raises(ValueError):
+            SubjectIndex(f(x_))
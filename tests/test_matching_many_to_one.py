@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
+import math
+
 import pytest
+from multiset import Multiset
 
 from matchpy.expressions.constraints import CustomConstraint
 from matchpy.expressions.expressions import Symbol, Pattern, Operation, Arity, Wildcard
+from matchpy.expressions.functions import preorder_iter_with_position
 from matchpy.matching.many_to_one import ManyToOneMatcher
+from matchpy.matching.one_to_one import SubjectIndex, match
 from .common import *
 from .utils import MockConstraint
 
@@ -259,4 +264,194 @@ def test_many_to_one(subject, patterns):
 
     assert matches == [], "Subject {!s} and pattern {!s} yielded unexpected matches".format(
         subject, pattern
-    )
\ No newline at end of file
+    )
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_count_matches(subject, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    matcher = ManyToOneMatcher(*patterns)
+    expected_counts = [0] * len(patterns)
+    for label, _ in matcher.match(subject):
+        expected_counts[patterns.index(label)] += 1
+
+    counts = [0] * len(patterns)
+    for label, count in matcher.count_matches(subject):
+        assert count > 0
+        counts[patterns.index(label)] += count
+
+    assert counts == expected_counts
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_matching_labels(subject, patterns):
+    patterns = [Pattern(p) for p in patterns]
+    matcher = ManyToOneMatcher(*patterns)
+    expected_labels = set(patterns.index(label) for label, _ in matcher.match(subject))
+
+    labels = [patterns.index(label) for label in matcher.matching_labels(subject)]
+
+    assert len(labels) == len(set(labels)), "Labels were yielded more than once"
+    assert set(labels) == expected_labels
+
+
+@pytest.mark.parametrize(
+    '   pattern,                                subject,                            count',
+    [
+        (f_c(x___, y___),                       f_c(a, a, b, c),                    12),
+        (f_c(x__, y__, b),                      f_c(a, a, b, c, c),                 7),
+        (f(f_c(x___, y___), z___),              f(f_c(a, b), c),                    4),
+        (f(f_c(x___, y___), x___),              f(f_c(a, b), a, b),                 1),
+        (f_ac(x___, y___, a),                   f_ac(a, b, b),                      3),
+        (f_c(x_, y___, z___),                   f_c(a, b, c),                       12),
+    ]
+)  # yapf: disable
+def test_count_matches_commutative(pattern, subject, count):
+    matcher = ManyToOneMatcher(Pattern(pattern))
+    assert list(matcher.count_matches(subject)) == [(Pattern(pattern), count)]
+    assert sum(1 for _ in matcher.match(subject)) == count
+
+
+def test_count_matches_constraints():
+    constraint = CustomConstraint(lambda x: len(x) == 1)
+    pattern1 = Pattern(f_c(x___, y___), constraint)
+    pattern2 = Pattern(f_c(x___, y___), MockConstraint(True))
+    matcher = ManyToOneMatcher(pattern1, pattern2)
+
+    counts = list(matcher.count_matches(f_c(a, b, c)))
+
+    assert counts == [(pattern1, 3), (pattern2, 8)]
+
+
+def test_commutative_repeated_subjects():
+    matcher = ManyToOneMatcher(Pattern(f_c(x_, x_, y___)))
+
+    substitutions = [substitution for _, substitution in matcher.match(f_c(a, a, a, a, b, b))]
+
+    assert sorted(substitutions, key=lambda s: str(s['x'])) == [
+        {'x': a, 'y': Multiset({a: 2, b: 2})},
+        {'x': b, 'y': Multiset({a: 4})},
+    ]
+
+
+def test_commutative_anonymous_patterns_with_shared_subject():
+    pattern = Pattern(f_c(f2(a, _), f2(_, b)))
+    matcher = ManyToOneMatcher(pattern)
+
+    assert list(matcher.match(f_c(f2(a, b), f2(a, c)))) == [(pattern, {})]
+    assert list(matcher.match(f_c(f2(a, c), f2(c, b)))) == [(pattern, {})]
+    assert list(matcher.match(f_c(f2(a, b), f2(a, b), f2(a, c)))) == []
+
+
+def test_commutative_anonymous_patterns_with_repeated_subjects():
+    pattern = Pattern(f_c(f2(a, _), f2(a, _), f2(_, b), x_, y___))
+    matcher = ManyToOneMatcher(pattern)
+    subject = f_c(*([f2(a, b)] * 3 + [f2(a, c)] * 2 + [f2(c, b)] * 2))
+
+    substitutions = [substitution for _, substitution in matcher.match(subject)]
+    expected = []
+    for substitution in match(subject, pattern):
+        if substitution not in expected:
+            expected.append(substitution)
+
+    assert len(substitutions) == len(expected)
+    assert all(substitution in expected for substitution in substitutions)
+
+
+@pytest.mark.parametrize(
+    'pattern, subject', [
+        (f_c(f2_c(x_, y_), f2_c(x_, z_)), f_c(f2_c(a, b), f2_c(a, c))),
+        (f_c(f2_c(x_, y_), f2_c(x_, z_)), f_c(f2_c(a, b), f2_c(c, b))),
+        (f_c(f2_c(x_, y_), f2_c(x_, z_)), f_c(f2_c(a, b), f2_c(c, d))),
+        (f_c(f2_c(x_, y___), f2_c(x_, z___), ___), f_c(f2_c(a, b, c), f2_c(b, c, d), f2_c(a, c))),
+        (f_c(f2_c(x_, y___), f2_c(x_, y___), f2_c(x_, _), z___), f_c(*([f2_c(a, b)] * 2 + [f2_c(b, c)] * 3))),
+    ]
+)  # yapf: disable
+def test_commutative_patterns_with_shared_variables(pattern, subject):
+    pattern = Pattern(pattern)
+    matcher = ManyToOneMatcher(pattern)
+
+    substitutions = [substitution for _, substitution in matcher.match(subject)]
+    expected = []
+    for substitution in match(subject, pattern):
+        if substitution not in expected:
+            expected.append(substitution)
+
+    assert len(substitutions) == len(expected)
+    assert all(substitution in expected for substitution in substitutions)
+
+
+@pytest.mark.parametrize('subject, patterns', PARAM_PATTERNS.items())
+def test_match_anywhere(subject, patterns):
+    subject = f2(subject, f(a, subject))
+    matcher = ManyToOneMatcher(*(Pattern(p) for p in patterns))
+    subexpressions = sorted(preorder_iter_with_position(subject), key=lambda p: p[1] + (math.inf, ))
+    expected_matches = [
+        (position, label, substitution)
+        for subexpression, position in subexpressions
+        for label, substitution in matcher.match(subexpression)
+    ]
+
+    assert list(matcher.match_anywhere(subject)) == expected_matches
+    assert list(matcher.match_anywhere(SubjectIndex(subject))) == expected_matches
+
+
+def test_match_anywhere_shared_subexpressions():
+    subject = f2(a, b)
+    for _ in range(10):
+        subject = f(subject, subject)
+    matcher = ManyToOneMatcher(Pattern(f2(x_, b)), Pattern(f(f(x_, y_), z_)))
+
+    matches = list(matcher.match_anywhere(subject))
+
+    assert len(matches) == 2 ** 10 + 2 ** 9 - 1
+    assert matches[0] == ((0, ) * 10, Pattern(f2(x_, b)), {'x': a})
+    substitutions = [substitution for _, label, substitution in matches if label == Pattern(f2(x_, b))]
+    assert all(s is not t for s, t in zip(substitutions, substitutions[1:])), "Substitutions must not be shared"
+
+
+def test_match_anywhere_empty_matcher():
+    assert list(ManyToOneMatcher().match_anywhere(f(a))) == []
+
+
+def test_deeply_nested_subject():
+    pattern, subject = f2(x___, a, y___), f2(a, b, a)
+    for _ in range(300):
+        pattern, subject = f(pattern), f(subject)
+    matcher = ManyToOneMatcher(Pattern(pattern))
+
+    substitutions = [substitution for _, substitution in matcher.match(subject)]
+
+    assert substitutions == [{'x': (), 'y': (b, a)}, {'x': (a, b), 'y': ()}]
+
+
+def test_freeze():
+    pattern1 = Pattern(f(a, x_))
+    pattern2 = Pattern(f(y_, b))
+    matcher = ManyToOneMatcher(pattern1)
+    matcher.freeze()
+    frozen = matcher._frozen
+    matcher.freeze()
+
+    assert matcher._frozen is frozen
+    assert list(matcher.match(f(a, b))) == [(pattern1, {'x': b})]
+
+    matcher.add(pattern2)
+
+    assert matcher._frozen is None
+    assert sorted(map(str, matcher.match(f(a, b)))) == sorted(map(str, [(pattern1, {'x': b}), (pattern2, {'y': a})]))
+    assert matcher._frozen is not None
+
+
+def test_freeze_shares_labels():
+    matcher = ManyToOneMatcher(Pattern(f(x_, a)), Pattern(f(a, y_)), Pattern(f2(x_)))
+    matcher.freeze()
+
+    wildcard_labels = [
+        transition.label
+        for table in matcher._frozen.transitions for transitions in table.values() for transition in transitions
+        if isinstance(transition.label, Wildcard)
+    ]
+
+    assert len(wildcard_labels) == 3
+    assert all(label is wildcard_labels[0] for label in wildcard_labels)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from matchpy.expressions.expressions import Operation, Pattern
+from matchpy.expressions.functions import op_iter
+from matchpy.functions import ReplacementRule, replace
+from matchpy.matching.many_to_one import ManyToOneReplacer
+from matchpy.strategies import Chain, Fixpoint, Innermost, OnceBottomUp, OnceTopDown, Outermost, Rewrite
+from .common import *
+
+RULES = [
+    ReplacementRule(Pattern(f(a, x___)), lambda x: f(*x, b)),
+    ReplacementRule(Pattern(f2(x_, y_)), lambda x, y: [y, x, c]),
+    ReplacementRule(Pattern(f_u(x_)), lambda x: f_a(x, f_a(x, d))),
+    ReplacementRule(Pattern(f_i(b, x___)), lambda x: f_i(*x)),
+    ReplacementRule(Pattern(f_c(c, x___)), lambda x: f_c(a, *x)),
+    ReplacementRule(Pattern(f_a(x_, d)), lambda x: f2(x, x)),
+    ReplacementRule(Pattern(f(b, b, x___)), lambda x: [f2(a)] * len(x)),
+]
+
+EXPRESSIONS = [
+    a,
+    f(a, f2(b, c), f_u(a)),
+    f(f_i(b, f(a, a)), f_c(c, f2(a, b)), f_u(f(b))),
+    f2(f(a, b), f(b, b, c, c), f_a(f_u(a), f_a(c, d))),
+    f_i(b, f_i(b, f2(c, f_u(a)))),
+    f_c(c, c, f(a, f2(a, b), a)),
+    f(f_i(f(b, b), c), f_a(f_u(a), c)),
+]  # yapf: disable
+
+
+class CountingRewrite(Rewrite):
+    def __init__(self, rules):
+        super().__init__(rules)
+        self.count = 0
+
+    def apply(self, expression):
+        self.count += 1
+        return super().apply(expression)
+
+
+def _postorder_iter_with_position(expression, position=()):
+    if isinstance(expression, Operation):
+        for index, operand in enumerate(op_iter(expression)):
+            yield from _postorder_iter_with_position(operand, position + (index, ))
+    yield expression, position
+
+
+def _rewrite_once_bottom_up(expression, replacer):
+    for subexpression, position in _postorder_iter_with_position(expression):
+        rewrite = replacer._find_rule(subexpression)
+        if rewrite is not None:
+            rule, subst = rewrite
+            return replace(expression, position, rule.replacement(**subst))
+    return expression
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_once_top_down(expression):
+    replacer = ManyToOneReplacer(*RULES)
+    assert OnceTopDown(replacer)(expression) == replacer.replace(expression, 1)
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_once_bottom_up(expression):
+    replacer = ManyToOneReplacer(*RULES)
+    assert OnceBottomUp(replacer)(expression) == _rewrite_once_bottom_up(expression, replacer)
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_innermost(expression):
+    replacer = ManyToOneReplacer(*RULES)
+    assert Innermost(replacer)(expression) == Fixpoint(OnceBottomUp(replacer), 100)(expression)
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_outermost(expression):
+    replacer = ManyToOneReplacer(*RULES)
+    assert Outermost(replacer)(expression) == replacer.replace(expression)
+    assert Outermost(replacer)(expression) == Fixpoint(OnceTopDown(replacer), 100)(expression)
+    assert Outermost(replacer, 2)(expression) == replacer.replace(expression, 2)
+
+
+def test_not_applicable():
+    strategies = [
+        Rewrite(RULES), OnceTopDown(RULES), OnceBottomUp(RULES), Innermost(RULES), Outermost(RULES), Fixpoint(RULES),
+        Chain(RULES, Innermost(RULES))
+    ]
+    expression = f(c, f2(a), d)
+    for strategy in strategies:
+        assert strategy.apply(expression) is None
+        assert strategy(expression) is expression
+
+
+def test_innermost_shared_subexpressions():
+    expression = a
+    for _ in range(30):
+        expression = f2(expression, expression, expression)
+    rewrite = CountingRewrite([ReplacementRule(Pattern(f2(a, x_)), lambda x: x)])
+
+    assert Innermost(rewrite)(expression) is expression
+    assert rewrite.count == 31
+
+
+def test_innermost_reuses_normal_forms():
+    rewrite = CountingRewrite([
+        ReplacementRule(Pattern(f_u(x_)), lambda x: f(x, x)),
+        ReplacementRule(Pattern(f2(x_)), lambda x: x),
+    ])
+    subexpression = f(a, b, c, d)
+
+    assert Innermost(rewrite)(f2(f_u(f2(subexpression)))) == f(subexpression, subexpression)
+    # f(a, b, c, d) and its operands are only visited once
+    assert rewrite.count == 9
+
+
+def test_fixpoint():
+    rules = [ReplacementRule(Pattern(f(x_)), lambda x: f2(x)), ReplacementRule(Pattern(f2(x_)), lambda x: f(x))]
+    assert Fixpoint(rules, 3)(f(a)) == f2(a)
+    assert Fixpoint(rules, 4)(f(a)) == f(a)
+    assert Fixpoint([ReplacementRule(Pattern(f(x_)), lambda x: x)])(f(f(f(a)))) == a
+
+
+def test_chain():
+    strategy = Chain(
+        Innermost([ReplacementRule(Pattern(f(a, x_)), lambda x: x)]),
+        Rewrite([ReplacementRule(Pattern(f(a)), lambda: b)]),
+        OnceTopDown([ReplacementRule(Pattern(x_), lambda x: f(x))]),
+    )
+    assert strategy(f(a, f(a, c))) == f(c)
+    assert strategy(f(b)) == f(f(b))
+
+
+def test_sequence_replacement():
+    rules = [ReplacementRule(Pattern(f2(x_, y_)), lambda x, y: [y, x])]
+    assert OnceTopDown(rules)(f(f2(a, b), c)) == f(b, a, c)
+    assert OnceBottomUp(rules)(f(f2(a, b), c)) == f(b, a, c)
+    assert Innermost(rules)(f(f2(a, f2(b, c)), d)) == f(f2(a, c, b), d)
+    assert Innermost(rules)(f(f2(f2(b, c), a), d)) == f(f2(c, b, a), d)
+    assert Innermost(rules)(f2(a, b)) == [b, a]
+
+
+def test_invalid_innermost_strategy():
+    with pytest.raises(TypeError):
+        Innermost(OnceTopDown(RULES))
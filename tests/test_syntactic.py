@@ -8,6 +8,7 @@ import pytest
 from matchpy.expressions.expressions import Atom, Operation, Symbol, Wildcard, Pattern
 from matchpy.matching.one_to_one import match
 from matchpy.matching.syntactic import OPERATION_END as OP_END
+from matchpy.matching import syntactic
 from matchpy.matching.syntactic import DiscriminationNet, FlatTerm, SequenceMatcher, is_operation, is_symbol_wildcard
 from .common import *
 
@@ -109,6 +110,88 @@ def test_flatterm_is_syntactic(flatterm, is_syntactic):
     assert flatterm.is_syntactic == is_syntactic
 
 
+@pytest.mark.parametrize(
+    '   expr,                   skips',
+    [
+        (a,                     [1]),
+        (f(),                   [2, 2]),
+        (f(a, b),               [4, 2, 3, 4]),
+        (f(f2(a), b),           [6, 4, 3, 4, 5, 6]),
+        (f(a, f2(b), c),        [7, 2, 5, 4, 5, 6, 7]),
+    ]
+)  # yapf: disable
+def test_flatterm_skips(expr, skips):
+    assert list(FlatTerm(expr).skips) == skips
+
+
+def test_flatterm_codes():
+    net = DiscriminationNet(Pattern(f(a, f2(b), a)))
+    assert net.is_match(f(a, f2(b), a))
+
+    codes = list(FlatTerm(f(a, f2(b), a)).codes)
+    assert all(code >= 0 for code in codes)
+    assert len(codes) == 7
+    assert codes[1] == codes[5]
+    assert codes[4] == codes[6]
+    assert len(set(codes)) == 5
+    assert list(FlatTerm(f(a, f2(b), a)).codes) == codes
+    assert FlatTerm(f(b)).codes[1] == codes[3]
+    assert FlatTerm(f(Symbol('not_a_label'))).codes[1] == -1
+
+
+def test_match_subject_encoded_before_label_exists():
+    subject = f(Symbol('later_label'))
+    assert FlatTerm.of(subject).codes[1] == -1
+
+    net = DiscriminationNet(Pattern(f(Symbol('later_label'))))
+
+    assert net.is_match(subject)
+    assert not net.is_match(f(Symbol('other_symbol')))
+
+
+def test_atom_codes_do_not_grow_with_subjects():
+    net = DiscriminationNet(Pattern(f(a, x_)))
+    assert net.is_match(f(a, b))
+    size = len(syntactic._label_codes)
+
+    for i in range(100):
+        assert net.is_match(f(a, Symbol('subject{}'.format(i))))
+
+    assert len(syntactic._label_codes) == size
+
+
+@pytest.mark.parametrize(
+    '   exprs,                  result',
+    [
+        ([],                    []),
+        ([a],                   [a]),
+        ([a, f(b)],             [a, f, b, OP_END]),
+        ([_, a, _],             [_, a, _]),
+        ([_, _],                [Wildcard(2, True)]),
+        ([f(_), __, ___],       [f, _, OP_END, Wildcard(1, False)]),
+    ]
+)  # yapf: disable
+def test_flatterm_merged(exprs, result):
+    flatterms = [FlatTerm(expr) for expr in exprs]
+    merged = FlatTerm.merged(*flatterms)
+    assert list(merged) == result
+    assert list(merged.codes) == list(FlatTerm(result).codes)
+
+    for flatterm in flatterms:
+        flatterm.codes
+    merged = FlatTerm.merged(*flatterms)
+    assert list(merged) == result
+    assert list(merged.codes) == list(FlatTerm(result).codes)
+
+
+def test_flatterm_of():
+    expr = f(a, f2(b))
+    flatterm = FlatTerm.of(expr)
+    assert flatterm == FlatTerm(expr)
+    assert FlatTerm.of(expr) is flatterm
+    assert FlatTerm.of(f(a, f2(b))) is not flatterm
+
+
 def test_is_operation():
     assert is_operation(str) is False
     assert is_operation(1) is False
@@ -248,6 +331,17 @@ def test_variable_expression_match_error():
         list(net.match(pattern))
 
 
+def test_matching_labels():
+    net = DiscriminationNet()
+    patterns = [Pattern(f(x_, x_)), Pattern(f(a, _)), Pattern(f(_, b))]
+    for pattern in patterns:
+        net.add(pattern, pattern)
+
+    assert list(net.matching_labels(f(a, a))) == [patterns[0], patterns[1]]
+    assert list(net.matching_labels(f(a, b))) == [patterns[1], patterns[2]]
+    assert list(net.count_matches(f(b, b))) == [(patterns[0], 1), (patterns[2], 1)]
+
+
 @given(st.sets(expression_strategy, max_size=20))
 @example({f(a), f(_s)})
 def test_randomized_product_net(patterns):
@@ -345,6 +439,56 @@ def test_sequence_matcher_match():
     assert list(matcher.match(a)) == []
 
 
+def test_sequence_matcher_match_operands_with_operations():
+    pattern = Pattern(f(___, f2(x_, a), b, ___))
+    matcher = SequenceMatcher(pattern)
+    subject = f(f2(b, a), b, f2(f2(a), a), b, f2(b, b), b)
+
+    substitutions = sorted(str(substitution) for _, substitution in matcher.match(subject))
+
+    assert substitutions == sorted(str(substitution) for substitution in match(subject, pattern))
+    assert len(substitutions) == 2
+
+
+def test_sequence_matcher_match_equal_operands():
+    pattern = Pattern(f(___, f2(x_), f2(x_), ___))
+    matcher = SequenceMatcher(pattern)
+    subject = f(f2(a), f2(a), f2(a), f2(b), f2(b))
+
+    substitutions = sorted(str(substitution) for _, substitution in matcher.match(subject))
+
+    assert substitutions == sorted(str(substitution) for substitution in match(subject, pattern))
+    assert len(substitutions) == 3
+
+
+def test_sequence_matcher_match_after_longer_pattern_fails():
+    patterns = [Pattern(f(___, a, ___)), Pattern(f(___, a, f2(b, _), ___))]
+    matcher = SequenceMatcher(*patterns)
+
+    assert list(matcher.match(f(a, f2(b)))) == [(patterns[0], {})]
+
+
+SEQUENCE_PATTERNS = [
+    Pattern(f(x___, a, y___)),
+    Pattern(f(x___, f2(z_), a, y___)),
+    Pattern(f(x___, f2(b, _), z_, y___)),
+    Pattern(f(x___, z_, f2(z_), y___)),
+]
+
+
+@given(st.lists(st.sampled_from([a, b, f2(a), f2(b), f2(b, a), f2(f2(a))]), max_size=8))
+def test_sequence_matcher_randomized(operands):
+    matcher = SequenceMatcher(*SEQUENCE_PATTERNS)
+    subject = f(*operands)
+
+    matches = sorted((str(pattern), str(substitution)) for pattern, substitution in matcher.match(subject))
+    expected = sorted(
+        (str(pattern), str(substitution)) for pattern in SEQUENCE_PATTERNS for substitution in match(subject, pattern)
+    )
+
+    assert matches == expected
+
+
 @pytest.mark.parametrize(
     '   patterns,                   expected_error',
     [
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from matchpy.expressions.constraints import CustomConstraint
+from matchpy.expressions.expressions import Pattern
+from matchpy.expressions.functions import is_constant
+from matchpy.matching.one_to_one import match
+from matchpy.matching.term_index import TermIndex, GeneralisationIndex
+from .test_matching import PARAM_MATCHES, PARAM_PATTERNS
+from .common import *
+
+TERMS = [e for e in PARAM_PATTERNS if is_constant(e)]
+PATTERNS = sorted({p for _, p in PARAM_MATCHES}, key=str)
+
+
+@pytest.fixture(scope='module')
+def index():
+    return TermIndex(*TERMS)
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_instances(index, pattern):
+    pattern = Pattern(pattern)
+    expected = {}
+    for term in TERMS:
+        substitutions = list(match(term, pattern))
+        if substitutions:
+            expected[term] = substitutions
+    instances = {}
+    for term, substitution in index.instances(pattern):
+        instances.setdefault(term, []).append(substitution)
+    assert instances == expected
+
+
+@pytest.mark.parametrize(
+    '   pattern,            expected_candidates',
+    [
+        (a,                 [a]),
+        (x_,                'all'),
+        (_s,                [a, b, s]),
+        (f(x_),             [f(a), f(b)]),
+        (f(a, x___),        [f(a), f(a, b), f(a, f(a))]),
+        (f(x__, b),         [f(a, b), f(b, b)]),
+        (f(_, f(x_)),       [f(a, f(a))]),
+        (f(x___, f(x_)),    [f(a, f(a))]),
+        (f2(x_),            []),
+        (f_c(a, x_),        [f_c(a, b), f_c(b, c)]),
+        (f_i(a, x_),        'all'),
+    ]
+)  # yapf: disable
+def test_candidates(pattern, expected_candidates):
+    terms = [a, b, s, f(a), f(b), f(a, b), f(b, b), f(a, f(a)), f_c(a, b), f_c(b, c)]
+    index = TermIndex(*terms)
+    if expected_candidates == 'all':
+        expected_candidates = terms
+    assert sorted(index.candidates(Pattern(pattern))) == sorted(expected_candidates)
+
+
+def test_add_remove():
+    terms = [a, f(a), f(a, b), f(a, f(b)), f_c(a, b), b]
+    index = TermIndex()
+    for term in terms:
+        assert index.add(term)
+        assert not index.add(term)
+    assert len(index) == len(terms)
+    assert sorted(index) == sorted(terms)
+
+    index.remove(f(a, b))
+    assert f(a, b) not in index
+    assert f(a) in index
+    assert sorted(index) == sorted(t for t in terms if t != f(a, b))
+    assert [t for t, _ in index.instances(Pattern(f(a, x_)))] == [f(a, f(b))]
+
+    index.remove(b)
+    assert b not in index
+    assert a in index
+    with pytest.raises(KeyError):
+        index.remove(b)
+
+    for term in [a, f(a), f(a, f(b)), f_c(a, b)]:
+        index.remove(term)
+    assert len(index) == 0
+    assert list(index) == []
+    assert index._root.is_empty()
+
+    with pytest.raises(KeyError):
+        index.remove(f(a))
+    with pytest.raises(KeyError):
+        index.remove(f(x_))
+
+
+def test_not_constant():
+    with pytest.raises(ValueError):
+        TermIndex(f(x_))
+    assert f(x_) not in TermIndex(f(a))
+
+
+@pytest.mark.parametrize(
+    '   general,                specific,               expected',
+    [
+        (a,                     a,                      True),
+        (a,                     b,                      False),
+        (x_,                    a,                      True),
+        (x_,                    f(y_),                  True),
+        (_s,                    a,                      True),
+        (_s,                    x_,                     False),
+        (_s,                    _ss,                    True),
+        (_ss,                   _s,                     False),
+        (f(x_),                 f(a),                   True),
+        (f(x_),                 f(y_),                  True),
+        (f(x_),                 f(y___),                False),
+        (f(x_, x_),             f(y_, z_),              False),
+        (f(x_, x_),             f(y_, y_),              True),
+        (f(x___),               f(a, y__, b),           True),
+        (f(x__),                f(y___),                False),
+        (f(x__),                f(y__),                 True),
+        (f(x__, a),             f(y__, z___, a),        True),
+        (f(x_, y___),           f(z__),                 True),
+        (f(x_, y_),             f(z__),                 False),
+        (f(a, x___),            f(a, b, y___),          True),
+        (f(a, x___),            f(y___, a),             False),
+        (f2(x___),              f(y___),                False),
+        (f_c(a, x___),          f_c(y_, a, b),          True),
+        (f_c(a, x___),          f_c(y_, b),             False),
+        (f_c(x__, a),           f_c(y___, a),           False),
+        (f_a(x_, a),            f_a(b, y___, a),        False),
+        (f_a(x_, a),            f_a(b, y__, a),         True),
+        (f(oa_),                f(o2b_),                True),
+        (f(x_),                 f(oa_),                 False),
+        (f(x___),               f(oa_),                 True),
+    ]
+)  # yapf: disable
+def test_generalisations(general, specific, expected):
+    index = GeneralisationIndex(Pattern(general))
+    assert bool(list(index.generalisations(Pattern(specific)))) == expected
+
+
+def test_generalisations_with_constraints():
+    constraint = CustomConstraint(lambda x: x == a)
+    index = GeneralisationIndex(Pattern(f(x_), constraint))
+    assert list(index.generalisations(Pattern(f(x_), constraint))) == [Pattern(f(x_), constraint)]
+    assert list(index.generalisations(Pattern(f(x_)))) == []
+    assert list(index.generalisations(Pattern(f(a)))) == []
+
+
+def test_generalisations_order():
+    patterns = [Pattern(f(x_, b)), Pattern(f(x___)), Pattern(f(a, b)), Pattern(x_), Pattern(f(a, x_))]
+    index = GeneralisationIndex()
+    for i, pattern in enumerate(patterns):
+        index.add(pattern, i)
+    assert len(index) == len(patterns)
+    assert list(index.generalisations(Pattern(f(a, b)))) == [0, 1, 2, 3, 4]
+    assert list(index.generalisations(Pattern(f(a, y_)))) == [1, 3, 4]
+    assert list(index.generalisations(Pattern(f2(a, b)))) == [3]
+
+
+@pytest.mark.parametrize('specific', PATTERNS)
+def test_generalisations_are_sound(specific):
+    index = GeneralisationIndex()
+    for pattern in PATTERNS:
+        index.add(Pattern(pattern), pattern)
+    specific = Pattern(specific)
+    generalisations = list(index.generalisations(specific))
+    assert specific.expression in generalisations
+    instances = [t for t in TERMS if any(True for _ in match(t, specific))]
+    for general in generalisations:
+        for term in instances:
+            assert any(True for _ in match(term, Pattern(general)))
@@ -9,8 +9,8 @@ from multiset import Multiset
 
 from matchpy.utils import (
     VariableWithCount, base_solution_linear, cached_property, commutative_sequence_variable_partition_iter,
-    extended_euclid, fixed_integer_vector_iter, get_short_lambda_source, weak_composition_iter, slot_cached_property,
-    solve_linear_diop
+    commutative_sequence_variable_partition_count, extended_euclid, fixed_integer_vector_iter, get_short_lambda_source,
+    weak_composition_iter, slot_cached_property, solve_linear_diop
 )
 
 
@@ -340,3 +340,31 @@ def test_slot_cached_property():
     assert b.example == 42
     assert A.call_count == 2
     assert A.example.__doc__ == "Docstring Test"
+
+
+class TestCommutativeSequenceVariablePartitionCount:
+    @given(sequence_vars(), st.lists(st.integers(1, 4), max_size=10))
+    def test_randomized(self, variables, values):
+        values = Multiset(values)
+        expected_count = sum(1 for _ in commutative_sequence_variable_partition_iter(values, variables))
+        assert commutative_sequence_variable_partition_count(values, variables) == expected_count
+
+    @pytest.mark.parametrize(
+        '   variables,                      values',
+        #   Variables have the form (count, minimum length, default)
+        [
+            ([],                            ''),
+            ([],                            'a'),
+            ([(1, 0, 'd')],                 ''),
+            ([(1, 1, 'd')],                 ''),
+            ([(1, 1, 'd'), (1, 0, None)],   'ab'),
+            ([(1, 2, 'd'), (1, 0, None)],   'aab'),
+            ([(2, 1, 'd'), (1, 1, None)],   'aab'),
+            ([(1, 1, 'd'), (1, 1, 'e')],    'a'),
+        ]
+    )  # yapf: disable
+    def test_defaults(self, variables, values):
+        values = Multiset(values)
+        variables = [VariableWithCount('var{:d}'.format(i), c, m, d) for i, (c, m, d) in enumerate(variables)]
+        expected_count = sum(1 for _ in commutative_sequence_variable_partition_iter(values, variables))
+        assert commutative_sequence_variable_partition_count(values, variables) == expected_count